@@ -1,69 +1,69 @@
 
 import cv2
 import os
-import numpy as np
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from frame_selection import (group_size, adaptive_blur_threshold,
+                             extract_sharp_frames_serial, extract_sharp_frames_streaming,
+                             extract_non_redundant_frames)
+import instrumentation
 
 # --- Configuration ---
 video_path = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SET_2/vids/near_horiz_vid.mp4"
 output_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SET_2/vids/frames"
 os.makedirs(output_dir, exist_ok=True)
 
+# --- Extraction mode ---
+# "serial": decode, score and write every frame on the main thread
+# "streaming": decode thread + scoring pool + writer thread (same selections as "serial")
+# "non_redundant": like "streaming", but also drops frames where the camera barely moved
+extraction_mode = "streaming"
+num_workers = os.cpu_count()
+proxy_scale = 1.0  # < 1.0 ranks frames on a downscaled proxy (faster, may pick another frame of the group)
+
+# --- Redundancy filter ("non_redundant" mode) ---
+motion_metric = "flow"  # "flow" (sparse optical flow) or "hash" (difference hash)
+min_motion = 0.02       # accumulated motion needed to keep a new frame (fraction of image width for "flow")
+target_frames = None    # e.g. 150: spread a fixed budget of frames along the motion instead of using min_motion
+
 # --- Reference resolution and threshold ---
 ref_width, ref_height = 1280, 720
 base_threshold = 100.0  # At 720p
 
+# --- Instrumentation ---
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+instrumentation.start("sharp_frames", trace_dir)
+
 # --- Open video and extract FPS & resolution ---
 cap = cv2.VideoCapture(video_path)
 fps = cap.get(cv2.CAP_PROP_FPS)
 width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
 height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-N = max(1, round(fps * (5 / 30)))  # Spacing group size
+N = group_size(fps)  # Spacing group size
 
 # --- Compute blur threshold scaled to resolution ---
-reference_pixels = ref_width * ref_height
-current_pixels = width * height
-scale = current_pixels / reference_pixels
-adaptive_threshold = base_threshold * scale
+adaptive_threshold = adaptive_blur_threshold(width, height, base_threshold, ref_width, ref_height)
 
 print(f"Video FPS: {fps:.2f}, Resolution: {width}x{height}")
 print(f"Using N = {N}, Adaptive blur threshold = {adaptive_threshold:.2f}")
 
-# --- Helper: Laplacian sharpness score ---
-def laplacian_variance(image):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    return cv2.Laplacian(gray, cv2.CV_64F).var()
-
-# --- Read and process in chunks of N frames ---
-frame_group = []
-frame_index = 0
-saved_count = 0
-
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    frame_group.append((frame, frame_index))
-
-    if len(frame_group) == N:
-        # Pick the sharpest frame in this group
-        scores = [laplacian_variance(f[0]) for f in frame_group]
-        best_idx = int(np.argmax(scores))
-        best_frame, best_frame_index = frame_group[best_idx]
-        best_score = scores[best_idx]
-
-        # Keep only if it's sharp enough
-        if best_score >= adaptive_threshold :
-            filename = f"{output_dir}/frame_{saved_count:04d}_idx{best_frame_index}_score{int(best_score)}.jpg"
-            cv2.imwrite(filename, best_frame)
-            saved_count += 1
-
-        # Clear group for next chunk
-        frame_group = []
-
-    frame_index += 1
+# --- Pick the sharpest frame of every N consecutive frames ---
+if extraction_mode == "streaming":
+    summary = extract_sharp_frames_streaming(cap, output_dir, N, adaptive_threshold,
+                                             proxy_scale=proxy_scale, num_workers=num_workers)
+elif extraction_mode == "non_redundant":
+    summary = extract_non_redundant_frames(cap, output_dir, N, adaptive_threshold,
+                                           min_motion=min_motion, target_frames=target_frames,
+                                           motion_metric=motion_metric, proxy_scale=proxy_scale,
+                                           num_workers=num_workers)
+    print(f"{summary['groups']} groups: {summary['dropped_blurry']} dropped as blurry, "
+          f"{summary['dropped_redundant']} dropped as redundant")
+else:
+    summary = extract_sharp_frames_serial(cap, output_dir, N, adaptive_threshold)
 
 cap.release()
-print(f"Saved {saved_count} sharp frames to {output_dir}")
-
-
+print(f"Read {summary['frames_read']} frames in {summary['elapsed_s']:.1f}s ({summary['fps']:.1f} fps)")
+print(f"Saved {len(summary['saved'])} sharp frames to {output_dir}")
+instrumentation.finish()
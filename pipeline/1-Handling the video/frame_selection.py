@@ -0,0 +1,351 @@
+import os
+import re
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from instrumentation import span, traced, count
+
+
+# --- Helper: Laplacian sharpness score ---
+@traced("sharpness")
+def laplacian_variance(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+# --- Helper: sharpness on a grayscale (optionally downscaled) proxy ---
+# With proxy_scale = 1.0 this is exactly laplacian_variance, so the ranking is unchanged.
+@traced("sharpness")
+def proxy_sharpness(image, proxy_scale=1.0):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if proxy_scale != 1.0:
+        gray = cv2.resize(gray, None, fx=proxy_scale, fy=proxy_scale, interpolation=cv2.INTER_AREA)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+# --- Helper: group size and blur threshold from the video properties ---
+def group_size(fps):
+    return max(1, round(fps * (5 / 30)))
+
+
+def adaptive_blur_threshold(width, height, base_threshold=100.0, ref_width=1280, ref_height=720):
+    scale = (width * height) / (ref_width * ref_height)
+    return base_threshold * scale
+
+
+def frame_filename(output_dir, saved_count, frame_index, score):
+    return f"{output_dir}/frame_{saved_count:04d}_idx{frame_index}_score{int(score)}.jpg"
+
+
+# --- Helper: metadata back from a frame filename ---
+# Anything before "frame_" (e.g. "near_horiz_" when several videos share a folder) is kept as the prefix.
+FRAME_PATTERN = re.compile(r"^(?P<prefix>.*?)frame_(?P<saved>\d+)_idx(?P<index>\d+)_score(?P<score>\d+)\.\w+$")
+
+
+def parse_frame_filename(filename):
+    """(prefix, saved count, source frame index, score) of a frame_filename() name, None for other names."""
+    match = FRAME_PATTERN.match(os.path.basename(filename))
+    if match is None:
+        return None
+    return match["prefix"], int(match["saved"]), int(match["index"]), int(match["score"])
+
+
+@traced("write_jpeg")
+def write_frame(filename, frame):
+    return cv2.imwrite(filename, frame)
+
+
+def _summary(saved, frames_read, elapsed):
+    count("frames_read", frames_read)
+    count("frames_kept", len(saved))
+    return {
+        "saved": saved,
+        "frames_read": frames_read,
+        "elapsed_s": elapsed,
+        "fps": frames_read / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+# --- Serial mode: read and process in chunks of N frames on the main thread ---
+@traced()
+def extract_sharp_frames_serial(cap, output_dir, N, threshold):
+    frame_group = []
+    frame_index = 0
+    saved = []
+    start = time.perf_counter()
+
+    while True:
+        with span("decode"):
+            ret, frame = cap.read()
+        if not ret:
+            break
+
+        frame_group.append((frame, frame_index))
+
+        if len(frame_group) == N:
+            # Pick the sharpest frame in this group
+            scores = [laplacian_variance(f[0]) for f in frame_group]
+            best_idx = int(np.argmax(scores))
+            best_frame, best_frame_index = frame_group[best_idx]
+            best_score = scores[best_idx]
+
+            # Keep only if it's sharp enough
+            if best_score >= threshold:
+                filename = frame_filename(output_dir, len(saved), best_frame_index, best_score)
+                write_frame(filename, best_frame)
+                saved.append((filename, best_frame_index, best_score))
+
+            # Clear group for next chunk
+            frame_group = []
+
+        frame_index += 1
+
+    return _summary(saved, frame_index, time.perf_counter() - start)
+
+
+# --- Decode thread: reads frames and hands them to the main loop through a bounded queue ---
+def _put_until_stopped(frame_queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+# Ends with None, or with the exception raised while decoding (re-raised by the consumer)
+def _decode_frames(cap, frame_queue, stop_event):
+    frame_index = 0
+    end = None
+    try:
+        while not stop_event.is_set():
+            with span("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            _put_until_stopped(frame_queue, (frame_index, frame), stop_event)
+            frame_index += 1
+    except BaseException as e:
+        end = e
+    finally:
+        _put_until_stopped(frame_queue, end, stop_event)
+
+
+def iter_group_winners(cap, N, proxy_scale=1.0, num_workers=None, queue_size=4, stats=None):
+    """
+    Yields (frame_index, frame, score) for the sharpest frame of every complete group of N frames.
+      - a decode thread reads the video while a thread pool scores frames (cv2 releases the GIL)
+      - each scorer keeps its frame only if it beats the running best of its group, so besides the
+        queue_size decoded frames and the frames being scored, only one full frame per open group
+        stays in memory (about queue_size + 2 x num_workers + 2 frames in total)
+      - groups are closed strictly in frame order and ties keep the first frame, so the winners
+        match the serial loop
+    If proxy_scale < 1 the ranking is done on a downscaled proxy and only the winner is
+    re-scored at full resolution. stats["frames_read"] is updated if a dict is given.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    max_inflight = 2 * num_workers
+    stats = stats if stats is not None else {}
+    stats["frames_read"] = 0
+
+    frame_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    decoder = threading.Thread(target=_decode_frames, args=(cap, frame_queue, stop_event), daemon=True)
+
+    # Running best of every open group: {group: (score, frame_index, frame)}
+    best = {}
+    best_lock = threading.Lock()
+
+    def score_frame(frame_index, frame):
+        score = proxy_sharpness(frame, proxy_scale)
+        group = frame_index // N
+        with best_lock:
+            current = best.get(group)
+            # higher score wins, the first frame on ties (like np.argmax)
+            if current is None or (score, -frame_index) > (current[0], -current[1]):
+                best[group] = (score, frame_index, frame)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as scorers:
+        decoder.start()
+        pending = deque()
+        finished = False
+        try:
+            while not finished or pending:
+                # Keep the scoring pool busy up to max_inflight frames
+                while not finished and len(pending) < max_inflight:
+                    item = frame_queue.get()
+                    if item is None:
+                        finished = True
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    frame_index, frame = item
+                    pending.append((frame_index, scorers.submit(score_frame, frame_index, frame)))
+                    del item, frame
+                    stats["frames_read"] += 1
+                if not pending:
+                    continue
+
+                frame_index, future = pending.popleft()
+                future.result()
+                # Last frame of a complete group (a trailing partial group is dropped, as before)
+                if frame_index % N == N - 1:
+                    with best_lock:
+                        best_score, best_frame_index, best_frame = best.pop(frame_index // N)
+                    if proxy_scale != 1.0:
+                        best_score = laplacian_variance(best_frame)
+                    yield best_frame_index, best_frame, best_score
+                    del best_frame
+        finally:
+            stop_event.set()
+            decoder.join()
+
+
+@traced()
+def extract_sharp_frames_streaming(cap, output_dir, N, threshold, proxy_scale=1.0,
+                                   num_workers=None, queue_size=4):
+    """
+    Same selection as the serial loop (sharpest frame of every complete group of N frames,
+    kept if its score >= threshold), computed with iter_group_winners and with the JPEG
+    encoding on a separate writer thread.
+    Returns a summary dict (saved frames, frames read, elapsed time, fps).
+    """
+    saved = []
+    write_futures = []
+    stats = {}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        for frame_index, frame, score in iter_group_winners(cap, N, proxy_scale, num_workers, queue_size, stats):
+            if score >= threshold:
+                filename = frame_filename(output_dir, len(saved), frame_index, score)
+                write_futures.append(writer.submit(write_frame, filename, frame))
+                saved.append((filename, frame_index, score))
+        for future in write_futures:
+            future.result()
+    return _summary(saved, stats["frames_read"], time.perf_counter() - start)
+
+
+# --- Motion estimates between two downscaled grayscale proxies ---
+def motion_proxy(image, proxy_width=320):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    if w > proxy_width:
+        gray = cv2.resize(gray, (proxy_width, max(1, round(h * proxy_width / w))), interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def flow_motion(prev_gray, gray, max_corners=200):
+    """Median sparse optical-flow magnitude, as a fraction of the proxy width (inf if tracking is lost)."""
+    prev_pts = cv2.goodFeaturesToTrack(prev_gray, maxCorners=max_corners, qualityLevel=0.01, minDistance=7)
+    if prev_pts is None or len(prev_pts) < 8:
+        return float("inf")
+    next_pts, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, prev_pts, None)
+    tracked = status.ravel() == 1
+    if tracked.sum() < 0.5 * len(prev_pts):
+        return float("inf")
+    magnitudes = np.linalg.norm((next_pts - prev_pts).reshape(-1, 2)[tracked], axis=1)
+    return float(np.median(magnitudes)) / gray.shape[1]
+
+
+def _dhash(gray):
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return small[:, 1:] > small[:, :-1]
+
+
+def hash_motion(prev_gray, gray):
+    """Normalized Hamming distance between the 64-bit difference hashes of both proxies."""
+    return float(np.count_nonzero(_dhash(prev_gray) != _dhash(gray))) / 64
+
+
+MOTION_METRICS = {"flow": flow_motion, "hash": hash_motion}
+
+
+@traced()
+def extract_non_redundant_frames(cap, output_dir, N, threshold, min_motion=0.02, target_frames=None,
+                                 motion_metric="flow", proxy_width=320, proxy_scale=1.0,
+                                 num_workers=None, queue_size=4):
+    """
+    Same groups and sharpness threshold as the other modes (the Laplacian score still picks the
+    frame inside each group), but a group winner is only kept if the scene moved enough since the
+    last kept frame. Motion is measured between consecutive sharp winners on small grayscale proxies
+    and accumulated, so "motion since the last kept frame" stays a sum of short, trackable steps.
+      - min_motion: accumulated motion needed to keep a new frame (fraction of the image width
+        for "flow", fraction of differing hash bits for "hash")
+      - target_frames: instead of min_motion, spread a budget of frames evenly along the
+        accumulated motion. Needs a second decoding pass to write the chosen frames.
+    Returns a summary dict with the counts of frames dropped as blurry and as redundant.
+    """
+    motion = MOTION_METRICS[motion_metric]
+    stats = {}
+    start = time.perf_counter()
+
+    # Pass 1: sharp group winners and the motion between consecutive winners
+    candidates = []  # (frame_index, score, step_motion)
+    blurry = 0
+    prev_proxy = None
+    accumulated = 0.0
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        write_futures = []
+        saved = []
+        for frame_index, frame, score in iter_group_winners(cap, N, proxy_scale, num_workers, queue_size, stats):
+            if score < threshold:
+                blurry += 1
+                continue
+            with span("motion"):
+                proxy = motion_proxy(frame, proxy_width)
+                step = float("inf") if prev_proxy is None else motion(prev_proxy, proxy)
+            prev_proxy = proxy
+            candidates.append((frame_index, score, step))
+            if target_frames is not None:
+                continue
+
+            accumulated += step
+            if accumulated >= min_motion:
+                filename = frame_filename(output_dir, len(saved), frame_index, score)
+                write_futures.append(writer.submit(write_frame, filename, frame))
+                saved.append((filename, frame_index, score))
+                accumulated = 0.0
+
+        # Pass 2 (frame budget only): pick evenly spaced winners along the accumulated motion,
+        # then decode the video again and write just those frames
+        if target_frames is not None and candidates:
+            steps = np.array([c[2] for c in candidates[1:]], dtype=np.float64)
+            # lost tracking counts as the largest finite step (or 1.0 if all were lost)
+            finite = steps[np.isfinite(steps)]
+            steps[~np.isfinite(steps)] = finite.max() if finite.size else 1.0
+            cumulative = np.concatenate([[0.0], np.cumsum(steps)])
+            marks = np.linspace(0.0, cumulative[-1], num=max(1, target_frames))
+            chosen = np.unique(np.searchsorted(cumulative, marks, side="left"))
+            chosen_indices = {candidates[i][0]: candidates[i][1] for i in chosen}
+
+            if not cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                raise RuntimeError("Cannot rewind the video for the second pass")
+            last_index = max(chosen_indices)
+            for frame_index in range(last_index + 1):
+                with span("decode"):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+                if frame_index in chosen_indices:
+                    score = chosen_indices[frame_index]
+                    filename = frame_filename(output_dir, len(saved), frame_index, score)
+                    write_futures.append(writer.submit(write_frame, filename, frame))
+                    saved.append((filename, frame_index, score))
+
+        for future in write_futures:
+            future.result()
+
+    summary = _summary(saved, stats["frames_read"], time.perf_counter() - start)
+    summary["groups"] = len(candidates) + blurry
+    summary["dropped_blurry"] = blurry
+    summary["dropped_redundant"] = len(candidates) - len(saved)
+    count("frames_dropped_blurry", blurry)
+    count("frames_dropped_redundant", summary["dropped_redundant"])
+    return summary
@@ -0,0 +1,21 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from mask_codec import convert_txt_dir
+import instrumentation
+
+# === CONFIG ===
+# Migrates the legacy per-pixel "x,y" .txt masks written by SAM.py to the compact .msk format
+imgs_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SUNLIGHT/near_vertic_114/imgs/all_imgs"
+masks_txt_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SUNLIGHT/near_vertic_114/masks/masks_txt"
+output_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SUNLIGHT/near_vertic_114/masks/masks_msk"
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+instrumentation.start("convert_masks", trace_dir)
+
+converted, skipped = convert_txt_dir(masks_txt_dir, imgs_dir, output_dir)
+instrumentation.count("mask_files_converted", converted)
+print(f"✅ Converted {converted} mask files to {output_dir} ({skipped} skipped: no image or already converted)")
+instrumentation.finish()
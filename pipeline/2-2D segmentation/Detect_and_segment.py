@@ -0,0 +1,81 @@
+import os
+import sys
+import urllib.request
+from segment_anything import sam_model_registry, SamPredictor
+from GroundingDINO.groundingdino.util.inference import load_model
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from sam_embedding_cache import EmbeddingCache
+from segmentation_pipeline import run_streaming_pipeline
+import instrumentation
+
+############ Initial Config
+# Runs GroundingDino.py + SAM.py in one process: both models loaded once, each image decoded once,
+# boxes passed to SAM in memory (full precision) while the next image is being detected
+config_path = "GroundingDINO/groundingdino/config/GroundingDINO_SwinT_OGC.py"
+weights_path = "GroundingDINO/weights/groundingdino_swint_ogc.pth"
+checkpoint_url = "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth"
+checkpoint_path = "/teamspace/studios/this_studio/segment-anything/weights/sam_vit_b_01ec64.pth"
+model_type = "vit_b"
+images_dir = "imgs"
+masks_dir = "masks"
+debug_bbx_dir = None  # e.g. "bbx/": also write the _detections.txt files
+mask_format = "msk"   # "msk" or "txt" (legacy per-pixel x,y dump)
+embedding_cache_dir = "sam_embeddings"  # None to disable
+embedding_cache_max_gb = 20
+box_chunk_size = 4  # boxes decoded per SAM call (1 = exactly the per-box masks, see segment_boxes)
+roi_mode = False  # segment padded crops around the boxes instead of the full frame (see SAM.py)
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+################## Prompts and thresholds
+prompt = (
+    "orange . yellow ball ."
+    "blue colored ball . purple colored ball ."
+)
+box_threshold = 0.25
+text_threshold = 0.25
+
+instrumentation.start("detect_and_segment", trace_dir)
+
+# === Load both models once (on CPU)
+with instrumentation.span("load_models"):
+    dino_model = load_model(config_path, weights_path).cpu()
+os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+if not os.path.exists(checkpoint_path):
+    print("⬇️ Downloading SAM checkpoint...")
+    urllib.request.urlretrieve(checkpoint_url, checkpoint_path)
+with instrumentation.span("load_models"):
+    sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+sam.to("cpu")
+predictor = SamPredictor(sam)
+cache = None
+if embedding_cache_dir is not None:
+    cache = EmbeddingCache(embedding_cache_dir, model_type, max_bytes=int(embedding_cache_max_gb * 1024**3))
+
+# === Stream every image through detection -> segmentation
+image_files = sorted([f for f in os.listdir(images_dir) if f.lower().endswith((".jpg", ".png", ".jpeg"))])
+report = run_streaming_pipeline(
+    dino_model=dino_model,
+    predictor=predictor,
+    images_dir=images_dir,
+    masks_dir=masks_dir,
+    image_files=image_files,
+    prompt=prompt,
+    box_threshold=box_threshold,
+    text_threshold=text_threshold,
+    cache=cache,
+    box_chunk_size=box_chunk_size,
+    mask_format=mask_format,
+    debug_bbx_dir=debug_bbx_dir,
+    roi_mode=roi_mode,
+)
+
+print(f"⏩ Skipped {report['skipped']} images with existing masks")
+print(f"⏱️ {report['images']} images, {report['masks']} masks in {report['wall']:.1f}s "
+      f"(decode {report['decode']:.1f}s, detection {report['detection']:.1f}s, "
+      f"segmentation {report['segmentation']:.1f}s, write {report['write']:.1f}s)")
+if cache is not None:
+    stats = cache.stats()
+    print(f"🗃️ Embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
+print("✅ All done!")
+instrumentation.finish()
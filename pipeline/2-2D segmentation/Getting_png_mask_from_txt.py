@@ -1,69 +1,30 @@
 import os
-from PIL import Image
-import numpy as np
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from mask_compositing import composite_dir
+import instrumentation
 
 # === CONFIG ===
 imgs_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SUNLIGHT/near_vertic_114/imgs/all_imgs"
 masks_txt_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SUNLIGHT/near_vertic_114/masks/masks_txt"
 output_dir = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SUNLIGHT/near_vertic_114/masks/masks_png"
-
-os.makedirs(output_dir, exist_ok=True)
-
-# Loop over all .txt files in the masks folder
-for mask_filename in os.listdir(masks_txt_dir):
-    if not mask_filename.lower().endswith(".txt"): 
-        continue
-
-    img_id = os.path.splitext(mask_filename)[0] 
-    img_path = os.path.join(imgs_dir, f"{img_id}.jpg").replace("\\", "/")
-    mask_txt_path = os.path.join(masks_txt_dir, mask_filename).replace("\\", "/")
-    output_path = os.path.join(output_dir, f"{img_id}.png").replace("\\", "/")
-
-    # Check if image exists
-    if not os.path.exists(img_path):
+cutouts_dir = None  # e.g. ".../masks/cutouts_png": also save one PNG per fruit, cropped to its bbox
+write_full_frame = True  # False to only write the cutouts
+num_workers = os.cpu_count()  # images are processed in parallel, 1 = serial
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+# Guard needed by the process pool (workers re-import this file on Windows)
+if __name__ == "__main__":
+    instrumentation.start("png_masks", trace_dir)
+    # Every mask file (.msk or legacy .txt) is composited over its .jpg in one array operation:
+    # masked pixels keep their RGB and become fully opaque, the rest stays transparent
+    summary = composite_dir(imgs_dir, masks_txt_dir, output_dir if write_full_frame else None,
+                            cutouts_dir=cutouts_dir, num_workers=num_workers)
+    for mask_filename in summary["missing"]:
         print(f"Image not found for mask {mask_filename}, skipping.")
-        continue
-
-    # Load image and convert to RGBA
-    image = Image.open(img_path).convert("RGBA")
-    image_data = np.array(image)
-    height, width = image.size[1], image.size[0]
-
-    # Create fully transparent output array
-    output_data = np.zeros((height, width, 4), dtype=np.uint8)
-
-    # Read mask txt
-    with open(mask_txt_path, "r") as f:
-        lines = f.readlines()
-
-    coords_started = False
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        if "Mask" in line:
-            coords_started = True
-            continue
-        if coords_started:
-            parts = line.split()
-            for part in parts:
-                if "," in part:
-                    try:
-                        x_str, y_str = part.split(",")
-                        x, y = int(x_str), int(y_str)
-                        if 0 <= x < width and 0 <= y < height:
-                            output_data[y, x] = [
-                                image_data[y, x][0],  # R
-                                image_data[y, x][1],  # G
-                                image_data[y, x][2],  # B
-                                255  # Alpha fully opaque
-                            ]
-                    except ValueError:
-                        continue
-
-    # Save resulting image
-    result_image = Image.fromarray(output_data, "RGBA")
-    result_image.save(output_path)
-    print(f"Saved {output_path}")
-
-print("All done!")
+    print(f"Saved {summary['images']} images ({summary['instances']} masks) to {output_dir} "
+          f"in {summary['elapsed_s']:.1f}s ({summary['images_per_s']:.2f} images/s)")
+    print("All done!")
+    instrumentation.finish()
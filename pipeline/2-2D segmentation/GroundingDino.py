@@ -1,12 +1,12 @@
 
 import os
-import cv2
-import torch
-from datetime import datetime
-import numpy as np
-from PIL import Image, ImageOps
-import torchvision.transforms as T
-from GroundingDINO.groundingdino.util.inference import load_model, predict, annotate
+import sys
+from GroundingDINO.groundingdino.util.inference import load_model
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from detection_runner import run_detection, STAGES
+import instrumentation
 
 
 ############ Initial Config
@@ -23,58 +23,36 @@ prompt = (
 )
 box_threshold = 0.25
 text_threshold = 0.25
+################## Runner
+batch_size = 4             # images per forward pass (1 = the plain per-image predict())
+prefetch_workers = 2       # threads decoding/resizing the next images during inference
+torch_threads = os.cpu_count()  # torch intra-op threads
+resume = True              # skip images whose _detections.txt already exists
+trace_dir = None           # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+instrumentation.start("grounding_dino", trace_dir)
 # Load model once
-model = load_model(config_path, weights_path).cpu()
+with instrumentation.span("load_models"):
+    model = load_model(config_path, weights_path).cpu()
 # Get all images in the folder, sorted
 image_files = sorted([f for f in os.listdir(images_dir) if f.lower().endswith((".jpg", ".png", ".jpeg"))])
-for idx, image_file in enumerate(image_files):
-    
-    now = datetime.now()
-    print("1-Current time:", now.strftime("%H:%M:%S"))
-    image_path = os.path.join(images_dir, image_file)
-    imgName = os.path.splitext(os.path.basename(image_path))[0]
-    # Create txt detection file for that fruit
-    output_txt = os.path.join(output_dir, f"{imgName}_detections.txt")
-    """
-    output_annotated = os.path.join(output_dir, "tree_annotated.jpg")
-    output_masked = os.path.join(output_dir, "tree_masked.jpg")
-    """
-    
 
-    ########### Input Img
-    first_image_cv0 = cv2.imread(image_path)
-    first_image_cv = cv2.cvtColor(first_image_cv0, cv2.COLOR_BGR2RGB)
-    pil_image = Image.fromarray(first_image_cv)
-    pil_image = ImageOps.exif_transpose(pil_image).convert("RGB")
-    original_w, original_h = pil_image.size
-    
-        
-    # Resize to smallest side = 1000
-    min_side = 1000
-    shorter = min(original_w, original_h)
-    scale = min_side / shorter if shorter > min_side else 1.0
-    new_w, new_h = int(original_w * scale), int(original_h * scale)
-    image_resized = pil_image.resize((new_w, new_h), Image.Resampling.BILINEAR)
-    image_tensor = T.ToTensor()(image_resized)
-    
-    ########### Inference
-    boxes, logits, phrases = predict(
-        model=model,
-        image=image_tensor,
-        caption=prompt,
-        box_threshold=box_threshold,
-        text_threshold=text_threshold,
-        device="cpu"
-    )
-    ############### Save results
-    
-    with open(output_txt, "w") as f:
-        for i, (phrase, box) in enumerate(zip(phrases, boxes)):
-            cx, cy, w, h = box.tolist()
-            f.write(f"{i+1}. Label: {phrase}, Box (cxcywh norm): [{cx:.3f}, {cy:.3f}, {w:.3f}, {h:.3f}]\n")
+# Background decoding/resizing, batched forward passes, resume on interrupted runs
+report = run_detection(
+    model=model,
+    images_dir=images_dir,
+    output_dir=output_dir,
+    image_files=image_files,
+    prompt=prompt,
+    box_threshold=box_threshold,
+    text_threshold=text_threshold,
+    batch_size=batch_size,
+    prefetch_workers=prefetch_workers,
+    torch_threads=torch_threads,
+    resume=resume,
+)
 
-    print(f"✅ Processed {image_file}")
-    print(f"📄 Detections: {output_txt}") 
-     
-now = datetime.now()
-print("2-Current time:", now.strftime("%H:%M:%S"))
+print(f"⏩ Skipped {report['skipped']} images with existing detections")
+print(f"⏱️ {report['images']} images in {report['batches']} batches, {report['wall']:.1f}s total")
+for stage in STAGES:
+    print(f"   {stage:<10} {report[stage]:8.2f}s")
+instrumentation.finish()
@@ -1,9 +1,17 @@
 import os
+import sys
 import cv2
 import torch
 import numpy as np
 from segment_anything import sam_model_registry, SamPredictor
 import urllib.request
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from mask_codec import encode_mask, write_encoded_masks, write_masks_txt, MASK_EXT, TXT_EXT
+from sam_embedding_cache import EmbeddingCache
+from sam_inference import segment_boxes, segment_boxes_roi, set_image, read_detections, cxcywh_to_xyxy
+import instrumentation
 # === Configuration ===
 checkpoint_url = "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth"
 checkpoint_path = "/teamspace/studios/this_studio/segment-anything/weights/sam_vit_b_01ec64.pth"
@@ -11,6 +19,15 @@ model_type = "vit_b"
 bbx_dir = "bbx"
 imgs_dir = "imgs"
 masks_dir = "masks"
+mask_format = "msk"  # "msk" (compact run-length binary, see mask_codec.py) or "txt" (legacy per-pixel x,y dump)
+embedding_cache_dir = "sam_embeddings"  # image embeddings reused across runs (None to disable)
+embedding_cache_max_gb = 20
+box_chunk_size = 4  # boxes decoded per SAM call (None = one predict() per box; >1 = same masks up to rare 1-pixel edge flips)
+roi_mode = False  # segment padded crops around the boxes (packed in one mosaic): more SAM pixels per fruit, same speed
+roi_min_resolution_gain = 1.0  # fall back to the full frame unless the mosaic gives more resolution per fruit than this
+roi_compare_full_frame = False  # also run the full frame and report the mask IoU (slower, for evaluation)
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+instrumentation.start("sam", trace_dir)
 # === Step 1: Download SAM checkpoint if not already present
 os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
 if not os.path.exists(checkpoint_path):
@@ -20,6 +37,9 @@ if not os.path.exists(checkpoint_path):
 sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
 sam.to("cpu")
 predictor = SamPredictor(sam)
+cache = None
+if embedding_cache_dir is not None:
+    cache = EmbeddingCache(embedding_cache_dir, model_type, max_bytes=int(embedding_cache_max_gb * 1024**3))
 # === Step 3: Process all detection files
 for filename in os.listdir(bbx_dir):
     if not filename.endswith("_detections.txt"):
@@ -30,7 +50,8 @@ for filename in os.listdir(bbx_dir):
     detection_path = os.path.join(bbx_dir, filename)
     output_dir = masks_dir  # Save txt files directly here
     # Path to save the txt summary with same base name as image
-    summary_path = os.path.join(output_dir, f"{img_id}.txt")
+    mask_ext = MASK_EXT if mask_format == "msk" else TXT_EXT
+    summary_path = os.path.join(output_dir, f"{img_id}{mask_ext}")
     # Skip if summary already exists
     if os.path.exists(summary_path):
         print(f"⏩ Skipping {img_id}: summary file already exists.")
@@ -43,39 +64,45 @@ for filename in os.listdir(bbx_dir):
     image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
     H, W = image_rgb.shape[:2]
     # Read detection file
-    boxes, labels = [], []
-    with open(detection_path, "r") as f:
-        for line in f:
-            if "Box" not in line:
-                continue
-            label_text, box_text = line.strip().split("Box")
-            labels.append(label_text.replace("Label:", "").strip())
-            cx, cy, w, h = map(float, box_text.split("[")[-1].split("]")[0].split(","))
-            x0 = int((cx - w / 2) * W)
-            y0 = int((cy - h / 2) * H)
-            x1 = int((cx + w / 2) * W)
-            y1 = int((cy + h / 2) * H)
-            boxes.append([x0, y0, x1, y1])
-    boxes = np.array(boxes)
-    # Run SAM
-    predictor.set_image(image_rgb)
-    all_masks = np.zeros((H, W), dtype=np.uint8)
+    labels, boxes_cxcywh = read_detections(detection_path)
+    boxes = cxcywh_to_xyxy(boxes_cxcywh, W, H)
     # Create masks folder if needed
     os.makedirs(output_dir, exist_ok=True)
-    # Write summary txt
-    with open(summary_path, "w") as f:
-        f.write(f"Found {len(boxes)} masks\n")
+    # Run SAM (the image encoder only runs on a cache miss) and predict one mask per box, kept run-length encoded
+    if roi_mode:
+        encoded, mask_scores, roi_info = segment_boxes_roi(predictor, image_rgb, boxes, cache=cache,
+                                                           chunk_size=box_chunk_size or 1,
+                                                           min_resolution_gain=roi_min_resolution_gain,
+                                                           compare_full_frame=roi_compare_full_frame)
+        iou_text = f", mask IoU vs full frame {roi_info['mean_iou']:.3f} (min {roi_info['min_iou']:.3f})" if roi_compare_full_frame else ""
+        print(f"🔍 {img_id}: {roi_info['mode']} mode, {roi_info['rois']} ROIs, SAM scale {roi_info['sam_scale']:.3f} "
+              f"(x{roi_info['resolution_gain']:.2f} vs full frame), embedding {roi_info['embedding_s']:.2f}s, "
+              f"masks {roi_info['decode_s']:.2f}s{iou_text}")
+    elif box_chunk_size:
+        set_image(predictor, image_rgb, cache)
+        encoded, mask_scores = segment_boxes(predictor, boxes, chunk_size=box_chunk_size)
+    else:
+        set_image(predictor, image_rgb, cache)
+        encoded, mask_scores = [], []
+        all_masks = np.zeros((H, W), dtype=np.uint8)
         for i, box in enumerate(boxes):
             masks, scores, _ = predictor.predict(box=np.array(box)[None, :], multimask_output=False)
             mask = masks[0].astype(np.uint8)
             all_masks = np.maximum(all_masks, mask)
-            coords = np.column_stack(np.where(mask == 1))
-            f.write(f"\nMask {i} ({labels[i]}): {len(coords)} pixels\n")
-            for y, x in coords:
-                f.write(f"{x},{y} ")
-            f.write("\n")
-    print(f"✅ Processed {img_id}: saved {img_id}.txt with {len(boxes)} masks")
+            encoded.append(encode_mask(mask))
+            mask_scores.append(float(scores[0]))
+    # Write summary file
+    if mask_format == "msk":
+        write_encoded_masks(summary_path, (H, W), encoded, labels, mask_scores)
+    else:
+        write_masks_txt(summary_path, encoded, labels)
+    instrumentation.count("masks_written", len(boxes))
+    print(f"✅ Processed {img_id}: saved {img_id}{mask_ext} with {len(boxes)} masks")
+if cache is not None:
+    stats = cache.stats()
+    print(f"🗃️ Embedding cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions")
 print("✅ All done!")
+instrumentation.finish()
 
 
 
@@ -0,0 +1,151 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import cv2
+import torch
+from PIL import Image, ImageOps
+import torchvision.transforms as T
+from GroundingDINO.groundingdino.util.inference import predict, preprocess_caption
+from GroundingDINO.groundingdino.util.utils import get_phrases_from_posmap
+from instrumentation import traced, count
+
+STAGES = ("decode", "preprocess", "model", "write")
+
+
+def detections_path(output_dir, image_file):
+    imgName = os.path.splitext(os.path.basename(image_file))[0]
+    return os.path.join(output_dir, f"{imgName}_detections.txt")
+
+
+@traced("decode")
+def decode_image(image_path):
+    first_image_cv0 = cv2.imread(image_path)
+    return cv2.cvtColor(first_image_cv0, cv2.COLOR_BGR2RGB)
+
+
+@traced("preprocess")
+def preprocess_rgb(image_rgb, min_side=1000):
+    """Same input as the per-image script: EXIF-transposed RGB, smallest side resized to min_side, ToTensor."""
+    pil_image = Image.fromarray(image_rgb)
+    pil_image = ImageOps.exif_transpose(pil_image).convert("RGB")
+    original_w, original_h = pil_image.size
+    shorter = min(original_w, original_h)
+    scale = min_side / shorter if shorter > min_side else 1.0
+    new_w, new_h = int(original_w * scale), int(original_h * scale)
+    image_resized = pil_image.resize((new_w, new_h), Image.Resampling.BILINEAR)
+    return T.ToTensor()(image_resized)
+
+
+def load_and_preprocess(image_path, min_side=1000):
+    start = time.perf_counter()
+    image_rgb = decode_image(image_path)
+    decoded = time.perf_counter()
+    image_tensor = preprocess_rgb(image_rgb, min_side)
+    done = time.perf_counter()
+    return image_tensor, {"decode": decoded - start, "preprocess": done - decoded}
+
+
+@traced("detection_model")
+def predict_batch(model, images, caption, box_threshold, text_threshold):
+    """
+    predict() for several same-size images in one forward pass.
+    Returns one (boxes, logits, phrases) per image, post-processed exactly like predict().
+    A single image goes through predict() itself.
+    """
+    if len(images) == 1:
+        return [predict(model=model, image=images[0], caption=caption, box_threshold=box_threshold,
+                        text_threshold=text_threshold, device="cpu")]
+
+    caption = preprocess_caption(caption=caption)
+    with torch.no_grad():
+        outputs = model(torch.stack(images), captions=[caption] * len(images))
+    all_logits = outputs["pred_logits"].cpu().sigmoid()  # (B, nq, 256)
+    all_boxes = outputs["pred_boxes"].cpu()  # (B, nq, 4)
+
+    tokenizer = model.tokenizer
+    tokenized = tokenizer(caption)
+    results = []
+    for prediction_logits, prediction_boxes in zip(all_logits, all_boxes):
+        mask = prediction_logits.max(dim=1)[0] > box_threshold
+        logits = prediction_logits[mask]
+        boxes = prediction_boxes[mask]
+        phrases = [
+            get_phrases_from_posmap(logit > text_threshold, tokenized, tokenizer).replace('.', '')
+            for logit in logits
+        ]
+        results.append((boxes, logits.max(dim=1)[0], phrases))
+    return results
+
+
+@traced("write_detections")
+def write_detections(output_txt, phrases, boxes):
+    with open(output_txt, "w") as f:
+        for i, (phrase, box) in enumerate(zip(phrases, boxes)):
+            cx, cy, w, h = box.tolist()
+            f.write(f"{i+1}. Label: {phrase}, Box (cxcywh norm): [{cx:.3f}, {cy:.3f}, {w:.3f}, {h:.3f}]\n")
+
+
+def _prefetch(pool, image_paths, depth):
+    # Keeps `depth` images decoding/resizing in the background, results come back in order
+    paths = iter(image_paths)
+    futures = deque(pool.submit(load_and_preprocess, p) for p in islice(paths, depth))
+    for path in paths:
+        yield futures.popleft().result()
+        futures.append(pool.submit(load_and_preprocess, path))
+    while futures:
+        yield futures.popleft().result()
+
+
+def _batches(image_files, loaded, batch_size):
+    # Consecutive images with the same resized shape share a forward pass (no padding, so no drift)
+    batch = []
+    for image_file, (tensor, timings) in zip(image_files, loaded):
+        if batch and (len(batch) == batch_size or batch[0][1].shape != tensor.shape):
+            yield batch
+            batch = []
+        batch.append((image_file, tensor, timings))
+    if batch:
+        yield batch
+
+
+@traced()
+def run_detection(model, images_dir, output_dir, image_files, prompt, box_threshold, text_threshold,
+                  batch_size=4, prefetch_workers=2, torch_threads=None, resume=True, log=print):
+    """
+    Runs GroundingDINO on image_files with background decoding/preprocessing, batched forward passes
+    and a fixed number of torch intra-op threads. With resume=True, images whose _detections.txt
+    already exists are skipped. Returns per-stage timings (seconds, summed over images) and counts.
+    """
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    os.makedirs(output_dir, exist_ok=True)
+
+    todo = [f for f in image_files if not (resume and os.path.exists(detections_path(output_dir, f)))]
+    report = {stage: 0.0 for stage in STAGES}
+    report.update({"images": len(todo), "skipped": len(image_files) - len(todo), "batches": 0})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=prefetch_workers) as pool:
+        loaded = _prefetch(pool, [os.path.join(images_dir, f) for f in todo], depth=2 * batch_size)
+        for batch in _batches(todo, loaded, batch_size):
+            for _, _, timings in batch:
+                report["decode"] += timings["decode"]
+                report["preprocess"] += timings["preprocess"]
+
+            t0 = time.perf_counter()
+            results = predict_batch(model, [tensor for _, tensor, _ in batch], prompt, box_threshold, text_threshold)
+            t1 = time.perf_counter()
+            for (image_file, _, _), (boxes, logits, phrases) in zip(batch, results):
+                output_txt = detections_path(output_dir, image_file)
+                write_detections(output_txt, phrases, boxes)
+                log(f"✅ Processed {image_file}")
+                log(f"📄 Detections: {output_txt}")
+            report["model"] += t1 - t0
+            report["write"] += time.perf_counter() - t1
+            report["batches"] += 1
+            count("images_detected", len(batch))
+            count("boxes_detected", sum(len(boxes) for boxes, _, _ in results))
+    report["wall"] = time.perf_counter() - start
+    return report
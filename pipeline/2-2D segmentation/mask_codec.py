@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import struct
+import numpy as np
+from instrumentation import traced
+
+############ Compact binary mask format (.msk)
+# b"MSK1" | uint32 header size | JSON header | run data
+# header = {"height": H, "width": W,
+#           "masks": [{"label": str, "score": float or null, "bbox": [x0, y0, x1, y1], "pixels": n, "runs": k}, ...]}
+# Each mask is stored as k (start, length) uint32 pairs, run-length encoded row by row inside its bbox
+# (x1, y1 exclusive), so a 12 MP image with dozens of fruits is a few KB instead of hundreds of MB.
+MAGIC = b"MSK1"
+MASK_EXT = ".msk"
+TXT_EXT = ".txt"
+_TXT_HEADER = re.compile(r"Mask\s+(\d+)\s+\((.*)\):\s*(\d+)\s+pixels")
+_TXT_COORDS = re.compile(r"\s*(?:-?\d+,-?\d+\s+)*(?:-?\d+,-?\d+)?\s*")
+
+
+def _crop_runs(crop):
+    """(start, length) uint32 runs of a mask cropped to its bbox, row by row."""
+    padded = np.concatenate(([False], crop.ravel(), [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1]).reshape(-1, 2)
+    return np.column_stack((edges[:, 0], edges[:, 1] - edges[:, 0])).astype(np.uint32)
+
+
+def encode_mask(mask):
+    """Full-frame boolean mask -> (bbox, runs) with runs a (k, 2) uint32 array of (start, length) in the bbox."""
+    mask = np.asarray(mask, dtype=bool)
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return (0, 0, 0, 0), np.zeros((0, 2), dtype=np.uint32)
+    cols = np.flatnonzero(mask.any(axis=0))
+    x0, y0, x1, y1 = int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+    return (x0, y0, x1, y1), _crop_runs(mask[y0:y1, x0:x1])
+
+
+def encode_mask_stack(masks):
+    """encode_mask for a (K, H, W) stack: the bboxes of all masks are found in one pass, then only the
+    bbox of each mask is run-length encoded."""
+    masks = np.asarray(masks, dtype=bool)
+    rows_any = masks.any(axis=2)  # (K, H)
+    cols_any = masks.any(axis=1)  # (K, W)
+    present = rows_any.any(axis=1)
+    height, width = masks.shape[1:]
+    y0, y1 = rows_any.argmax(axis=1), height - rows_any[:, ::-1].argmax(axis=1)
+    x0, x1 = cols_any.argmax(axis=1), width - cols_any[:, ::-1].argmax(axis=1)
+    encoded = []
+    for i, mask in enumerate(masks):
+        if not present[i]:
+            encoded.append(((0, 0, 0, 0), np.zeros((0, 2), dtype=np.uint32)))
+            continue
+        bbox = int(x0[i]), int(y0[i]), int(x1[i]), int(y1[i])
+        encoded.append((bbox, _crop_runs(mask[bbox[1]:bbox[3], bbox[0]:bbox[2]])))
+    return encoded
+
+
+def encode_mask_crop(crop, bbox):
+    """Same as encode_mask for a mask that is already cropped to its bbox."""
+    if crop.size == 0 or not crop.any():
+        return (0, 0, 0, 0), np.zeros((0, 2), dtype=np.uint32)
+    x0, y0, _, _ = bbox
+    inner_bbox, runs = encode_mask(crop)
+    ix0, iy0, ix1, iy1 = inner_bbox
+    return (x0 + ix0, y0 + iy0, x0 + ix1, y0 + iy1), runs
+
+
+def decode_runs(bbox, runs):
+    """(bbox, runs) -> boolean mask cropped to the bbox."""
+    x0, y0, x1, y1 = bbox
+    h, w = y1 - y0, x1 - x0
+    crop = np.zeros(h * w + 1, dtype=np.int8)
+    if len(runs):
+        # runs are maximal, so starts and ends never collide
+        starts = runs[:, 0].astype(np.int64)
+        crop[starts] = 1
+        crop[starts + runs[:, 1]] = -1
+    return (np.cumsum(crop[:-1]) > 0).reshape(h, w)
+
+
+def encoded_iou(a, b):
+    """IoU of two encoded masks (bbox, runs), computed on the union of their bboxes only."""
+    (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = a[0], b[0]
+    pa, pb = int(a[1][:, 1].sum()) if len(a[1]) else 0, int(b[1][:, 1].sum()) if len(b[1]) else 0
+    if pa == 0 or pb == 0:
+        return 1.0 if pa == pb else 0.0
+    x0, y0, x1, y1 = min(ax0, bx0), min(ay0, by0), max(ax1, bx1), max(ay1, by1)
+    region = np.zeros((2, y1 - y0, x1 - x0), dtype=bool)
+    region[0, ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = decode_runs(a[0], a[1])
+    region[1, by0 - y0:by1 - y0, bx0 - x0:bx1 - x0] = decode_runs(b[0], b[1])
+    intersection = np.count_nonzero(region[0] & region[1])
+    return intersection / (pa + pb - intersection)
+
+
+def paste(crop, bbox, image_shape):
+    """Cropped mask -> full-frame boolean mask of shape (H, W)."""
+    x0, y0, x1, y1 = bbox
+    mask = np.zeros(image_shape[:2], dtype=bool)
+    mask[y0:y1, x0:x1] = crop
+    return mask
+
+
+@traced("write_masks")
+def write_encoded_masks(path, image_shape, encoded, labels, scores=None):
+    """Write already encoded masks [(bbox, runs), ...] to a .msk file."""
+    height, width = image_shape[:2]
+    scores = scores if scores is not None else [None] * len(encoded)
+    header = {"height": int(height), "width": int(width), "masks": []}
+    for (bbox, runs), label, score in zip(encoded, labels, scores):
+        header["masks"].append({
+            "label": label,
+            "score": None if score is None else float(score),
+            "bbox": [int(v) for v in bbox],
+            "pixels": int(runs[:, 1].sum()) if len(runs) else 0,
+            "runs": len(runs),
+        })
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for bbox, runs in encoded:
+            f.write(np.ascontiguousarray(runs, dtype="<u4").tobytes())
+
+
+def write_masks(path, image_shape, masks, labels, scores=None):
+    """Write full-frame boolean masks to a .msk file (masks can be a generator, they are encoded one by one)."""
+    write_encoded_masks(path, image_shape, [encode_mask(m) for m in masks], labels, scores)
+
+
+@traced("write_masks_txt")
+def write_masks_txt(path, encoded, labels):
+    """Legacy per-pixel "x,y " text dump of encoded masks, byte-identical to what SAM.py used to write."""
+    with open(path, "w") as f:
+        f.write(f"Found {len(labels)} masks\n")
+        for i, ((bbox, runs), label) in enumerate(zip(encoded, labels)):
+            ys, xs = np.nonzero(decode_runs(bbox, runs))
+            xs, ys = xs + bbox[0], ys + bbox[1]
+            f.write(f"\nMask {i} ({label}): {len(xs)} pixels\n")
+            f.write("".join(f"{x},{y} " for x, y in zip(xs.tolist(), ys.tolist())))
+            f.write("\n")
+
+
+def _read_msk(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MAGIC:
+        raise ValueError(f"{path} is not a {MASK_EXT} mask file")
+    (header_size,) = struct.unpack_from("<I", data, 4)
+    header = json.loads(data[8:8 + header_size].decode("utf-8"))
+    offset = 8 + header_size
+    instances = []
+    for entry in header["masks"]:
+        count = entry["runs"]
+        runs = np.frombuffer(data, dtype="<u4", count=2 * count, offset=offset).reshape(count, 2)
+        offset += 8 * count
+        bbox = tuple(entry["bbox"])
+        instances.append({"label": entry["label"], "score": entry["score"], "bbox": bbox,
+                          "mask": decode_runs(bbox, runs)})
+    return (header["height"], header["width"]), instances
+
+
+def _parse_coords(tokens):
+    # fast path: every token is "x,y"
+    if _TXT_COORDS.fullmatch(tokens):
+        return np.array(tokens.replace(",", " ").split(), dtype=np.int64).reshape(-1, 2)
+    # slow path: same tolerance as the old converter (ignore malformed tokens)
+    coords = []
+    for part in tokens.split():
+        if "," in part:
+            try:
+                x_str, y_str = part.split(",")
+                coords.append((int(x_str), int(y_str)))
+            except ValueError:
+                continue
+    return np.array(coords, dtype=np.int64).reshape(-1, 2)
+
+
+def _read_txt(path, image_shape):
+    height, width = image_shape[:2]
+    labels, chunks = [], []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if "Mask" in line:
+                match = _TXT_HEADER.search(line)
+                labels.append(match.group(2) if match else "")
+                chunks.append([])
+                continue
+            if chunks:
+                chunks[-1].append(line)
+
+    instances = []
+    for label, lines in zip(labels, chunks):
+        coords = _parse_coords(" ".join(lines))
+        x, y = coords[:, 0], coords[:, 1]
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        x, y = x[inside], y[inside]
+        if x.size == 0:
+            bbox = (0, 0, 0, 0)
+            crop = np.zeros((0, 0), dtype=bool)
+        else:
+            bbox = (int(x.min()), int(y.min()), int(x.max()) + 1, int(y.max()) + 1)
+            crop = np.zeros((bbox[3] - bbox[1], bbox[2] - bbox[0]), dtype=bool)
+            crop[y - bbox[1], x - bbox[0]] = True
+        instances.append({"label": label, "score": None, "bbox": bbox, "mask": crop})
+    return (height, width), instances
+
+
+@traced("read_masks")
+def read_masks(path, image_shape=None, cropped=False):
+    """
+    Read a .msk or legacy .txt mask file.
+    Returns (image_shape, instances), each instance a dict with "label", "score" (None for .txt),
+    "bbox" (x0, y0, x1, y1) and "mask": a full-frame boolean array, or the bbox crop if cropped=True.
+    Legacy .txt files don't store the image size, so image_shape (H, W) is required for them.
+    """
+    if path.lower().endswith(TXT_EXT):
+        if image_shape is None:
+            raise ValueError(f"image_shape is required to read the legacy mask file {path}")
+        shape, instances = _read_txt(path, image_shape)
+    else:
+        shape, instances = _read_msk(path)
+    if not cropped:
+        for instance in instances:
+            instance["mask"] = paste(instance["mask"], instance["bbox"], shape)
+    return shape, instances
+
+
+def mask_path(masks_dir, image_name):
+    """Mask file of an image (.msk first, legacy .txt otherwise), None if there is none."""
+    stem = os.path.join(masks_dir, os.path.splitext(os.path.basename(image_name))[0])
+    for ext in (MASK_EXT, TXT_EXT):
+        if os.path.exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def union_mask(instances, image_shape):
+    """Union of all instances (cropped or full-frame) as one (H, W) boolean mask."""
+    union = np.zeros(image_shape[:2], dtype=bool)
+    for instance in instances:
+        mask = instance["mask"]
+        if mask.shape == union.shape:
+            union |= mask
+        else:
+            x0, y0, x1, y1 = instance["bbox"]
+            union[y0:y1, x0:x1] |= mask
+    return union
+
+
+def convert_txt_dir(masks_txt_dir, imgs_dir, output_dir, overwrite=False):
+    """Migrate a directory of legacy .txt masks to .msk (the image size is read from the matching .jpg)."""
+    from PIL import Image
+
+    os.makedirs(output_dir, exist_ok=True)
+    converted, skipped = 0, 0
+    for mask_filename in sorted(os.listdir(masks_txt_dir)):
+        if not mask_filename.lower().endswith(TXT_EXT):
+            continue
+        img_id = os.path.splitext(mask_filename)[0]
+        img_path = os.path.join(imgs_dir, f"{img_id}.jpg")
+        out_path = os.path.join(output_dir, f"{img_id}{MASK_EXT}")
+        if not os.path.exists(img_path) or (os.path.exists(out_path) and not overwrite):
+            skipped += 1
+            continue
+        with Image.open(img_path) as image:
+            width, height = image.size
+        shape, instances = read_masks(os.path.join(masks_txt_dir, mask_filename), (height, width), cropped=True)
+        encoded = [encode_mask_crop(inst["mask"], inst["bbox"]) for inst in instances]
+        write_encoded_masks(out_path, shape, encoded, [inst["label"] for inst in instances],
+                            [inst["score"] for inst in instances])
+        converted += 1
+    return converted, skipped
@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from instrumentation import count
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of SAM image embeddings, keyed by image content and model type.
+    set_image() is a drop-in for predictor.set_image(): on a hit the ViT encoder is skipped and the
+    predictor gets the stored features (memory-mapped .npy), so only the mask decoder runs.
+    Entries are evicted least-recently-used first once the cache is over max_bytes.
+    """
+
+    def __init__(self, cache_dir, model_type, max_bytes=20 * 1024**3):
+        self.cache_dir = cache_dir
+        self.model_type = model_type
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, image_rgb):
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{self.model_type}|{image_rgb.shape}|{image_rgb.dtype}|".encode())
+        h.update(np.ascontiguousarray(image_rgb).data)
+        return h.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".npy", base + ".json"
+
+    def set_image(self, predictor, image_rgb):
+        key = self.key(image_rgb)
+        features_path, meta_path = self._paths(key)
+        if os.path.exists(features_path) and os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            # copy-on-write mapping: the file is never modified, torch gets a writable array
+            features = np.load(features_path, mmap_mode="c")
+            predictor.reset_image()
+            predictor.original_size = tuple(meta["original_size"])
+            predictor.input_size = tuple(meta["input_size"])
+            predictor.features = torch.from_numpy(features).to(predictor.device)
+            predictor.is_image_set = True
+            os.utime(features_path)  # mtime = last use, for LRU eviction
+            self.hits += 1
+            count("sam_cache_hits")
+            return True
+
+        predictor.set_image(image_rgb)
+        self.misses += 1
+        count("sam_cache_misses")
+        self._store(key, predictor)
+        return False
+
+    def _store(self, key, predictor):
+        features_path, meta_path = self._paths(key)
+        features = predictor.features.detach().cpu().numpy()
+        # write to temporary files then rename, so an interrupted run never leaves a broken entry
+        with open(features_path + ".tmp", "wb") as f:
+            np.save(f, features)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"model_type": self.model_type,
+                       "original_size": list(predictor.original_size),
+                       "input_size": list(predictor.input_size)}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        os.replace(features_path + ".tmp", features_path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for p in (path, path[:-len(".npy")] + ".json"):
+                if os.path.exists(p):
+                    os.remove(p)
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,192 @@
+import time
+import numpy as np
+import torch
+from mask_codec import encode_mask_stack, encode_mask_crop, decode_runs, encoded_iou
+from instrumentation import traced
+
+
+def read_detections(detection_path):
+    """Parse a GroundingDino.py _detections.txt: labels and (N, 4) normalized cxcywh boxes."""
+    labels, boxes = [], []
+    with open(detection_path, "r") as f:
+        for line in f:
+            if "Box" not in line:
+                continue
+            label_text, box_text = line.strip().split("Box")
+            labels.append(label_text.replace("Label:", "").strip())
+            boxes.append(list(map(float, box_text.split("[")[-1].split("]")[0].split(","))))
+    return labels, np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def detection_label(i, phrase):
+    """The label SAM.py reads back from line i of a _detections.txt, without going through the file."""
+    return f"{i+1}. Label: {phrase},".replace("Label:", "").strip()
+
+
+def cxcywh_to_xyxy(boxes, W, H):
+    """Normalized (cx, cy, w, h) -> integer pixel (x0, y0, x1, y1), truncated like int()."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    cx, cy, w, h = boxes.T
+    xyxy = np.column_stack(((cx - w / 2) * W, (cy - h / 2) * H, (cx + w / 2) * W, (cy + h / 2) * H))
+    return np.trunc(xyxy).astype(np.int64)
+
+
+@traced("sam_masks")
+def segment_boxes(predictor, boxes, chunk_size=4):
+    """
+    One mask per box, like calling predictor.predict(box=box[None, :], multimask_output=False) per box,
+    but every chunk of boxes goes through the prompt encoder and mask decoder in a single call.
+    The batched kernels round differently, so the output is identical to the per-box calls only up to
+    float rounding: scores differ by about 1e-7 and a mask can gain or lose a pixel on its edge where the
+    logit is near 0. chunk_size=1 gives the per-box results exactly.
+    chunk_size caps memory: each chunk holds chunk_size full-resolution masks.
+    Returns (encoded, scores): run-length encoded masks (see mask_codec.py) and their predicted IoU.
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    encoded, scores = [], []
+    for start in range(0, len(boxes), chunk_size):
+        chunk = predictor.transform.apply_boxes(boxes[start:start + chunk_size], predictor.original_size)
+        box_torch = torch.as_tensor(chunk, dtype=torch.float, device=predictor.device)
+        masks, iou_predictions, _ = predictor.predict_torch(
+            point_coords=None,
+            point_labels=None,
+            boxes=box_torch,
+            multimask_output=False,
+        )
+        encoded.extend(encode_mask_stack(masks[:, 0].cpu().numpy()))
+        scores.extend(iou_predictions[:, 0].cpu().numpy().tolist())
+    return encoded, scores
+
+
+@traced("sam_embedding")
+def set_image(predictor, image_rgb, cache=None):
+    if cache is not None:
+        cache.set_image(predictor, image_rgb)
+    else:
+        predictor.set_image(image_rgb)
+
+
+def group_boxes(boxes, W, H, pad_ratio=0.25, min_pad=16):
+    """
+    Pads every box by max(min_pad, pad_ratio * its longest side) and merges overlapping padded boxes.
+    Returns the ROIs (x0, y0, x1, y1) clipped to the image and the ROI index of every box.
+    """
+    rois, members = [], []
+    for i, (x0, y0, x1, y1) in enumerate(np.asarray(boxes).reshape(-1, 4).tolist()):
+        pad = max(min_pad, pad_ratio * max(x1 - x0, y1 - y0))
+        rois.append([max(0, x0 - pad), max(0, y0 - pad), min(W, x1 + pad), min(H, y1 + pad)])
+        members.append([i])
+
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(rois)):
+            for b in range(a + 1, len(rois)):
+                ra, rb = rois[a], rois[b]
+                if ra[0] < rb[2] and rb[0] < ra[2] and ra[1] < rb[3] and rb[1] < ra[3]:
+                    rois[a] = [min(ra[0], rb[0]), min(ra[1], rb[1]), max(ra[2], rb[2]), max(ra[3], rb[3])]
+                    members[a] += members.pop(b)
+                    rois.pop(b)
+                    merged = True
+                    break
+            if merged:
+                break
+
+    roi_of_box = np.zeros(sum(len(m) for m in members), dtype=np.int64)
+    for r, m in enumerate(members):
+        roi_of_box[m] = r
+    rois = [(int(np.floor(x0)), int(np.floor(y0)), int(np.ceil(x1)), int(np.ceil(y1))) for x0, y0, x1, y1 in rois]
+    return rois, roi_of_box
+
+
+def pack_rois(rois, gap=8):
+    """Shelf-packs ROIs into one mosaic. Returns the top-left corner of each ROI in the mosaic and the mosaic size."""
+    sizes = [(x1 - x0, y1 - y0) for x0, y0, x1, y1 in rois]
+    total_area = sum((w + gap) * (h + gap) for w, h in sizes)
+    canvas_w = max(max(w for w, _ in sizes), int(np.ceil(np.sqrt(total_area))))
+    order = sorted(range(len(rois)), key=lambda r: -sizes[r][1])
+
+    origins = [None] * len(rois)
+    x, y, shelf_h, used_w = 0, 0, 0, 0
+    for r in order:
+        w, h = sizes[r]
+        if x > 0 and x + w > canvas_w:
+            x, y, shelf_h = 0, y + shelf_h + gap, 0
+        origins[r] = (x, y)
+        used_w = max(used_w, x + w)
+        x += w + gap
+        shelf_h = max(shelf_h, h)
+    return origins, (y + shelf_h, used_w)
+
+
+@traced("sam_roi")
+def segment_boxes_roi(predictor, image_rgb, boxes, cache=None, chunk_size=4, pad_ratio=0.25, min_pad=16,
+                      gap=8, min_resolution_gain=1.0, compare_full_frame=False):
+    """
+    ROI-cropped version of set_image + segment_boxes, an accuracy knob for high-resolution frames with
+    few, small fruits (not a speed-up: SAM resizes any input to 1024 px on its long side, so the encoder
+    costs the same). Nearby boxes are grouped into padded ROIs and the ROIs are packed into one mosaic,
+    so each fruit gets max(H, W) / max(mosaic) times more encoder pixels per side than in the full frame.
+    Masks are clipped to their ROI and pasted back in full-frame coordinates.
+    Falls back to the full frame when the mosaic would not gain more than min_resolution_gain.
+    Returns (encoded, scores, info): info has the mode, number of ROIs, the SAM input scale (encoder pixels
+    per image pixel, above 1 the crops are only upsampled) of the full frame and of what was encoded, the
+    resolution gain, the embedding and mask-decoding times, and with compare_full_frame=True the mean/min
+    mask IoU against the full-frame masks.
+    """
+    H, W = image_rgb.shape[:2]
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    input_size = predictor.model.image_encoder.img_size
+    full_scale = input_size / max(H, W)
+    info = {"mode": "full", "rois": 0, "sam_scale_full": full_scale, "sam_scale": full_scale,
+            "resolution_gain": 1.0}
+
+    mosaic = None
+    if len(boxes):
+        rois, roi_of_box = group_boxes(boxes, W, H, pad_ratio, min_pad)
+        origins, (mosaic_h, mosaic_w) = pack_rois(rois, gap)
+        gain = max(H, W) / max(mosaic_h, mosaic_w)
+        if gain > min_resolution_gain:
+            mosaic = np.zeros((mosaic_h, mosaic_w, 3), dtype=image_rgb.dtype)
+            for (x0, y0, x1, y1), (mx, my) in zip(rois, origins):
+                mosaic[my:my + y1 - y0, mx:mx + x1 - x0] = image_rgb[y0:y1, x0:x1]
+            info.update(mode="roi", rois=len(rois), sam_scale=input_size / max(mosaic_h, mosaic_w),
+                        resolution_gain=gain)
+
+    if mosaic is None:
+        t0 = time.perf_counter()
+        set_image(predictor, image_rgb, cache)
+        t1 = time.perf_counter()
+        encoded, scores = segment_boxes(predictor, boxes, chunk_size)
+        info.update(embedding_s=t1 - t0, decode_s=time.perf_counter() - t1)
+        if compare_full_frame:
+            info.update(mean_iou=1.0, min_iou=1.0)
+        return encoded, scores, info
+
+    # box i lives in ROI r: shift it from the frame to the mosaic
+    shift = np.array([(mx - x0, my - y0) for (x0, y0, _, _), (mx, my) in zip(rois, origins)])[roi_of_box]
+    t0 = time.perf_counter()
+    set_image(predictor, mosaic, cache)
+    t1 = time.perf_counter()
+    mosaic_encoded, scores = segment_boxes(predictor, boxes + np.tile(shift, 2), chunk_size)
+
+    encoded = []
+    for i, (bbox, runs) in enumerate(mosaic_encoded):
+        x0, y0, x1, y1 = rois[roi_of_box[i]]
+        mx, my = origins[roi_of_box[i]]
+        # keep the part of the mask inside its own tile, in full-frame coordinates
+        tile = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        bx0, by0, bx1, by1 = bbox
+        cx0, cy0, cx1, cy1 = max(bx0, mx), max(by0, my), min(bx1, mx + x1 - x0), min(by1, my + y1 - y0)
+        if cx0 < cx1 and cy0 < cy1:
+            crop = decode_runs(bbox, runs)
+            tile[cy0 - my:cy1 - my, cx0 - mx:cx1 - mx] = crop[cy0 - by0:cy1 - by0, cx0 - bx0:cx1 - bx0]
+        encoded.append(encode_mask_crop(tile, (x0, y0, x1, y1)))
+    info.update(embedding_s=t1 - t0, decode_s=time.perf_counter() - t1)
+
+    if compare_full_frame:
+        set_image(predictor, image_rgb, cache)
+        full_encoded, _ = segment_boxes(predictor, boxes, chunk_size)
+        ious = [encoded_iou(a, b) for a, b in zip(encoded, full_encoded)]
+        info.update(mean_iou=float(np.mean(ious)), min_iou=float(np.min(ious)))
+    return encoded, scores, info
@@ -0,0 +1,120 @@
+import os
+import queue
+import threading
+import time
+from detection_runner import decode_image, preprocess_rgb, predict_batch, write_detections, detections_path
+from mask_codec import write_encoded_masks, write_masks_txt, MASK_EXT, TXT_EXT
+from sam_inference import segment_boxes, segment_boxes_roi, set_image, detection_label, cxcywh_to_xyxy
+from instrumentation import traced, count
+
+_DONE = object()
+
+
+def _put_until_stopped(out_queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _detect(dino_model, jobs, prompt, box_threshold, text_threshold, debug_bbx_dir, out_queue, stop_event, report):
+    # Detection thread: decode each image once, run GroundingDINO, hand over the image and full-precision boxes
+    try:
+        for image_file, image_path in jobs:
+            if stop_event.is_set():
+                break
+            t0 = time.perf_counter()
+            image_rgb = decode_image(image_path)
+            t1 = time.perf_counter()
+            [(boxes, logits, phrases)] = predict_batch(dino_model, [preprocess_rgb(image_rgb)], prompt,
+                                                       box_threshold, text_threshold)
+            t2 = time.perf_counter()
+            if debug_bbx_dir is not None:
+                write_detections(detections_path(debug_bbx_dir, image_file), phrases, boxes)
+            report["decode"] += t1 - t0
+            report["detection"] += t2 - t1
+            labels = [detection_label(i, phrase) for i, phrase in enumerate(phrases)]
+            _put_until_stopped(out_queue, (image_file, image_rgb, boxes.numpy(), labels), stop_event)
+    except BaseException as e:
+        _put_until_stopped(out_queue, e, stop_event)
+        return
+    _put_until_stopped(out_queue, _DONE, stop_event)
+
+
+@traced()
+def run_streaming_pipeline(dino_model, predictor, images_dir, masks_dir, image_files, prompt,
+                           box_threshold, text_threshold, cache=None, box_chunk_size=4,
+                           mask_format="msk", queue_size=2, debug_bbx_dir=None, resume=True,
+                           roi_mode=False, roi_min_resolution_gain=1.0, log=print):
+    """
+    GroundingDINO -> SAM in one process, without intermediate text files:
+      - each image is decoded once and both models are loaded once (by the caller)
+      - a detection thread feeds a bounded queue, so detecting image i+1 overlaps segmenting image i
+      - boxes go straight to SAM as float arrays (no 3-decimal round trip through _detections.txt)
+      - debug_bbx_dir optionally still writes the _detections.txt files
+      - roi_mode segments padded crops around the boxes instead of the full frame, for more resolution
+        per fruit (see segment_boxes_roi)
+    With resume=True images whose mask file already exists are skipped. Returns counts and timings.
+    """
+    mask_ext = MASK_EXT if mask_format == "msk" else TXT_EXT
+    os.makedirs(masks_dir, exist_ok=True)
+    if debug_bbx_dir is not None:
+        os.makedirs(debug_bbx_dir, exist_ok=True)
+
+    jobs = []
+    for image_file in image_files:
+        img_id = os.path.splitext(image_file)[0]
+        if resume and os.path.exists(os.path.join(masks_dir, f"{img_id}{mask_ext}")):
+            continue
+        jobs.append((image_file, os.path.join(images_dir, image_file)))
+
+    report = {"images": len(jobs), "skipped": len(image_files) - len(jobs), "masks": 0,
+              "decode": 0.0, "detection": 0.0, "segmentation": 0.0, "write": 0.0}
+    detections = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    detector = threading.Thread(target=_detect, daemon=True,
+                                args=(dino_model, jobs, prompt, box_threshold, text_threshold,
+                                      debug_bbx_dir, detections, stop_event, report))
+
+    start = time.perf_counter()
+    detector.start()
+    try:
+        while True:
+            item = detections.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            image_file, image_rgb, boxes_cxcywh, labels = item
+            img_id = os.path.splitext(image_file)[0]
+            H, W = image_rgb.shape[:2]
+
+            t0 = time.perf_counter()
+            boxes = cxcywh_to_xyxy(boxes_cxcywh, W, H)
+            if roi_mode:
+                encoded, scores, _ = segment_boxes_roi(predictor, image_rgb, boxes, cache=cache,
+                                                       chunk_size=box_chunk_size,
+                                                       min_resolution_gain=roi_min_resolution_gain)
+            else:
+                set_image(predictor, image_rgb, cache)
+                encoded, scores = segment_boxes(predictor, boxes, chunk_size=box_chunk_size)
+            t1 = time.perf_counter()
+
+            summary_path = os.path.join(masks_dir, f"{img_id}{mask_ext}")
+            if mask_format == "msk":
+                write_encoded_masks(summary_path, (H, W), encoded, labels, scores)
+            else:
+                write_masks_txt(summary_path, encoded, labels)
+            report["segmentation"] += t1 - t0
+            report["write"] += time.perf_counter() - t1
+            report["masks"] += len(encoded)
+            count("images_segmented")
+            count("masks_written", len(encoded))
+            log(f"✅ Processed {img_id}: saved {img_id}{mask_ext} with {len(encoded)} masks")
+    finally:
+        stop_event.set()
+        detector.join()
+    report["wall"] = time.perf_counter() - start
+    return report
@@ -0,0 +1,29 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from pair_generation import generate_pairs
+import instrumentation
+
+# === CONFIGURATION ===
+# Pair list for "colmap matches_importer --match_type pairs" (see 1-Structure-from-motion (commands).txt)
+images_dir = "C:/Users/HP/Desktop/colmap_test/images"  # frames of every pass (sub-folders or prefixes per video)
+output_path = "C:/Users/HP/Desktop/colmap_test/pairs.txt"
+
+window = 10              # every frame is matched with the next `window` frames of its video
+quadratic = True         # + frames 1, 2, 4, 8, ... apart in the same video (loops within a pass)
+cross_per_image = 3      # most similar frames of the other videos matched with every frame (0 = none)
+min_similarity = 0.5     # cosine similarity of the global descriptors needed for a cross-video pair
+trace_dir = None         # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+instrumentation.start("generate_pairs", trace_dir)
+report = generate_pairs(images_dir, output_path, window=window, quadratic=quadratic, cross_per_image=cross_per_image,
+                        min_similarity=min_similarity)
+print(f"🎞️ Videos: {', '.join(f'{n} frames' for n in report['videos'])}")
+print(f"🔗 {report['temporal_pairs']:,} temporal + {report['cross_video_pairs']:,} cross-video pairs = "
+      f"{report['pairs']:,} (exhaustive matching: {report['exhaustive_pairs']:,}, "
+      f"{report['exhaustive_pairs'] / max(report['pairs'], 1):.0f}x more)")
+print(f"⏱️ {report['seconds']:.1f}s")
+print(f"✅ Pairs saved to: {output_path}")
+instrumentation.finish()
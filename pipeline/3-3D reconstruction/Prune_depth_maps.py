@@ -0,0 +1,30 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from depth_pruning import prune_workspace
+import instrumentation
+
+# === CONFIGURATION ===
+# Run between "colmap patch_match_stereo" and "colmap stereo_fusion" (see 2-Patch-match-mvs (commands).txt)
+dense_dir = "C:/Users/HP/Desktop/colmap_test/dense"    # --workspace_path of patch_match_stereo
+masks_dir = "C:/Users/HP/Desktop/colmap_test/masks"    # stage-2 masks (.msk or legacy .txt), one file per frame
+sparse_dir = "C:/Users/HP/Desktop/colmap_test/sparse/0"  # original model, None = resize the masks instead
+dilation_px = 5             # margin kept around the fruits, in depth-map pixels
+input_types = ("geometric", "photometric")  # the type given to stereo_fusion --input_type first
+dry_run = False             # only count the depths that would be removed
+trace_dir = None            # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+instrumentation.start("prune_depth_maps", trace_dir)
+report = prune_workspace(dense_dir, masks_dir, sparse_dir=sparse_dir, dilation_px=dilation_px,
+                         input_types=input_types, dry_run=dry_run)
+fused_type = input_types[0]
+valid, removed = report[f"{fused_type}_valid"], report[f"{fused_type}_removed"]
+print(f"🗺️ {report['depth_maps']} depth maps of {report['images']} images")
+if report["images_without_masks"]:
+    print(f"⚠️ No masks for: {', '.join(report['images_without_masks'])}")
+print(f"✂️ stereo_fusion avoids {removed:,} of {valid:,} candidate pixels ({100 * removed / max(valid, 1):.1f}%)"
+      f"{' (dry run, nothing written)' if dry_run else ''}")
+print(f"⏱️ {report['seconds']:.1f}s")
+instrumentation.finish()
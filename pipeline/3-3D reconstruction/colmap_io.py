@@ -0,0 +1,218 @@
+import os
+import struct
+import numpy as np
+
+############ COLMAP workspace I/O with NumPy only (no COLMAP / pycolmap needed)
+# - depth / normal maps of patch_match_stereo (dense/stereo/{depth,normal}_maps/<image>.<type>.bin):
+#   ASCII header "width&height&channels&" followed by float32 data, column-major (x fastest), one plane per channel
+# - sparse models (cameras + images) in binary (cameras.bin, images.bin) or text (cameras.txt, images.txt) form
+# - the camera models COLMAP uses (pinhole, radial, OpenCV, fisheye), to project 3D points or map undistorted
+#   pixels to the original images
+# Cameras and images are dicts:
+#   camera = {"id", "model", "width", "height", "params": float64 array}
+#   image = {"id", "qvec": (w, x, y, z) world->camera, "tvec", "camera_id", "name"}
+CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3), 1: ("PINHOLE", 4), 2: ("SIMPLE_RADIAL", 4), 3: ("RADIAL", 5),
+    4: ("OPENCV", 8), 5: ("OPENCV_FISHEYE", 8), 6: ("FULL_OPENCV", 12), 7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4), 9: ("RADIAL_FISHEYE", 5), 10: ("THIN_PRISM_FISHEYE", 12),
+}
+_SINGLE_FOCAL = {"SIMPLE_PINHOLE", "SIMPLE_RADIAL", "RADIAL", "SIMPLE_RADIAL_FISHEYE", "RADIAL_FISHEYE"}
+
+
+# === Depth / normal maps ===
+def read_array(path):
+    """COLMAP .bin depth (H, W) or normal (H, W, 3) map as float32."""
+    with open(path, "rb") as f:
+        header = b""
+        while header.count(b"&") < 3:
+            byte = f.read(1)
+            if not byte:
+                raise ValueError(f"{path}: truncated COLMAP array header")
+            header += byte
+        width, height, channels = (int(v) for v in header.decode("ascii").split("&")[:3])
+        data = np.fromfile(f, dtype="<f4", count=width * height * channels)
+    if data.size != width * height * channels:
+        raise ValueError(f"{path}: expected {width}x{height}x{channels} values, found {data.size}")
+    array = data.reshape(channels, height, width)
+    return array[0] if channels == 1 else np.ascontiguousarray(array.transpose(1, 2, 0))
+
+
+def read_array_shape(path):
+    """(H, W) of a COLMAP array from its header only."""
+    with open(path, "rb") as f:
+        header = f.read(64).split(b"&")
+    return int(header[1]), int(header[0])
+
+
+def write_array(path, array):
+    """Inverse of read_array (written to a temporary file first, so a crash never leaves a half-written map)."""
+    array = np.asarray(array, dtype="<f4")
+    planes = array[None] if array.ndim == 2 else array.transpose(2, 0, 1)
+    channels, height, width = planes.shape
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(f"{width}&{height}&{channels}&".encode("ascii"))
+        f.write(np.ascontiguousarray(planes).tobytes())
+    os.replace(tmp_path, path)
+
+
+# === Sparse models ===
+def _read_cameras_bin(path):
+    cameras = {}
+    with open(path, "rb") as f:
+        (num_cameras,) = struct.unpack("<Q", f.read(8))
+        for _ in range(num_cameras):
+            camera_id, model_id, width, height = struct.unpack("<iiQQ", f.read(24))
+            model, num_params = CAMERA_MODELS[model_id]
+            params = np.frombuffer(f.read(8 * num_params), dtype="<f8").astype(np.float64)
+            cameras[camera_id] = {"id": camera_id, "model": model, "width": width, "height": height, "params": params}
+    return cameras
+
+
+def _read_images_bin(path):
+    images = {}
+    with open(path, "rb") as f:
+        (num_images,) = struct.unpack("<Q", f.read(8))
+        for _ in range(num_images):
+            values = struct.unpack("<i7di", f.read(64))
+            name = b""
+            while True:
+                byte = f.read(1)
+                if byte in (b"\x00", b""):
+                    break
+                name += byte
+            (num_points,) = struct.unpack("<Q", f.read(8))
+            f.seek(24 * num_points, os.SEEK_CUR)  # (x, y, point3D_id) per keypoint, not needed here
+            images[values[0]] = {"id": values[0], "qvec": np.array(values[1:5]), "tvec": np.array(values[5:8]),
+                                 "camera_id": values[8], "name": name.decode("utf-8")}
+    return images
+
+
+def _data_lines(path):
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def _read_cameras_txt(path):
+    cameras = {}
+    for line in _data_lines(path):
+        words = line.split()
+        camera_id = int(words[0])
+        cameras[camera_id] = {"id": camera_id, "model": words[1], "width": int(words[2]), "height": int(words[3]),
+                              "params": np.array(words[4:], dtype=np.float64)}
+    return cameras
+
+
+def _read_images_txt(path):
+    images = {}
+    with open(path, "r") as f:
+        lines = [line.rstrip("\n") for line in f if not line.startswith("#")]
+    # two lines per image: the pose, then its keypoints (possibly an empty line)
+    for pose in lines[0::2]:
+        words = pose.split(None, 9)
+        if len(words) < 10:
+            continue
+        image_id = int(words[0])
+        images[image_id] = {"id": image_id, "qvec": np.array(words[1:5], dtype=np.float64),
+                            "tvec": np.array(words[5:8], dtype=np.float64), "camera_id": int(words[8]),
+                            "name": words[9].strip()}
+    return images
+
+
+def read_model(model_dir):
+    """(cameras, images) of a sparse model folder (e.g. sparse/0 or dense/sparse), binary files first."""
+    if os.path.exists(os.path.join(model_dir, "cameras.bin")):
+        return (_read_cameras_bin(os.path.join(model_dir, "cameras.bin")),
+                _read_images_bin(os.path.join(model_dir, "images.bin")))
+    if os.path.exists(os.path.join(model_dir, "cameras.txt")):
+        return (_read_cameras_txt(os.path.join(model_dir, "cameras.txt")),
+                _read_images_txt(os.path.join(model_dir, "images.txt")))
+    raise FileNotFoundError(f"No COLMAP model (cameras.bin / cameras.txt) in {model_dir}")
+
+
+# === Geometry ===
+def rotation_matrix(qvec):
+    """World->camera rotation of a COLMAP quaternion (w, x, y, z)."""
+    w, x, y, z = np.asarray(qvec, dtype=np.float64) / np.linalg.norm(qvec)
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)],
+        [2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+        [2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)],
+    ])
+
+
+def camera_center(image):
+    """Position of the camera in world coordinates."""
+    return -rotation_matrix(image["qvec"]).T @ image["tvec"]
+
+
+def _intrinsics(camera):
+    p = camera["params"]
+    if camera["model"] in _SINGLE_FOCAL:
+        return p[0], p[0], p[1], p[2], p[3:]
+    return p[0], p[1], p[2], p[3], p[4:]
+
+
+def distort(camera, u, v):
+    """Applies the lens distortion of camera to normalized coordinates (u, v) = (X / Z, Y / Z)."""
+    model = camera["model"]
+    _, _, _, _, k = _intrinsics(camera)
+    if model in ("SIMPLE_PINHOLE", "PINHOLE"):
+        return u, v
+    r2 = u * u + v * v
+    if model == "SIMPLE_RADIAL":
+        radial = 1 + k[0] * r2
+        return u * radial, v * radial
+    if model == "RADIAL":
+        radial = 1 + k[0] * r2 + k[1] * r2 * r2
+        return u * radial, v * radial
+    if model in ("OPENCV", "FULL_OPENCV"):
+        if model == "OPENCV":
+            radial = 1 + k[0] * r2 + k[1] * r2 * r2
+        else:
+            radial = ((1 + k[0] * r2 + k[1] * r2**2 + k[4] * r2**3) /
+                      (1 + k[5] * r2 + k[6] * r2**2 + k[7] * r2**3))
+        uv = u * v
+        return (u * radial + 2 * k[2] * uv + k[3] * (r2 + 2 * u * u),
+                v * radial + 2 * k[3] * uv + k[2] * (r2 + 2 * v * v))
+    if model in ("OPENCV_FISHEYE", "SIMPLE_RADIAL_FISHEYE", "RADIAL_FISHEYE"):
+        r = np.sqrt(r2)
+        theta = np.arctan(r)
+        t2 = theta * theta
+        if model == "OPENCV_FISHEYE":
+            theta_d = theta * (1 + k[0] * t2 + k[1] * t2**2 + k[2] * t2**3 + k[3] * t2**4)
+        elif model == "SIMPLE_RADIAL_FISHEYE":
+            theta_d = theta * (1 + k[0] * t2)
+        else:
+            theta_d = theta * (1 + k[0] * t2 + k[1] * t2**2)
+        scale = np.divide(theta_d, r, out=np.ones_like(r), where=r > 1e-12)
+        return u * scale, v * scale
+    raise ValueError(f"Unsupported COLMAP camera model: {model}")
+
+
+def project_normalized(camera, u, v):
+    """Normalized coordinates -> pixel coordinates (COLMAP convention: pixel centers at +0.5)."""
+    fx, fy, cx, cy, _ = _intrinsics(camera)
+    du, dv = distort(camera, u, v)
+    return fx * du + cx, fy * dv + cy
+
+
+def unproject_pinhole(camera, x, y):
+    """Pixel coordinates of an undistorted (pinhole) camera -> normalized coordinates."""
+    fx, fy, cx, cy, _ = _intrinsics(camera)
+    return (x - cx) / fx, (y - cy) / fy
+
+
+def project_points(points, image, camera):
+    """
+    (N, 3) world points -> (x, y) pixel coordinates and depth in one image (vectorized).
+    Points behind the camera get a depth <= 0 and must be discarded by the caller.
+    """
+    camera_points = np.asarray(points, dtype=np.float64) @ rotation_matrix(image["qvec"]).T + image["tvec"]
+    depth = camera_points[:, 2]
+    safe = np.where(np.abs(depth) > 1e-12, depth, 1e-12)
+    x, y = project_normalized(camera, camera_points[:, 0] / safe, camera_points[:, 1] / safe)
+    return x, y, depth
@@ -0,0 +1,151 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from colmap_io import read_array, read_array_shape, write_array, read_model, unproject_pinhole, project_normalized
+from mask_codec import read_masks, union_mask, mask_path
+from instrumentation import span, traced, count
+
+############ Mask-guided depth-map pruning (between patch_match_stereo and stereo_fusion)
+# stereo_fusion turns every valid depth pixel into a fusion candidate, leaves and branches included.
+# For every depth map of dense/stereo/depth_maps/<image>.<type>.bin, the stage-2 fruit masks of the image
+# (masks/<image id>.msk, union of all instances, scaling balls included) are brought to the depth-map frame,
+# dilated by dilation_px depth pixels and every depth outside them is set to 0 (= no depth for COLMAP).
+# Mask -> depth-map frame:
+#   - with the sparse models (original sparse/0 and undistorted dense/sparse): every depth pixel is mapped
+#     exactly to the original image (pinhole unprojection, lens distortion of the original camera, rescale of
+#     --max_image_size), one remap table per camera pair
+#   - without them: the mask is resized to the depth-map size (ignores the lens distortion, keep the dilation
+#     a few pixels larger)
+# Maps are rewritten in place in the COLMAP format; running it twice changes nothing.
+DEPTH_DIR = os.path.join("stereo", "depth_maps")
+
+
+def depth_map_names(dense_dir, input_types=("geometric", "photometric")):
+    """{image name: [depth map paths]} of a dense workspace."""
+    depth_dir = os.path.join(dense_dir, DEPTH_DIR)
+    names = {}
+    for filename in sorted(os.listdir(depth_dir)):
+        for input_type in input_types:
+            suffix = f".{input_type}.bin"
+            if filename.endswith(suffix):
+                names.setdefault(filename[:-len(suffix)], []).append(os.path.join(depth_dir, filename))
+    return names
+
+
+def remap_table(dense_camera, original_camera, shape):
+    """(map_x, map_y) for cv2.remap: position in the original image of every pixel of an undistorted map."""
+    height, width = shape
+    # the depth map can be smaller than the undistorted camera (rescaled workspace)
+    sx, sy = dense_camera["width"] / width, dense_camera["height"] / height
+    xs = (np.arange(width) + 0.5) * sx
+    ys = (np.arange(height) + 0.5) * sy
+    u, v = unproject_pinhole(dense_camera, xs[None, :], ys[:, None])
+    u, v = np.broadcast_arrays(u, v)
+    x, y = project_normalized(original_camera, u, v)
+    return (x - 0.5).astype(np.float32), (y - 0.5).astype(np.float32)
+
+
+def keep_mask(masks_path, shape, table=None, original_shape=None, dilation_px=5):
+    """Fruit mask of an image in a depth map of the given (H, W) shape, dilated by dilation_px pixels."""
+    image_shape, instances = read_masks(masks_path, original_shape, cropped=True)
+    mask = union_mask(instances, image_shape).astype(np.uint8)
+    if table is not None:
+        mask = cv2.remap(mask, table[0], table[1], cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    elif mask.shape != tuple(shape):
+        # INTER_AREA keeps thin parts when downscaling (any covered fraction counts)
+        mask = cv2.resize(mask * 255, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+    if dilation_px > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilation_px + 1, 2 * dilation_px + 1))
+        mask = cv2.dilate(mask, kernel)
+    return mask > 0
+
+
+def prune_depth_map(path, keep, dry_run=False):
+    """Zeroes the depths of path outside keep. Returns (valid depths before, depths removed)."""
+    depth = read_array(path)
+    if depth.shape != keep.shape:
+        raise ValueError(f"{path}: depth map {depth.shape} but mask {keep.shape}")
+    valid = depth > 0
+    removed = valid & ~keep
+    n_removed = int(np.count_nonzero(removed))
+    if n_removed and not dry_run:
+        depth[removed] = 0
+        write_array(path, depth)
+    return int(np.count_nonzero(valid)), n_removed
+
+
+def _models(dense_dir, sparse_dir):
+    if sparse_dir is None:
+        return None
+    try:
+        dense_cameras, dense_images = read_model(os.path.join(dense_dir, "sparse"))
+        cameras, images = read_model(sparse_dir)
+    except FileNotFoundError:
+        return None
+    by_name = {image["name"]: image for image in images.values()}
+    return dense_cameras, {image["name"]: image for image in dense_images.values()}, cameras, by_name
+
+
+@traced()
+def prune_workspace(dense_dir, masks_dir, sparse_dir=None, dilation_px=5, input_types=("geometric", "photometric"),
+                    dry_run=False, num_workers=None, log=print):
+    """
+    Prunes every depth map of a COLMAP dense workspace with the stage-2 masks (see the header above).
+    sparse_dir: the original model (e.g. sparse/0) for the exact mapping, None = resize the masks.
+    Images without a mask file keep their depth maps. dry_run only counts.
+    Returns a report: images, depth maps, images without masks, valid / removed depths (the fusion
+    candidates avoided, per input type) and the time.
+    """
+    start = time.perf_counter()
+    names = depth_map_names(dense_dir, input_types)
+    models = _models(dense_dir, sparse_dir)
+    if sparse_dir is not None and models is None:
+        log(f"⚠️ No sparse models in {sparse_dir} / {dense_dir}/sparse: masks are resized to the depth maps")
+    tables = {}
+
+    def prune_image(item):
+        image_name, paths = item
+        masks_path = mask_path(masks_dir, image_name)
+        if masks_path is None:
+            return image_name, None
+        keeps, results = {}, []
+        for path in paths:
+            shape = read_array_shape(path)
+            if shape not in keeps:
+                table, original_shape = None, None
+                if models is not None and image_name in models[1] and image_name in models[3]:
+                    dense_camera = models[0][models[1][image_name]["camera_id"]]
+                    camera = models[2][models[3][image_name]["camera_id"]]
+                    original_shape = (camera["height"], camera["width"])
+                    key = (dense_camera["id"], camera["id"], shape)
+                    if key not in tables:
+                        tables[key] = remap_table(dense_camera, camera, shape)
+                    table = tables[key]
+                keeps[shape] = keep_mask(masks_path, shape, table, original_shape, dilation_px)
+            results.append((path, *prune_depth_map(path, keeps[shape], dry_run)))
+        return image_name, results
+
+    report = {"images": len(names), "depth_maps": 0, "images_without_masks": [], "dry_run": dry_run}
+    for input_type in input_types:
+        report[f"{input_type}_valid"] = report[f"{input_type}_removed"] = 0
+    with span("prune_depth_maps", images=len(names)):
+        with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+            for image_name, results in pool.map(prune_image, sorted(names.items())):
+                if results is None:
+                    report["images_without_masks"].append(image_name)
+                    continue
+                for path, valid, removed in results:
+                    input_type = path.rsplit(".", 2)[-2]
+                    report["depth_maps"] += 1
+                    report[f"{input_type}_valid"] += valid
+                    report[f"{input_type}_removed"] += removed
+    report["seconds"] = time.perf_counter() - start
+    fused_type = input_types[0]
+    count("depth_maps_pruned", report["depth_maps"])
+    count("depths_removed", report[f"{fused_type}_removed"])
+    log(f"✂️ {report[f'{fused_type}_removed']:,} of {report[f'{fused_type}_valid']:,} {fused_type} depths outside "
+        f"the masks ({len(report['images_without_masks'])} images without masks kept as is)")
+    return report
+
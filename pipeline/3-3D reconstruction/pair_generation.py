@@ -0,0 +1,164 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from frame_selection import parse_frame_filename
+from instrumentation import span, traced, count
+
+############ Image pairs for "colmap matches_importer --match_type pairs"
+# Replaces sequential_matcher (misses the loops between passes) / exhaustive_matcher (N^2 pairs) when several
+# passes of the same tree (near / far, horizontal / vertical) are matched together.
+#   1- videos: the frames are grouped by sub-folder and by filename prefix (anything before "frame_"), and
+#      ordered by their source index (frame_XXXX_idxN_scoreS.jpg); a source index going backwards starts a
+#      new video (passes copied one after the other with continuing numbers); two videos in the same folder
+#      need different prefixes or continuing numbers
+#   2- temporal pairs: every frame with the next `window` frames of its video, plus frames 2^k apart when
+#      quadratic=True (like sequential_matcher's quadratic overlap)
+#   3- cross-video pairs: every frame with its cross_per_image most similar frames of the other videos,
+#      similarity = cosine of a cheap global descriptor (16x16 gray thumbnail + hue/saturation histogram,
+#      from the JPEG decoded at 1/8 scale), above min_similarity
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+def list_images(images_dir):
+    """Image names relative to images_dir (COLMAP names: sub-folders included, "/" separators)."""
+    names = []
+    for root, _, files in os.walk(images_dir):
+        for filename in files:
+            if filename.lower().endswith(IMAGE_EXTS):
+                names.append(os.path.relpath(os.path.join(root, filename), images_dir).replace("\\", "/"))
+    return sorted(names)
+
+
+def image_sequences(names):
+    """Names grouped into videos (see the header), each in temporal order. Unparsed names: one video per folder."""
+    groups = {}
+    for name in names:
+        meta = parse_frame_filename(name)
+        folder = os.path.dirname(name)
+        if meta is None:
+            groups.setdefault((folder, None), []).append(((0, 0), name))
+        else:
+            prefix, saved, index, _ = meta
+            groups.setdefault((folder, prefix), []).append(((saved, index), name))
+    sequences = []
+    for key in sorted(groups, key=str):
+        frames = sorted(groups[key])
+        current, last_index = [], -1
+        for (_, index), name in frames:
+            if key[1] is not None and index < last_index:
+                sequences.append(current)
+                current = []
+            current.append(name)
+            last_index = index
+        sequences.append(current)
+    return sequences
+
+
+def temporal_pairs(sequence_ids, window=10, quadratic=True):
+    """(i, j) pairs of global image ids within every video: the next `window` frames, plus 2^k offsets."""
+    pairs = set()
+    for ids in sequence_ids:
+        n = len(ids)
+        offsets = set(range(1, window + 1))
+        if quadratic:
+            offsets |= {2**k for k in range(int(np.log2(max(n, 1))) + 1)}
+        for offset in sorted(o for o in offsets if o < n):
+            pairs.update(zip(ids[:-offset], ids[offset:]))
+    return pairs
+
+
+def _descriptor(path, size=16, hist_bins=(8, 4)):
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+    if image is None:
+        raise ValueError(f"Cannot read {path}")
+    gray = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), (size, size), interpolation=cv2.INTER_AREA)
+    gray = gray.astype(np.float32).ravel()
+    gray -= gray.mean()
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, list(hist_bins), [0, 180, 0, 256]).ravel()
+    hist = np.sqrt(hist / max(hist.sum(), 1.0))  # Hellinger: cosine of sqrt-histograms
+    parts = [v / max(np.linalg.norm(v), 1e-12) for v in (gray, hist)]
+    return np.concatenate(parts) / np.sqrt(2.0)
+
+
+@traced()
+def global_descriptors(images_dir, names, num_workers=None):
+    """(N, D) unit-norm float32 descriptors of the images (thread pool: cv2 releases the GIL)."""
+    paths = [os.path.join(images_dir, name) for name in names]
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+        return np.asarray(list(pool.map(_descriptor, paths)), dtype=np.float32).reshape(len(names), -1)
+
+
+@traced()
+def cross_video_pairs(descriptors, video_ids, per_image=3, min_similarity=0.5, block_size=1024):
+    """
+    {(i, j): similarity} linking every image to its per_image most similar images of the other videos.
+    The similarity matrix is computed block by block (block_size rows at a time).
+    """
+    video_ids = np.asarray(video_ids)
+    n = len(descriptors)
+    pairs = {}
+    if per_image <= 0 or len(np.unique(video_ids)) < 2:
+        return pairs
+    k = min(per_image, n - 1)
+    for s in range(0, n, block_size):
+        similarity = descriptors[s:s + block_size] @ descriptors.T
+        similarity[video_ids[s:s + block_size, None] == video_ids[None, :]] = -np.inf
+        best = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        rows = np.repeat(np.arange(s, s + len(similarity)), k)
+        cols = best.ravel()
+        values = similarity[rows - s, cols]
+        for i, j, value in zip(rows.tolist(), cols.tolist(), values.tolist()):
+            if value >= min_similarity:
+                key = (min(i, j), max(i, j))
+                pairs[key] = max(value, pairs.get(key, -np.inf))
+    return pairs
+
+
+@traced()
+def generate_pairs(images_dir, output_path, window=10, quadratic=True, cross_per_image=3, min_similarity=0.5,
+                   num_workers=None, log=print):
+    """
+    Writes the "name1 name2" pair list of images_dir to output_path (see the header).
+    Returns a report: images, videos, temporal / cross-video / total pairs, the exhaustive pair count,
+    the fraction of it that is matched, and the time.
+    """
+    start = time.perf_counter()
+    sequences = image_sequences(list_images(images_dir))
+    names = [name for sequence in sequences for name in sequence]
+    sequence_ids, video_ids, offset = [], [], 0
+    for v, sequence in enumerate(sequences):
+        sequence_ids.append(list(range(offset, offset + len(sequence))))
+        video_ids.extend([v] * len(sequence))
+        offset += len(sequence)
+
+    with span("temporal_pairs"):
+        temporal = temporal_pairs(sequence_ids, window, quadratic)
+    cross = {}
+    if cross_per_image > 0 and len(sequences) > 1:
+        descriptors = global_descriptors(images_dir, names, num_workers)
+        cross = cross_video_pairs(descriptors, video_ids, cross_per_image, min_similarity)
+    pairs = sorted(temporal | set(cross))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        f.writelines(f"{names[i]} {names[j]}\n" for i, j in pairs)
+
+    n = len(names)
+    exhaustive = n * (n - 1) // 2
+    report = {
+        "images": n,
+        "videos": [len(sequence) for sequence in sequences],
+        "temporal_pairs": len(temporal),
+        "cross_video_pairs": len(set(cross) - temporal),
+        "pairs": len(pairs),
+        "exhaustive_pairs": exhaustive,
+        "fraction_of_exhaustive": len(pairs) / exhaustive if exhaustive else 0.0,
+        "seconds": time.perf_counter() - start,
+    }
+    count("image_pairs", len(pairs))
+    log(f"🔗 {len(pairs):,} pairs for {n} images in {len(sequences)} videos "
+        f"({100 * report['fraction_of_exhaustive']:.1f}% of the {exhaustive:,} exhaustive pairs)")
+    return report
@@ -0,0 +1,42 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from gaussian_sampler import gaussians_to_cloud, cluster_spheres
+import instrumentation
+
+# === CONFIGURATION ===
+# Replaces the external 3DGS-to-PC step of "3-3DGS x 3DGS-to-pc" / "4-SuGar x 3DGS-to-pc" (see gaussian_sampler.py)
+gaussians_ply_path = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SET_2/far_horiz_143/3dgs/point_cloud/iteration_30000/point_cloud.ply"
+output_ply_path = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SET_2/far_horiz_143/cloud/point_cloud.ply"
+
+num_points = 10_000_000   # points shared by the Gaussians (the background only in adaptive mode)
+min_opacity = 0.05        # Gaussians more transparent than this are dropped
+max_scale = None          # drop Gaussians whose largest axis (1 sigma, scene units) is above this (large floaters)
+max_sigma = 2.0           # samples are drawn within this many standard deviations of the Gaussian center
+roi = None                # ((xmin, ymin, zmin), (xmax, ymax, zmax)): only sample inside this box
+
+# === Adaptive density per fruit ===
+# Clusters of a first (coarse) run give the fruit spheres; each fruit then gets points_per_fruit points
+fruit_clusters_folder = None  # e.g. ".../clusters" from HDBSCAN_clustering.py, None = uniform sampling
+points_per_fruit = 20_000
+fruit_margin = 1.2        # Gaussians within fruit_margin x radius of a fruit center belong to it
+
+chunk_size = 500_000      # Gaussians read per chunk
+seed = 0
+trace_dir = None          # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+instrumentation.start("gaussians_to_cloud", trace_dir)
+fruits = cluster_spheres(fruit_clusters_folder) if fruit_clusters_folder is not None else None
+os.makedirs(os.path.dirname(output_ply_path), exist_ok=True)
+report = gaussians_to_cloud(gaussians_ply_path, output_ply_path, num_points=num_points, min_opacity=min_opacity,
+                            max_scale=max_scale, roi=roi, fruits=fruits, points_per_fruit=points_per_fruit,
+                            fruit_margin=fruit_margin, max_sigma=max_sigma, chunk_size=chunk_size, seed=seed)
+if fruits is not None:
+    print(f"{report['fruits']} fruits ({report['fruits_without_gaussians']} without Gaussians), "
+          f"{report['background_points']:,} background points")
+print(f"⏱️ {report['points']:,} points in {report['total_s']:.1f}s ({report['points_per_s']:,.0f} points/s), "
+      f"peak memory {report['peak_rss_mb']:.0f} MB")
+print(f"✅ Point cloud saved to: {output_ply_path}")
+instrumentation.finish()
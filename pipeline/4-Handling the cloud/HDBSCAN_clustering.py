@@ -3,38 +3,80 @@ import numpy as np
 import hdbscan
 import matplotlib.pyplot as plt
 import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from cloud_clustering import cluster_multiresolution, label_agreement, peak_rss_mb
+from cluster_store import write_cluster_store, ClusterStore, export_ply
+import instrumentation
 
-# === Load PLY file ===
-pcd = o3d.io.read_point_cloud("C:/Users/HP/Desktop/colmap_test/dense_cloud.ply")
-points = np.asarray(pcd.points)
-colors = np.asarray(pcd.colors)
-
-# === Run HDBSCAN ===
-clusterer = hdbscan.HDBSCAN(min_cluster_size=100)
-labels = clusterer.fit_predict(points)
-
-# === Prepare folder to save clusters ===
-output_dir = "C:/Users/HP/Desktop/colmap_test/clusters"
-os.makedirs(output_dir, exist_ok=True)
-
-# === Save each cluster separately, including colors ===
-unique_labels = set(labels)
-for label in unique_labels:
-    if label == -1:
-        continue  # skip noise/outliers
-    cluster_indices = np.where(labels == label)[0]
-    cluster_points = points[cluster_indices]
-    cluster_colors = colors[cluster_indices]  # preserve colors
-
-    cluster_pcd = o3d.geometry.PointCloud()
-    cluster_pcd.points = o3d.utility.Vector3dVector(cluster_points)
-    cluster_pcd.colors = o3d.utility.Vector3dVector(cluster_colors) 
-    save_path = os.path.join(output_dir, f"cluster_0{label}.ply")
-    o3d.io.write_point_cloud(save_path, cluster_pcd)
-
-# === Visualize all clusters together ===
-max_label = labels.max()
-cluster_colors_vis = plt.get_cmap("tab20")(labels / (max_label + 1 if max_label > 0 else 1))
-cluster_colors_vis[labels < 0] = [0, 0, 0, 1]  # Outliers = black
-pcd.colors = o3d.utility.Vector3dVector(cluster_colors_vis[:, :3])  
-o3d.visualization.draw_geometries([pcd])
+# === Clustering mode ===
+# "full": HDBSCAN on every point (fine up to a few 100k points)
+# "multires": voxel-downsample, cluster the reduced cloud, give every point the label of its voxel
+# "tiled": like "multires", but the reduced cloud is split in overlapping XY tiles clustered in parallel
+# "multires" / "tiled" are opt-in: much faster on big clouds, but the labels are an approximation of
+# "full" (ARI about 0.99 against it), so measurements can change slightly; check with compare_full_resolution
+clustering_mode = "full"
+min_cluster_size = 100       # in original points
+voxel_size = None            # None = automatic, about target_points voxels
+target_points = 500_000
+tile_size = None             # tiled mode, in cloud units (None = about 4 x 4 tiles)
+tile_overlap = None          # tiled mode, in cloud units (None = 10% of tile_size)
+num_workers = os.cpu_count()
+compare_full_resolution = False  # also run "full" and report the label agreement (slow on big clouds)
+show_clusters = True
+write_cluster_ply = False  # also export one cluster_0<label>.ply per cluster (the cluster store is always written)
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+# Guard needed by the process pool (workers re-import this file on Windows)
+if __name__ == "__main__":
+    instrumentation.start("hdbscan_clustering", trace_dir)
+
+    # === Load PLY file ===
+    with instrumentation.span("read_ply"):
+        pcd = o3d.io.read_point_cloud("C:/Users/HP/Desktop/colmap_test/dense_cloud.ply")
+    points = np.asarray(pcd.points)
+    colors = np.asarray(pcd.colors)
+
+    # === Run HDBSCAN ===
+    if clustering_mode == "full":
+        with instrumentation.span("hdbscan"):
+            clusterer = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size)
+            labels = clusterer.fit_predict(points)
+        instrumentation.count("points_clustered", len(points))
+    else:
+        if clustering_mode == "tiled" and tile_size is None:
+            tile_size = float(np.ptp(points[:, :2], axis=0).max()) / 4
+        labels, info = cluster_multiresolution(points, min_cluster_size, voxel_size=voxel_size,
+                                               target_points=target_points,
+                                               tile_size=tile_size if clustering_mode == "tiled" else None,
+                                               tile_overlap=tile_overlap, num_workers=num_workers)
+        print(f"{len(points)} points -> {info['reduced_points']} voxels (size {info['voxel_size']:.4g}), "
+              f"{info['clusters']} clusters in {info['total_s']:.1f}s, peak memory {info['peak_rss_mb']:.0f} MB")
+        if compare_full_resolution:
+            reference = hdbscan.HDBSCAN(min_cluster_size=min_cluster_size).fit_predict(points)
+            agreement = label_agreement(labels, reference)
+            print(f"Agreement with full resolution: ARI {agreement['adjusted_rand_index']:.3f}, "
+                  f"same noise status {100 * agreement['same_noise_status']:.1f}% "
+                  f"(peak memory {peak_rss_mb():.0f} MB)")
+
+    # === Prepare folder to save clusters ===
+    output_dir = "C:/Users/HP/Desktop/colmap_test/clusters"
+    os.makedirs(output_dir, exist_ok=True)
+
+    # === Save all clusters (points + colors) in one indexed store, grouped in a single pass ===
+    index = write_cluster_store(output_dir, points, colors, labels)
+    print(f"Saved {len(index['clusters'])} clusters ({index['count']} points) to {output_dir}")
+    if write_cluster_ply:
+        export_ply(ClusterStore(output_dir), output_dir)
+
+    instrumentation.finish()
+
+    # === Visualize all clusters together ===
+    if show_clusters:
+        max_label = labels.max()
+        cluster_colors_vis = plt.get_cmap("tab20")(labels / (max_label + 1 if max_label > 0 else 1))
+        cluster_colors_vis[labels < 0] = [0, 0, 0, 1]  # Outliers = black
+        pcd.colors = o3d.utility.Vector3dVector(cluster_colors_vis[:, :3])
+        o3d.visualization.draw_geometries([pcd])
@@ -1,22 +1,73 @@
-import open3d as o3d
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from outlier_removal import remove_statistical_outlier_tiled, remove_statistical_outlier_reference
+from ply_io import read_vertices, xyz
+import instrumentation
 
 # === CONFIGURATION ===
 input_ply_path = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SET_2/far_horiz_143/cloud/point_cloud.ply"
 output_ply_path = "C:/Users/HP/Desktop/3DReconstruction/Dataset/SET_2/far_horiz_143/cloud/point_cloud_cleaned.ply"
 
-# === Load PLY file ===
-print(f"Loading point cloud from: {input_ply_path}")
-pcd = o3d.io.read_point_cloud(input_ply_path)
-print(pcd)
-
-# === Apply Statistical Outlier Removal ===
 # Parameters:
 # nb_neighbors: how many neighbors are used for estimating the average distance
 # std_ratio: threshold based on standard deviation
+nb_neighbors = 20
+std_ratio = 0.5
+
+# === Mode ===
+# "in_memory": Open3D on the whole cloud (single-threaded, the cloud must fit in memory)
+# "tiled": memory-mapped PLY, kNN distances per XY tile (with a halo) in parallel workers, same result
+noise_removal_mode = "tiled"
+tile_points = 1_000_000        # about this many points per tile
+halo = None                    # in cloud units (None = 2% of the tile size, grown automatically where needed)
+num_workers = os.cpu_count()
+compare_in_memory = False      # tiled mode: also run the in-memory filter and compare the kept points (small clouds)
+trace_dir = None               # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+# Guard needed by the process pool (workers re-import this file on Windows)
+if __name__ == "__main__":
+    instrumentation.start("noise_removal", trace_dir)
+    if noise_removal_mode == "in_memory":
+        import open3d as o3d
+
+        # === Load PLY file ===
+        print(f"Loading point cloud from: {input_ply_path}")
+        pcd = o3d.io.read_point_cloud(input_ply_path)
+        print(pcd)
+
+        # === Apply Statistical Outlier Removal ===
+        clean_pcd, ind = pcd.remove_statistical_outlier(nb_neighbors=nb_neighbors, std_ratio=std_ratio)
+        print(f"{len(ind)} points remaining after filtering")
+
+        # === Save the cleaned point cloud ===
+        o3d.io.write_point_cloud(output_ply_path, clean_pcd)
+    else:
+        print(f"Filtering point cloud in tiles: {input_ply_path}")
+        report, keep = remove_statistical_outlier_tiled(input_ply_path, output_ply_path, nb_neighbors=nb_neighbors,
+                                                        std_ratio=std_ratio, tile_points=tile_points, halo=halo,
+                                                        num_workers=num_workers)
+        print(f"{report['kept']} points remaining after filtering ({report['removed']} removed, "
+              f"{report['tiles']} tiles, threshold {report['threshold']:.4g})")
+        print(f"⏱️ {report['total_s']:.1f}s, {report['points_per_s']:,.0f} points/s, "
+              f"peak memory {report['peak_rss_mb']:.0f} MB")
 
-clean_pcd, ind = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=0.5) 
-print(f"{len(ind)} points remaining after filtering")
+        if compare_in_memory:
+            points = xyz(read_vertices(input_ply_path))
+            try:
+                import open3d as o3d
+                pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+                _, ind = pcd.remove_statistical_outlier(nb_neighbors=nb_neighbors, std_ratio=std_ratio)
+                kept_reference, reference = np.sort(np.asarray(ind, dtype=np.int64)), "Open3D"
+            except ImportError:
+                kept_reference = remove_statistical_outlier_reference(points, nb_neighbors, std_ratio)
+                reference = "In-memory filter (Open3D not installed)"
+            same = np.array_equal(np.flatnonzero(keep), kept_reference)
+            print(f"{'✅' if same else '⚠️'} {reference} keeps {len(kept_reference)} points, "
+                  f"identical selection: {same}")
 
-# === Save the cleaned point cloud ===
-o3d.io.write_point_cloud(output_ply_path, clean_pcd)
-print(f"Cleaned point cloud saved to: {output_ply_path}")
+    print(f"Cleaned point cloud saved to: {output_ply_path}")
+    instrumentation.finish()
@@ -0,0 +1,34 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from duplicate_fruits import find_duplicates
+import instrumentation
+
+# === CONFIGURATION ===
+# Run after HDBSCAN_clustering.py, before the measurements (see duplicate_fruits.py)
+clusters_folder = "C:/Users/HP/Desktop/colmap_test/clusters"
+sparse_dir = "C:/Users/HP/Desktop/colmap_test/sparse/0"   # COLMAP model the cloud was reconstructed in
+masks_dir = "C:/Users/HP/Desktop/colmap_test/masks"       # stage-2 masks (.msk or legacy .txt), one file per frame
+output_folder = "C:/Users/HP/Desktop/colmap_test/clusters_dedup"  # duplicates.json + clusters without the ghosts
+
+distance_factor = 1.5     # candidates: centers closer than distance_factor x (r1 + r2)
+max_radius_ratio = 1.5    # ... and radii within this ratio
+min_views = 3             # views where both centers fall in the same fruit mask needed to confirm a pair
+confirm_ratio = 0.7       # ... making at least this fraction of the views that see either of them on a fruit
+drop_duplicates = True    # False = only flag them in duplicates.json (then measure clusters_folder)
+trace_dir = None          # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+instrumentation.start("remove_duplicate_fruits", trace_dir)
+report = find_duplicates(clusters_folder, sparse_dir, masks_dir, output_folder, distance_factor=distance_factor,
+                         max_radius_ratio=max_radius_ratio, min_views=min_views, confirm_ratio=confirm_ratio,
+                         drop_duplicates=drop_duplicates)
+for group in report["groups"]:
+    points = group["points"]
+    print(f"   keep {group['kept']} ({points[group['kept']]:,} points), "
+          f"{'drop' if drop_duplicates else 'flag'} {', '.join(f'{c} ({points[c]:,})' for c in group['dropped'])}")
+print(f"⏱️ {report['clusters']:,} clusters in {report['total_s']:.1f}s (fit {report['fit_s']:.1f}s, "
+      f"reprojection {report['check_s']:.1f}s)")
+print(f"✅ {'Clusters without duplicates' if drop_duplicates else 'Duplicate list'} saved to: {output_folder}")
+instrumentation.finish()
@@ -0,0 +1,192 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import hdbscan
+from scipy.spatial import cKDTree
+from instrumentation import peak_rss_mb, traced, count
+
+
+# === Voxel downsampling ===
+@traced("voxel_downsample")
+def voxel_downsample(points, voxel_size):
+    """
+    Centroid of the points of every occupied voxel.
+    Returns (centroids (M, 3), inverse (N,) voxel index of every point, counts (M,)).
+    """
+    keys = np.floor((points - points.min(axis=0)) / voxel_size).astype(np.int64)
+    dims = keys.max(axis=0) + 1
+    linear = (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+    _, inverse, counts = np.unique(linear, return_inverse=True, return_counts=True)
+    centroids = np.column_stack([np.bincount(inverse, weights=points[:, d]) for d in range(3)]) / counts[:, None]
+    return centroids, inverse, counts
+
+
+def auto_voxel_size(points, target_points, iterations=6):
+    """Voxel size giving roughly target_points occupied voxels (clouds are surfaces: count ~ 1 / size^2)."""
+    extent = np.ptp(points, axis=0)
+    size = float(np.cbrt(np.prod(np.maximum(extent, 1e-12)) / target_points))
+    for _ in range(iterations):
+        count = len(voxel_downsample(points, size)[2])
+        if abs(count - target_points) < 0.1 * target_points:
+            break
+        size *= np.sqrt(count / target_points)
+    return size
+
+
+@traced("hdbscan")
+def _hdbscan_labels(points, min_cluster_size):
+    return hdbscan.HDBSCAN(min_cluster_size=int(min_cluster_size)).fit_predict(points)
+
+
+# === Tiles ===
+def _tile_job(job):
+    tile_points, min_cluster_size = job
+    if len(tile_points) < min_cluster_size:
+        return np.full(len(tile_points), -1, dtype=np.int64)
+    return _hdbscan_labels(tile_points, min_cluster_size)
+
+
+def _union_find_roots(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+@traced("cluster_tiled")
+def cluster_tiled(points, min_cluster_size, tile_size, overlap, num_workers=None, min_shared=5):
+    """
+    Clusters overlapping XY tiles in parallel and merges the clusters across tile seams.
+    Every point belongs to the core (non-overlapping) part of exactly one tile, which gives its label;
+    clusters of neighbouring tiles that share at least min_shared points in the overlap are merged.
+    """
+    xy_min = points[:, :2].min(axis=0)
+    core = np.floor((points[:, :2] - xy_min) / tile_size).astype(np.int64)
+    n_tiles = core.max(axis=0) + 1
+
+    jobs, members = [], []
+    for tx in range(n_tiles[0]):
+        for ty in range(n_tiles[1]):
+            lo = xy_min + np.array([tx, ty]) * tile_size - overlap
+            hi = xy_min + np.array([tx + 1, ty + 1]) * tile_size + overlap
+            idx = np.flatnonzero(np.all((points[:, :2] >= lo) & (points[:, :2] < hi), axis=1))
+            if len(idx) == 0:
+                continue
+            jobs.append((points[idx], min_cluster_size))
+            members.append((tx, ty, idx))
+
+    if num_workers == 1:
+        tile_labels = list(map(_tile_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+            tile_labels = list(pool.map(_tile_job, jobs))
+
+    # global id of (tile, local label) = offset of the tile + local label
+    offsets = np.cumsum([0] + [int(l.max()) + 1 if len(l) else 0 for l in tile_labels])
+    parent = list(range(int(offsets[-1])))
+    labels = np.full(len(points), -1, dtype=np.int64)
+    seen = np.full(len(points), -1, dtype=np.int64)  # global label of the first tile that clustered the point
+    pair_counts = {}
+    for (tx, ty, idx), local, offset in zip(members, tile_labels, offsets[:-1]):
+        clustered = local >= 0
+        global_labels = np.where(clustered, local + offset, -1)
+        owned = np.all(core[idx] == (tx, ty), axis=1)
+        labels[idx[owned]] = global_labels[owned]
+        # count points clustered both here and in an earlier tile
+        shared = clustered & (seen[idx] >= 0)
+        if shared.any():
+            pairs, counts = np.unique(np.column_stack((seen[idx[shared]], global_labels[shared])),
+                                      axis=0, return_counts=True)
+            for (a, b), c in zip(pairs.tolist(), counts.tolist()):
+                pair_counts[(a, b)] = pair_counts.get((a, b), 0) + c
+        first = clustered & (seen[idx] < 0)
+        seen[idx[first]] = global_labels[first]
+
+    for (a, b), count in pair_counts.items():
+        if count >= min_shared:
+            ra, rb = _union_find_roots(parent, a), _union_find_roots(parent, b)
+            if ra != rb:
+                parent[rb] = ra
+
+    if parent:
+        roots = np.array([_union_find_roots(parent, i) for i in range(len(parent))])
+        clustered = labels >= 0
+        labels[clustered] = roots[labels[clustered]]
+    return relabel(labels)
+
+
+def relabel(labels):
+    """Consecutive cluster ids 0..K-1 (noise stays -1)."""
+    out = np.full(len(labels), -1, dtype=np.int64)
+    clustered = labels >= 0
+    _, out[clustered] = np.unique(labels[clustered], return_inverse=True)
+    return out
+
+
+@traced("propagate_labels")
+def propagate_labels(centroids, centroid_labels, points, inverse=None, max_distance=None, workers=-1):
+    """
+    Labels of all original points from the labels of the reduced cloud.
+    With the voxel inverse index every point takes the label of its own voxel (exact and O(N));
+    otherwise a KD-tree over the reduced points gives each point its nearest label.
+    """
+    if inverse is not None:
+        return centroid_labels[inverse]
+    tree = cKDTree(centroids)
+    distances, nearest = tree.query(points, k=1, workers=workers,
+                                    distance_upper_bound=np.inf if max_distance is None else max_distance)
+    labels = np.full(len(points), -1, dtype=np.int64)
+    found = np.isfinite(distances)
+    labels[found] = centroid_labels[nearest[found]]
+    return labels
+
+
+@traced()
+def cluster_multiresolution(points, min_cluster_size, voxel_size=None, target_points=500_000,
+                            tile_size=None, tile_overlap=None, num_workers=None):
+    """
+    HDBSCAN for clouds too large to cluster directly:
+      1- voxel-downsample (voxel_size, or automatic for about target_points voxels)
+      2- cluster the reduced cloud, whole or in overlapping XY tiles clustered in parallel (tile_size)
+      3- give every original point the label of its voxel
+    min_cluster_size is in original points and is scaled to the reduced cloud.
+    Returns (labels, info) with the voxel size, reduced size, timings and peak memory.
+    """
+    start = time.perf_counter()
+    if voxel_size is None:
+        voxel_size = float(auto_voxel_size(points, target_points))
+    centroids, inverse, counts = voxel_downsample(points, voxel_size)
+    reduced_min_cluster_size = max(2, round(min_cluster_size * len(centroids) / len(points)))
+    t_down = time.perf_counter()
+
+    if tile_size is None:
+        centroid_labels = _hdbscan_labels(centroids, reduced_min_cluster_size)
+    else:
+        overlap = tile_overlap if tile_overlap is not None else 0.1 * tile_size
+        centroid_labels = cluster_tiled(centroids, reduced_min_cluster_size, tile_size, overlap, num_workers)
+    t_cluster = time.perf_counter()
+
+    labels = propagate_labels(centroids, centroid_labels, points, inverse=inverse)
+    t_end = time.perf_counter()
+    count("points_clustered", len(points))
+    return labels, {
+        "voxel_size": voxel_size,
+        "reduced_points": len(centroids),
+        "reduced_min_cluster_size": reduced_min_cluster_size,
+        "clusters": int(labels.max()) + 1 if len(labels) else 0,
+        "downsample_s": t_down - start,
+        "cluster_s": t_cluster - t_down,
+        "propagate_s": t_end - t_cluster,
+        "total_s": t_end - start,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def label_agreement(labels, reference):
+    """Adjusted Rand index and noise/cluster agreement between two labelings of the same points."""
+    from sklearn.metrics import adjusted_rand_score
+    return {
+        "adjusted_rand_index": float(adjusted_rand_score(reference, labels)),
+        "same_noise_status": float(np.mean((labels < 0) == (reference < 0))),
+    }
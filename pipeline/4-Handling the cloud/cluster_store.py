@@ -0,0 +1,140 @@
+import os
+import json
+import numpy as np
+from instrumentation import traced, count
+
+############ Cluster store
+# One directory with:
+#   clusters.npy        every clustered point once, grouped by cluster: structured array (xyz float64, rgb float32)
+#   clusters_index.json {"count": N, "clusters": {"<label>": [start, stop], ...}}
+# so any cluster is a slice of one memory-mapped file instead of one PLY per cluster.
+POINTS_FILE = "clusters.npy"
+INDEX_FILE = "clusters_index.json"
+POINT_DTYPE = np.dtype([("xyz", "<f8", (3,)), ("rgb", "<f4", (3,))])
+
+
+def cluster_name(label):
+    """Name used for the per-cluster PLY files and the results table."""
+    return f"cluster_0{label}"
+
+
+def partition_by_label(labels, skip_noise=True):
+    """
+    Single argsort/group pass over the labels.
+    Returns (order, groups): order sorts the points by label, groups = {label: (start, stop)} in that order.
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind="stable")
+    sorted_labels = labels[order]
+    if skip_noise:
+        first = np.searchsorted(sorted_labels, 0)
+        order, sorted_labels = order[first:], sorted_labels[first:]
+    if len(sorted_labels) == 0:
+        return order, {}
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_labels)) + 1))
+    stops = np.append(starts[1:], len(sorted_labels))
+    return order, {int(sorted_labels[s]): (int(s), int(e)) for s, e in zip(starts, stops)}
+
+
+@traced("write_cluster_store")
+def write_cluster_store(store_dir, points, colors, labels, skip_noise=True):
+    """Writes the points/colors of every cluster contiguously plus the offsets index. Returns the index."""
+    os.makedirs(store_dir, exist_ok=True)
+    order, groups = partition_by_label(labels, skip_noise)
+
+    store = np.lib.format.open_memmap(os.path.join(store_dir, POINTS_FILE), mode="w+",
+                                      dtype=POINT_DTYPE, shape=(len(order),))
+    store["xyz"] = points[order]
+    store["rgb"] = colors[order]
+    store.flush()
+    del store
+
+    index = {"count": int(len(order)), "clusters": {str(label): list(span) for label, span in groups.items()}}
+    with open(os.path.join(store_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f)
+    count("clusters_written", len(groups))
+    return index
+
+
+class ClusterStore:
+    """Read side of the cluster store: every cluster is a zero-copy view into the memory-mapped file."""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, INDEX_FILE), "r") as f:
+            index = json.load(f)
+        self.spans = {int(label): tuple(span) for label, span in index["clusters"].items()}
+        self.data = np.load(os.path.join(store_dir, POINTS_FILE), mmap_mode="r")
+
+    def labels(self):
+        return sorted(self.spans)
+
+    def points(self, label):
+        start, stop = self.spans[label]
+        return self.data["xyz"][start:stop]
+
+    def colors(self, label):
+        start, stop = self.spans[label]
+        return self.data["rgb"][start:stop]
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __iter__(self):
+        for label in self.labels():
+            yield label, self.points(label), self.colors(label)
+
+
+def export_ply(store, output_dir):
+    """The former output: one Open3D PLY per cluster, named cluster_0<label>.ply."""
+    import open3d as o3d
+
+    os.makedirs(output_dir, exist_ok=True)
+    for label, points, colors in store:
+        cluster_pcd = o3d.geometry.PointCloud()
+        cluster_pcd.points = o3d.utility.Vector3dVector(np.asarray(points, dtype=np.float64))
+        cluster_pcd.colors = o3d.utility.Vector3dVector(np.asarray(colors, dtype=np.float64))
+        o3d.io.write_point_cloud(os.path.join(output_dir, f"{cluster_name(label)}.ply"), cluster_pcd)
+
+
+def iter_clusters(clusters_folder):
+    """
+    (label, points, colors) of every cluster of a folder: read from the cluster store if there is one,
+    else from the cluster_0<label>.ply files.
+    """
+    if os.path.exists(os.path.join(clusters_folder, INDEX_FILE)):
+        yield from ClusterStore(clusters_folder)
+        return
+    import open3d as o3d
+
+    for fname in sorted(os.listdir(clusters_folder)):
+        if (not fname.endswith(".ply")) or (not fname.startswith("cluster_")):
+            continue
+        pc = o3d.io.read_point_cloud(os.path.join(clusters_folder, fname))
+        yield int(fname.replace("cluster_", "").replace(".ply", "")), np.asarray(pc.points), np.asarray(pc.colors)
+
+
+def cluster_reader(clusters_folder):
+    """Function label -> (points, colors) for many lookups, opening the cluster store (if any) only once."""
+    if os.path.exists(os.path.join(clusters_folder, INDEX_FILE)):
+        store = ClusterStore(clusters_folder)
+        return lambda label: (store.points(label), store.colors(label))
+    return lambda label: read_cluster(clusters_folder, label)
+
+
+def list_clusters(clusters_folder):
+    """Labels of the clusters of a folder (cluster store or cluster_0<label>.ply files)."""
+    if os.path.exists(os.path.join(clusters_folder, INDEX_FILE)):
+        return ClusterStore(clusters_folder).labels()
+    return sorted(int(f.replace("cluster_", "").replace(".ply", "")) for f in os.listdir(clusters_folder)
+                  if f.startswith("cluster_") and f.endswith(".ply"))
+
+
+def read_cluster(clusters_folder, label):
+    """(points, colors) of one cluster, from the cluster store if there is one, else from its PLY."""
+    if os.path.exists(os.path.join(clusters_folder, INDEX_FILE)):
+        store = ClusterStore(clusters_folder)
+        return store.points(label), store.colors(label)
+    import open3d as o3d
+
+    pc = o3d.io.read_point_cloud(os.path.join(clusters_folder, f"{cluster_name(label)}.ply"))
+    return np.asarray(pc.points), np.asarray(pc.colors)
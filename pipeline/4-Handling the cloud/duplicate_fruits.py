@@ -0,0 +1,212 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from cluster_store import ClusterStore, write_cluster_store, list_clusters, cluster_reader, cluster_name
+from sphere_fitting import fit_spheres
+from colmap_io import read_model, project_points
+from mask_codec import read_masks, mask_path
+from instrumentation import span, traced, count
+
+############ Duplicate fruits (one fruit reconstructed twice, e.g. PatchMatch-MVS under harsh light)
+#   1- a sphere is fitted to every cluster (batched, in cloud units)
+#   2- candidates: KD-tree over the centers, pairs closer than distance_factor x (r1 + r2) with radii within
+#      max_radius_ratio of each other (one ball query per cluster with its own radius, no N^2 pass)
+#   3- confirmation by reprojection: the centers of all candidate clusters are projected into every registered
+#      image of the COLMAP model (sparse/0, same frame as the cloud) at once and looked up in the stage-2 masks
+#      of the image. A view votes "same" when both centers fall in the same fruit instance, "different" when
+#      they fall in different instances (or one on the background). A pair is a duplicate with at least
+#      min_views "same" votes making at least confirm_ratio of the votes.
+#   4- duplicates are grouped (connected components). Each group keeps its best-supported cluster (most points,
+#      then lowest RMS distance to its sphere); the others are ghosts and are dropped from a new cluster store
+#      (or only flagged). Points are never pooled: a ghost offset by a fraction of the radius would bias the
+#      fitted diameter (+8% for a 1 r offset, +33% for 2 r).
+# duplicates.json (groups and votes of every candidate pair) is written into the output folder; the input
+# clusters folder (an upstream output) is left untouched.
+DUPLICATES_FILE = "duplicates.json"
+
+
+@traced()
+def fit_cluster_spheres(clusters_folder, labels=None, batch_size=256):
+    """
+    (labels, centers (K, 3), radii (K,), point counts, RMS distances to the sphere) of the clusters,
+    fitted batch_size clusters at a time.
+    """
+    labels = list_clusters(clusters_folder) if labels is None else list(labels)
+    read = cluster_reader(clusters_folder)
+    centers, radii, sizes, rms = [], [], [], []
+    for s in range(0, len(labels), batch_size):
+        point_sets = [np.asarray(read(label)[0], dtype=np.float64) for label in labels[s:s + batch_size]]
+        batch_centers, batch_radii, _ = fit_spheres(point_sets)
+        centers.append(batch_centers)
+        radii.append(batch_radii)
+        sizes.extend(len(p) for p in point_sets)
+        rms.extend(float(np.sqrt(np.mean((np.linalg.norm(p - c, axis=1) - r) ** 2))) if len(p) else np.nan
+                   for p, c, r in zip(point_sets, batch_centers, batch_radii))
+    if not labels:
+        return (np.array(labels, dtype=np.int64), np.empty((0, 3)), np.empty(0), np.empty(0, dtype=np.int64),
+                np.empty(0))
+    return np.asarray(labels), np.vstack(centers), np.concatenate(radii), np.asarray(sizes), np.asarray(rms)
+
+
+@traced()
+def candidate_pairs(centers, radii, distance_factor=1.5, max_radius_ratio=1.5):
+    """(P, 2) index pairs (i < j) of nearby spheres of similar size. NaN fits are never candidates."""
+    valid = np.flatnonzero(np.isfinite(radii) & np.all(np.isfinite(centers), axis=1) & (radii > 0))
+    if len(valid) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    c, r = centers[valid], radii[valid]
+    # |ci - cj| <= f (ri + rj) with rj <= ratio ri  =>  |ci - cj| <= f (1 + ratio) ri: one ball per sphere
+    neighbours = cKDTree(c).query_ball_point(c, distance_factor * (1 + max_radius_ratio) * r, workers=-1)
+    lengths = np.fromiter((len(n) for n in neighbours), dtype=np.int64, count=len(neighbours))
+    i = np.repeat(np.arange(len(c)), lengths)
+    j = np.concatenate([np.asarray(n, dtype=np.int64) for n in neighbours]) if len(i) else i
+    keep = i < j
+    i, j = i[keep], j[keep]
+    distance = np.linalg.norm(c[i] - c[j], axis=1)
+    ratio = np.maximum(r[i], r[j]) / np.minimum(r[i], r[j])
+    keep = (distance <= distance_factor * (r[i] + r[j])) & (ratio <= max_radius_ratio)
+    return np.column_stack((valid[i[keep]], valid[j[keep]]))
+
+
+def _instance_ids(masks_path, x, y, image_shape):
+    """Mask instance (1-based) under every pixel position, 0 = background, -1 = outside the image."""
+    height, width = image_shape
+    xi, yi = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+    ids = np.where((xi >= 0) & (xi < width) & (yi >= 0) & (yi < height), 0, -1)
+    _, instances = read_masks(masks_path, image_shape, cropped=True)
+    for k, instance in enumerate(instances, start=1):
+        x0, y0, x1, y1 = instance["bbox"]
+        inside = np.flatnonzero((xi >= x0) & (xi < x1) & (yi >= y0) & (yi < y1) & (ids == 0))
+        if len(inside):
+            hit = instance["mask"][yi[inside] - y0, xi[inside] - x0]
+            ids[inside[hit]] = k
+    return ids
+
+
+@traced()
+def reprojection_votes(centers, pairs, sparse_dir, masks_dir, num_workers=None):
+    """
+    ("same", "different") votes of every candidate pair over the images of the COLMAP model (see the header),
+    plus the number of images with masks that were used.
+    """
+    cameras, images = read_model(sparse_dir)
+    involved, inverse = np.unique(pairs.ravel(), return_inverse=True)
+    first, second = inverse.reshape(-1, 2).T
+    points = centers[involved]
+
+    def votes(image):
+        masks_path = mask_path(masks_dir, image["name"])
+        if masks_path is None:
+            return None
+        camera = cameras[image["camera_id"]]
+        x, y, depth = project_points(points, image, camera)
+        ids = _instance_ids(masks_path, x, y, (camera["height"], camera["width"]))
+        ids[depth <= 0] = -1
+        a, b = ids[first], ids[second]
+        seen = (a >= 0) & (b >= 0) & ((a > 0) | (b > 0))
+        return seen & (a == b), seen & (a != b)
+
+    same = np.zeros(len(pairs), dtype=np.int64)
+    different = np.zeros(len(pairs), dtype=np.int64)
+    used = 0
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+        for result in pool.map(votes, images.values()):
+            if result is None:
+                continue
+            used += 1
+            same += result[0]
+            different += result[1]
+    return same, different, used
+
+
+def duplicate_groups(n, pairs):
+    """Connected components of the confirmed pairs: lists of cluster indices, only the groups of 2 or more."""
+    if not len(pairs):
+        return []
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+    n_components, component = connected_components(graph, directed=False)
+    sizes = np.bincount(component, minlength=n_components)
+    order = np.argsort(component, kind="stable")
+    groups = np.split(order, np.cumsum(sizes)[:-1])
+    return [g.tolist() for g in groups if len(g) > 1]
+
+
+def best_supported(group, sizes, rms):
+    """Index of the cluster a duplicate group keeps: most points, then lowest RMS distance, then smallest label."""
+    rms = np.where(np.isfinite(rms), rms, np.inf)
+    return min(group, key=lambda i: (-sizes[i], rms[i], i))
+
+
+@traced()
+def drop_clusters(clusters_folder, output_folder, dropped):
+    """New cluster store without the dropped labels; every other cluster keeps its label and its points."""
+    if os.path.abspath(clusters_folder) == os.path.abspath(output_folder):
+        raise ValueError("drop_clusters writes a new cluster store, output_folder must differ from clusters_folder")
+    store = ClusterStore(clusters_folder)
+    labels = np.empty(len(store.data), dtype=np.int64)
+    for label, (start, stop) in store.spans.items():
+        labels[start:stop] = -1 if label in dropped else label
+    return write_cluster_store(output_folder, store.data["xyz"], store.data["rgb"], labels)
+
+
+@traced()
+def find_duplicates(clusters_folder, sparse_dir, masks_dir, output_folder, distance_factor=1.5, max_radius_ratio=1.5,
+                    min_views=3, confirm_ratio=0.7, drop_duplicates=True, num_workers=None, log=print):
+    """
+    Detects duplicated fruits among the clusters of clusters_folder (see the header) and writes
+    output_folder/duplicates.json (groups with their votes); with drop_duplicates, output_folder also gets
+    a cluster store without the ghosts (the best-supported cluster of each group is kept as is).
+    Returns the report.
+    """
+    start = time.perf_counter()
+    labels, centers, radii, sizes, rms = fit_cluster_spheres(clusters_folder)
+    t_fit = time.perf_counter()
+    pairs = candidate_pairs(centers, radii, distance_factor, max_radius_ratio)
+    log(f"🔎 {len(pairs):,} candidate pairs among {len(labels):,} clusters")
+
+    same = different = np.zeros(len(pairs), dtype=np.int64)
+    views = 0
+    if len(pairs):
+        with span("reprojection", pairs=len(pairs)):
+            same, different, views = reprojection_votes(centers, pairs, sparse_dir, masks_dir, num_workers)
+    confirmed = (same >= min_views) & (same >= confirm_ratio * np.maximum(same + different, 1))
+    groups = duplicate_groups(len(labels), pairs[confirmed])
+    kept = [best_supported(g, sizes, rms) for g in groups]
+    t_check = time.perf_counter()
+
+    pair_records = [{"clusters": [cluster_name(labels[i]), cluster_name(labels[j])],
+                     "distance": float(np.linalg.norm(centers[i] - centers[j])),
+                     "radii": [float(radii[i]), float(radii[j])], "same": int(s), "different": int(d),
+                     "duplicate": bool(c)}
+                    for (i, j), s, d, c in zip(pairs.tolist(), same, different, confirmed)]
+    group_records = [{"kept": cluster_name(labels[k]), "dropped": [cluster_name(labels[i]) for i in g if i != k],
+                      "points": {cluster_name(labels[i]): int(sizes[i]) for i in g},
+                      "rms": {cluster_name(labels[i]): float(rms[i]) for i in g}}
+                     for g, k in zip(groups, kept)]
+    os.makedirs(output_folder, exist_ok=True)
+    if drop_duplicates:
+        dropped = {int(labels[i]) for g, k in zip(groups, kept) for i in g if i != k}
+        drop_clusters(clusters_folder, output_folder, dropped)
+    with open(os.path.join(output_folder, DUPLICATES_FILE), "w") as f:
+        json.dump({"groups": group_records, "pairs": pair_records, "dropped": drop_duplicates}, f, indent=2)
+    end = time.perf_counter()
+
+    count("duplicate_candidates", len(pairs))
+    count("duplicate_clusters", sum(len(g) - 1 for g in groups))
+    log(f"🍊 {int(confirmed.sum())} duplicate pairs confirmed in {views} views -> {len(groups)} groups, "
+        f"{sum(len(g) - 1 for g in groups)} clusters {'dropped' if drop_duplicates else 'flagged'}")
+    return {
+        "clusters": len(labels),
+        "candidates": len(pairs),
+        "confirmed": int(confirmed.sum()),
+        "groups": group_records,
+        "views": views,
+        "fit_s": t_fit - start,
+        "check_s": t_check - t_fit,
+        "total_s": end - start,
+    }
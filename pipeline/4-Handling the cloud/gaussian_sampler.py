@@ -0,0 +1,205 @@
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+from ply_io import read_vertices, xyz, write_ply
+from cluster_store import list_clusters, cluster_reader
+from instrumentation import span, traced, count, peak_rss_mb
+
+############ Gaussian splats -> point cloud
+# Reads the Gaussian PLY written by 3DGS (point_cloud/iteration_*/point_cloud.ply) or SuGaR (refined_ply) as a
+# memory-mapped structured array: x, y, z, f_dc_0..2 (SH color), opacity (logit), scale_0..2 (log), rot_0..3
+# (quaternion w, x, y, z). Two passes over the file, chunk by chunk:
+#   1- opacity filter (sigmoid(opacity) >= min_opacity, optional max_scale / ROI box) and a sampling weight
+#      per Gaussian: opacity x (s0 s1 + s1 s2 + s0 s2), i.e. its visible surface. The budget of every group
+#      (background, or one group per fruit in adaptive mode) is split over its Gaussians by weight with
+#      systematic rounding, so the total number of points is known before writing.
+#   2- points = mean + R(q) (scale * z), z ~ N(0, I) truncated to max_sigma, colors from the SH DC term,
+#      streamed to a binary PLY (x, y, z, red, green, blue) in batches of at most batch_points points.
+# Adaptive mode (fruits = (centers, radii), e.g. from cluster_spheres() on a first coarse pass): Gaussians
+# within fruit_margin x radius of a fruit center get points_per_fruit points per fruit, the others share
+# num_points (0 = no background at all).
+SH_C0 = 0.28209479177387814
+OUTPUT_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+BACKGROUND = -1
+
+
+def _chunks(n, chunk_size):
+    for s in range(0, n, chunk_size):
+        yield s, min(s + chunk_size, n)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _scales(gaussians):
+    return np.exp(np.column_stack([gaussians[f"scale_{i}"] for i in range(3)]).astype(np.float64))
+
+
+def _quaternions(gaussians):
+    q = np.column_stack([gaussians[f"rot_{i}"] for i in range(4)]).astype(np.float64)
+    norms = np.linalg.norm(q, axis=1, keepdims=True)
+    q /= np.where(norms > 0, norms, 1.0)
+    return q
+
+
+def _rotate(q, v):
+    """Rotates the rows of v (N, 3) by the unit quaternions q (N, 4) (w, x, y, z), without building matrices."""
+    w, u = q[:, :1], q[:, 1:]
+    t = 2.0 * np.cross(u, v)
+    return v + w * t + np.cross(u, t)
+
+
+def _colors(gaussians):
+    dc = np.column_stack([gaussians[f"f_dc_{i}"] for i in range(3)]).astype(np.float64)
+    return np.clip(np.round((0.5 + SH_C0 * dc) * 255), 0, 255).astype(np.uint8)
+
+
+def _truncated_normal(rng, n, max_sigma, retries=8):
+    z = rng.standard_normal((n, 3))
+    if max_sigma is None:
+        return z
+    for _ in range(retries):
+        out = np.flatnonzero(np.einsum("ij,ij->i", z, z) > max_sigma**2)
+        if not len(out):
+            return z
+        z[out] = rng.standard_normal((len(out), 3))
+    norms = np.linalg.norm(z, axis=1, keepdims=True)
+    return z * np.minimum(1.0, max_sigma / norms)
+
+
+@traced("gaussian_weights")
+def gaussian_weights(gaussians, min_opacity=0.05, max_scale=None, roi=None):
+    """Sampling weight of a chunk of Gaussians (0 = dropped): opacity x surface of the 1-sigma ellipsoid."""
+    opacity = _sigmoid(gaussians["opacity"].astype(np.float64))
+    s = _scales(gaussians)
+    weights = opacity * (s[:, 0] * s[:, 1] + s[:, 1] * s[:, 2] + s[:, 0] * s[:, 2])
+    keep = opacity >= min_opacity
+    if max_scale is not None:
+        keep &= s.max(axis=1) <= max_scale
+    if roi is not None:
+        lo, hi = np.asarray(roi[0]), np.asarray(roi[1])
+        means = xyz(gaussians)
+        keep &= np.all((means >= lo) & (means <= hi), axis=1)
+    return np.where(keep, weights, 0.0)
+
+
+def cluster_spheres(clusters_folder, percentile=95):
+    """(centers, radii) of the clusters of a folder: centroid and percentile distance to it, for fruits=."""
+    read = cluster_reader(clusters_folder)
+    centers, radii = [], []
+    for label in list_clusters(clusters_folder):
+        points = np.asarray(read(label)[0], dtype=np.float64)
+        center = points.mean(axis=0)
+        centers.append(center)
+        radii.append(np.percentile(np.linalg.norm(points - center, axis=1), percentile))
+    return np.asarray(centers).reshape(-1, 3), np.asarray(radii)
+
+
+def allocate(weights, groups, budgets):
+    """
+    Points per Gaussian: the budget of every group split by weight, with systematic rounding
+    (floor of the running sum of the expected counts), so a group receives its budget to within one point.
+    """
+    order = np.argsort(groups, kind="stable")
+    expected = np.zeros(len(weights))
+    totals = np.bincount(groups, weights=weights, minlength=len(budgets))
+    scale = np.divide(budgets, totals, out=np.zeros(len(budgets)), where=totals > 0)
+    expected[order] = weights[order] * scale[groups[order]]
+    running = np.floor(np.cumsum(expected[order]) + 1e-9)
+    counts = np.empty(len(weights), dtype=np.int64)
+    counts[order] = np.diff(np.concatenate(([0.0], running))).astype(np.int64)
+    return counts
+
+
+@traced("sample_gaussians")
+def sample_gaussians(gaussians, counts, rng, max_sigma=2.0):
+    """Points (float32) and colors (uint8) drawn from each Gaussian of a chunk, counts[i] points for Gaussian i."""
+    selected = np.flatnonzero(counts)
+    g = gaussians[selected]
+    repeat = np.repeat(np.arange(len(selected)), counts[selected])
+    local = _truncated_normal(rng, len(repeat), max_sigma) * _scales(g)[repeat]
+    points = xyz(g)[repeat] + _rotate(_quaternions(g)[repeat], local)
+    return points.astype(np.float32), _colors(g)[repeat]
+
+
+def _batches(counts, chunk_size, batch_points):
+    # Gaussian ranges holding at most chunk_size Gaussians and (unless one Gaussian exceeds it) batch_points points
+    cumulative = np.cumsum(counts)
+    cuts = np.searchsorted(cumulative, np.arange(batch_points, cumulative[-1] if len(counts) else 0, batch_points),
+                           side="right")
+    cuts = np.union1d(cuts, np.arange(0, len(counts), chunk_size))
+    cuts = np.union1d(cuts, [0, len(counts)])
+    return zip(cuts[:-1], cuts[1:])
+
+
+@traced("gaussians_to_cloud")
+def gaussians_to_cloud(gaussians_ply_path, output_ply_path, num_points=10_000_000, min_opacity=0.05,
+                       max_scale=None, roi=None, fruits=None, points_per_fruit=20_000, fruit_margin=1.2,
+                       max_sigma=2.0, chunk_size=500_000, batch_points=2_000_000, seed=0, log=print):
+    """
+    Samples a point cloud from a 3DGS / SuGaR Gaussian PLY without loading it (see the header above).
+    roi: ((xmin, ymin, zmin), (xmax, ymax, zmax)) or None; fruits: (centers (K, 3), radii (K,)) or None.
+    Returns a report with the Gaussian / point counts, timings, points/s and peak RSS.
+    """
+    start = time.perf_counter()
+    gaussians = read_vertices(gaussians_ply_path)
+    n = len(gaussians)
+    missing = [f for f in ("x", "y", "z", "opacity", "scale_0", "rot_0", "f_dc_0") if f not in gaussians.dtype.names]
+    if missing:
+        raise ValueError(f"{gaussians_ply_path} is not a Gaussian splat PLY (no {missing})")
+
+    # Pass 1: weights and groups
+    weights = np.empty(n, dtype=np.float64)
+    groups = np.zeros(n, dtype=np.int64)
+    if fruits is not None:
+        centers, radii = np.asarray(fruits[0], dtype=np.float64).reshape(-1, 3), np.asarray(fruits[1], np.float64)
+        tree = cKDTree(centers)
+    with span("weights"):
+        for s, e in _chunks(n, chunk_size):
+            chunk = gaussians[s:e]
+            weights[s:e] = gaussian_weights(chunk, min_opacity, max_scale, roi)
+            if fruits is not None:
+                distance, nearest = tree.query(xyz(chunk), workers=-1)
+                inside = distance <= fruit_margin * radii[nearest]
+                groups[s:e] = np.where(inside, nearest + 1, 0)  # group 0 = background, k + 1 = fruit k
+    budgets = np.array([num_points] + ([points_per_fruit] * len(fruits[1]) if fruits is not None else []),
+                       dtype=np.float64)
+    counts = allocate(weights, groups, budgets)
+    total = int(counts.sum())
+    kept = int(np.count_nonzero(weights))
+    t_weights = time.perf_counter()
+    log(f"{kept:,} of {n:,} Gaussians kept, sampling {total:,} points")
+
+    # Pass 2: sample and stream to disk
+    rng = np.random.default_rng(seed)
+
+    def batches():
+        for s, e in _batches(counts, chunk_size, batch_points):
+            if counts[s:e].any():
+                points, colors = sample_gaussians(gaussians[s:e], counts[s:e], rng, max_sigma)
+                out = np.empty(len(points), dtype=OUTPUT_DTYPE)
+                out["x"], out["y"], out["z"] = points.T
+                out["red"], out["green"], out["blue"] = colors.T
+                yield out
+
+    with span("sample_and_write"):
+        write_ply(output_ply_path, OUTPUT_DTYPE, batches(), total)
+    end = time.perf_counter()
+    count("gaussians_read", n)
+    count("points_sampled", total)
+
+    fruit_points = np.bincount(groups, weights=counts, minlength=len(budgets))[1:]
+    return {
+        "gaussians": n,
+        "gaussians_kept": kept,
+        "points": total,
+        "background_points": int(total - fruit_points.sum()),
+        "fruits": len(fruit_points),
+        "fruits_without_gaussians": int(np.count_nonzero(fruit_points == 0)),
+        "weights_s": t_weights - start,
+        "sample_s": end - t_weights,
+        "total_s": end - start,
+        "points_per_s": total / max(end - start, 1e-9),
+        "peak_rss_mb": peak_rss_mb(),
+    }
@@ -0,0 +1,216 @@
+import os
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.spatial import cKDTree
+from cloud_clustering import peak_rss_mb
+from ply_io import read_vertices, xyz, write_ply
+from instrumentation import span, traced, count
+
+
+############ Out-of-core statistical outlier removal
+# Same filter as Open3D's remove_statistical_outlier(nb_neighbors, std_ratio) (PointCloud::RemoveStatisticalOutliers):
+#   d_i       = mean distance of point i to its nb_neighbors nearest points (the point itself included, as in Open3D)
+#   mean      = sum(d_i > 0) / N
+#   std       = sqrt(sum over d_i > 0 of (d_i - mean)^2 / (N - 1))
+#   threshold = mean + std_ratio * std
+#   keep i    <=> 0 < d_i < threshold
+# N counts every point with neighbours (all of them), so exact duplicates (d_i = 0) are left out of the sums
+# but not of the denominators, like in Open3D.
+# Unlike Open3D, the PLY stays memory-mapped and d is computed per XY tile in worker processes.
+# Each tile also loads a halo of points around it; a point whose k-th neighbour lies farther than the
+# halo is recomputed with a doubled halo, so every d_i is exactly the global kNN result.
+
+# === Tiling ===
+def _chunks(n, chunk_size):
+    for start in range(0, n, chunk_size):
+        yield start, min(start + chunk_size, n)
+
+
+def _bounds(vertices, chunk_size):
+    lo, hi = np.full(3, np.inf), np.full(3, -np.inf)
+    for start, stop in _chunks(len(vertices), chunk_size):
+        points = xyz(vertices[start:stop])
+        lo, hi = np.minimum(lo, points.min(axis=0)), np.maximum(hi, points.max(axis=0))
+    return lo, hi
+
+
+def _tile_grid(lo, hi, n_points, tile_points):
+    """XY grid of about n_points / tile_points square-ish tiles. Returns (cell size, (nx, ny))."""
+    extent = np.maximum(hi[:2] - lo[:2], 1e-9)
+    n_tiles = max(1, int(np.ceil(n_points / tile_points)))
+    cell = float(np.sqrt(extent[0] * extent[1] / n_tiles))
+    cell = max(cell, float(extent.max()) / n_tiles)  # degenerate (flat) extents
+    dims = np.maximum(np.ceil(extent / cell).astype(np.int64), 1)
+    return cell, (int(dims[0]), int(dims[1]))
+
+
+def _tile_ids(points, lo, cell, dims):
+    cells = np.floor((points[:, :2] - lo[:2]) / cell).astype(np.int64)
+    cells = np.clip(cells, 0, np.array(dims) - 1)
+    return cells[:, 0] * dims[1] + cells[:, 1]
+
+
+@traced("partition")
+def _partition(vertices, lo, cell, dims, order_path, chunk_size):
+    """Point indices sorted by tile (saved as .npy for the workers) and the tile offsets into that order."""
+    tile_ids = np.empty(len(vertices), dtype=np.int32)
+    for start, stop in _chunks(len(vertices), chunk_size):
+        tile_ids[start:stop] = _tile_ids(xyz(vertices[start:stop]), lo, cell, dims)
+    order = np.argsort(tile_ids, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(tile_ids, minlength=dims[0] * dims[1]))))
+    np.save(order_path, order)
+    return offsets
+
+
+# === Per-tile job ===
+@traced("knn_tile")
+def _tile_job(job):
+    ply_path, order_path, dist_path, offsets, lo, cell, dims, tile, nb_neighbors, halo = job
+    vertices = read_vertices(ply_path)
+    order = np.load(order_path, mmap_mode="r")
+    core_idx = np.sort(order[offsets[tile]:offsets[tile + 1]])
+    core = xyz(vertices, core_idx)
+    tx, ty = divmod(tile, dims[1])
+    tile_lo = lo[:2] + np.array([tx, ty]) * cell
+    tile_hi = tile_lo + cell
+
+    mean_dist = np.empty(len(core))
+    pending = np.arange(len(core))
+    rounds = 0
+    while len(pending):
+        rounds += 1
+        # tiles overlapping the tile box grown by the halo
+        (x0, y0), (x1, y1) = [np.clip(np.floor((b - lo[:2]) / cell).astype(np.int64), 0, np.array(dims) - 1)
+                              for b in (tile_lo - halo, tile_hi + halo)]
+        covers_all = x0 == 0 and y0 == 0 and x1 == dims[0] - 1 and y1 == dims[1] - 1
+        idx = np.concatenate([order[offsets[t]:offsets[t + 1]]
+                              for gx in range(x0, x1 + 1) for t in range(gx * dims[1] + y0, gx * dims[1] + y1 + 1)])
+        idx.sort()
+        points = xyz(vertices, idx)
+        inside = np.all((points[:, :2] >= tile_lo - halo) & (points[:, :2] <= tile_hi + halo), axis=1)
+        points = points if covers_all else points[inside]
+
+        # fewer than k points in reach come back as inf distances, i.e. not exact yet
+        k = min(nb_neighbors, len(points)) if covers_all else nb_neighbors
+        distances, _ = cKDTree(points).query(core[pending], k=k)
+        distances = distances.reshape(len(pending), k)
+        # exact once the k-th neighbour found is within the halo (or the halo covers the whole cloud)
+        exact = np.full(len(pending), True) if covers_all else distances[:, -1] <= halo
+        mean_dist[pending[exact]] = distances[exact].mean(axis=1)
+        pending = pending[~exact]
+        halo *= 2
+
+    out = np.load(dist_path, mmap_mode="r+")
+    out[core_idx] = mean_dist
+    out.flush()
+    valid = mean_dist[mean_dist > 0]
+    n = len(valid)
+    mean = float(valid.mean()) if n else 0.0
+    m2 = float(((valid - mean) ** 2).sum()) if n else 0.0
+    return n, mean, m2, rounds
+
+
+def _merge_stats(a, b):
+    # Chan et al. parallel merge of (count, mean, sum of squared deviations)
+    (na, ma, m2a), (nb, mb, m2b) = a, b
+    n = na + nb
+    if n == 0:
+        return 0, 0.0, 0.0
+    delta = mb - ma
+    return n, ma + delta * nb / n, m2a + m2b + delta ** 2 * na * nb / n
+
+
+def _open3d_stats(valid, valid_mean, valid_m2, n_points):
+    """Open3D's mean and std of d from the (count, mean, m2) of the d > 0 values: both divide by n_points."""
+    if n_points == 0:
+        return 0.0, 0.0
+    cloud_mean = valid_mean * valid / n_points
+    # sum of (d - cloud_mean)^2 over the d > 0 values, moved from their own mean
+    sq_sum = valid_m2 + valid * (valid_mean - cloud_mean) ** 2
+    std_dev = float(np.sqrt(sq_sum / (n_points - 1))) if n_points > 1 else 0.0
+    return float(cloud_mean), std_dev
+
+
+# === Filter ===
+@traced("remove_statistical_outlier")
+def remove_statistical_outlier_tiled(input_ply_path, output_ply_path, nb_neighbors=20, std_ratio=0.5,
+                                     tile_points=1_000_000, halo=None, num_workers=None,
+                                     chunk_size=1_000_000, tmp_dir=None):
+    """
+    Tiled, out-of-core remove_statistical_outlier on a PLY file; the kept vertices (all properties)
+    are streamed to output_ply_path. halo defaults to 2% of the tile size.
+    Returns (report, keep): report has the kept/removed counts, threshold, timings, points/s and peak RSS,
+    keep is the boolean mask of the kept input vertices.
+    """
+    start = time.perf_counter()
+    vertices = read_vertices(input_ply_path)
+    n_points = len(vertices)
+    lo, hi = _bounds(vertices, chunk_size)
+    cell, dims = _tile_grid(lo, hi, n_points, tile_points)
+    halo = 0.02 * cell if halo is None else halo
+
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as work_dir:
+        order_path = os.path.join(work_dir, "order.npy")
+        dist_path = os.path.join(work_dir, "mean_dist.npy")
+        offsets = _partition(vertices, lo, cell, dims, order_path, chunk_size)
+        np.lib.format.open_memmap(dist_path, mode="w+", dtype=np.float64, shape=(n_points,)).flush()
+        t_partition = time.perf_counter()
+
+        jobs = [(input_ply_path, order_path, dist_path, offsets, lo, cell, dims, tile, nb_neighbors, halo)
+                for tile in range(dims[0] * dims[1]) if offsets[tile + 1] > offsets[tile]]
+        with span("knn", tiles=len(jobs)):
+            if num_workers == 1:
+                results = list(map(_tile_job, jobs))
+            else:
+                with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+                    results = list(pool.map(_tile_job, jobs))
+        stats = (0, 0.0, 0.0)
+        for n, mean, m2, _ in results:
+            stats = _merge_stats(stats, (n, mean, m2))
+        cloud_mean, std_dev = _open3d_stats(*stats, n_points)
+        threshold = cloud_mean + std_ratio * std_dev
+        t_knn = time.perf_counter()
+
+        # keep mask first (one byte per point), then stream the kept vertices
+        mean_dist = np.load(dist_path, mmap_mode="r")
+        keep = np.empty(n_points, dtype=bool)
+        for s, e in _chunks(n_points, chunk_size):
+            keep[s:e] = (mean_dist[s:e] > 0) & (mean_dist[s:e] < threshold)
+        kept = int(keep.sum())
+        chunks = (vertices[s:e][keep[s:e]] for s, e in _chunks(n_points, chunk_size))
+        with span("write_ply"):
+            write_ply(output_ply_path, vertices.dtype, chunks, kept)
+        del mean_dist
+    end = time.perf_counter()
+    count("points_denoised", n_points)
+    count("points_removed", n_points - kept)
+
+    return {
+        "points": n_points,
+        "kept": kept,
+        "removed": n_points - kept,
+        "tiles": len(jobs),
+        "halo_retry_tiles": sum(1 for r in results if r[3] > 1),
+        "mean_distance": cloud_mean,
+        "std_distance": std_dev,
+        "threshold": threshold,
+        "partition_s": t_partition - start,
+        "knn_s": t_knn - t_partition,
+        "write_s": end - t_knn,
+        "total_s": end - start,
+        "points_per_s": n_points / max(end - start, 1e-9),
+        "peak_rss_mb": peak_rss_mb(),
+    }, keep
+
+
+def remove_statistical_outlier_reference(points, nb_neighbors=20, std_ratio=0.5):
+    """In-memory version of the same filter (Open3D's formulas written out), returns the kept indices."""
+    distances, _ = cKDTree(points).query(points, k=min(nb_neighbors, len(points)))
+    mean_dist = distances.reshape(len(points), -1).mean(axis=1)
+    valid = mean_dist[mean_dist > 0]
+    cloud_mean = valid.sum() / len(points)
+    std_dev = np.sqrt(((valid - cloud_mean) ** 2).sum() / (len(points) - 1)) if len(points) > 1 else 0.0
+    threshold = cloud_mean + std_ratio * std_dev
+    return np.flatnonzero((mean_dist > 0) & (mean_dist < threshold))
@@ -0,0 +1,89 @@
+import numpy as np
+
+############ Minimal PLY I/O without loading the cloud in memory
+# Binary PLY vertices are exposed as a memory-mapped NumPy structured array (one field per property),
+# so 10M+ point clouds and Gaussian splat files can be read chunk by chunk.
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+_NUMPY_TO_PLY = {"i1": "char", "u1": "uchar", "i2": "short", "u2": "ushort",
+                 "i4": "int", "u4": "uint", "f4": "float", "f8": "double"}
+
+
+def read_ply_header(path):
+    """Returns (format, elements, header_size): elements = [(name, count, [(prop, numpy type), ...]), ...]."""
+    elements, fmt = [], None
+    with open(path, "rb") as f:
+        if f.readline().strip() != b"ply":
+            raise ValueError(f"{path} is not a PLY file")
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"{path}: unterminated PLY header")
+            words = line.decode("ascii", errors="replace").split()
+            if not words:
+                continue
+            if words[0] == "format":
+                fmt = words[1]
+            elif words[0] == "element":
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == "property":
+                if words[1] == "list":
+                    raise ValueError(f"{path}: list properties are only supported after the vertices")
+                elements[-1][2].append((words[2], _PLY_TYPES[words[1]]))
+            elif words[0] == "end_header":
+                return fmt, elements, f.tell()
+
+
+def read_vertices(path, mode="r"):
+    """
+    Vertices of a PLY as a structured array: memory-mapped for binary files, loaded for ASCII ones.
+    The vertex element must be the first element of the file (true for point clouds and 3DGS/SuGaR files).
+    """
+    fmt, elements, header_size = read_ply_header(path)
+    name, count, props = elements[0]
+    if name != "vertex":
+        raise ValueError(f"{path}: the first PLY element is '{name}', expected 'vertex'")
+    if fmt == "ascii":
+        dtype = np.dtype([(p, t) for p, t in props])
+        table = np.loadtxt(path, skiprows=_ascii_header_lines(path), max_rows=count, ndmin=2)
+        vertices = np.empty(count, dtype=dtype)
+        for i, (p, _) in enumerate(props):
+            vertices[p] = table[:, i]
+        return vertices
+    endian = "<" if fmt == "binary_little_endian" else ">"
+    dtype = np.dtype([(p, endian + t) for p, t in props])
+    return np.memmap(path, dtype=dtype, mode=mode, offset=header_size, shape=(count,))
+
+
+def _ascii_header_lines(path):
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            if line.strip() == b"end_header":
+                return i + 1
+
+
+def xyz(vertices, index=None):
+    """(N, 3) float64 coordinates of all (or the indexed) vertices."""
+    rows = vertices if index is None else vertices[index]
+    return np.column_stack((rows["x"], rows["y"], rows["z"])).astype(np.float64, copy=False)
+
+
+def write_ply(path, dtype, chunks, count):
+    """Binary little-endian PLY with one vertex property per field of dtype, written from an iterable of chunks."""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    lines = ["ply", "format binary_little_endian 1.0", f"element vertex {count}"]
+    for field in dtype.names:
+        lines.append(f"property {_NUMPY_TO_PLY[dtype[field].str[1:]]} {field}")
+    lines.append("end_header")
+    written = 0
+    with open(path, "wb") as f:
+        f.write(("\n".join(lines) + "\n").encode("ascii"))
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+            written += len(chunk)
+    if written != count:
+        raise ValueError(f"{path}: {written} vertices written, {count} declared")
@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+import sqlite3
+import pandas as pd
+from instrumentation import traced
+
+############ Ground-truth store
+# all_fruits.xlsx is parsed once and cached next to it as a columnar file:
+#   all_fruits.gt.parquet (or all_fruits.gt.sqlite without a Parquet engine)  normalized table, indexed by id_norm
+#   all_fruits.gt.json                                                          mtime / size / sha256 of the source
+# The cache is reused while the source mtime is unchanged; if the mtime changed, the sha256 decides
+# (a touched but identical file does not trigger a new import).
+DECIMAL_COLUMNS = ["height", "width", "avg"]
+ID_COLUMN = "id"
+KEY_COLUMN = "id_norm"
+
+
+def normalize_id(ids):
+    return ids.astype(str).str.strip().str.lower()
+
+
+def _file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(xlsx_path, cache_dir):
+    stem = os.path.splitext(os.path.basename(xlsx_path))[0]
+    folder = cache_dir or os.path.dirname(os.path.abspath(xlsx_path))
+    base = os.path.join(folder, f"{stem}.gt")
+    return base + ".parquet", base + ".sqlite", base + ".json"
+
+
+def _has_parquet_engine():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        try:
+            import fastparquet  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+
+@traced("import_ground_truth")
+def import_spreadsheet(xlsx_path):
+    """all_fruits.xlsx as a table: decimal commas fixed in one pass, plus the normalized id as index."""
+    df = pd.read_excel(xlsx_path)
+    present = [c for c in DECIMAL_COLUMNS if c in df.columns]
+    df[present] = df[present].astype(str).apply(lambda col: col.str.replace(",", ".")).astype(float)
+    # ids typed as numbers in some rows and as text in others (and any other mixed column) are stored as text:
+    # Parquet needs one type per column
+    for column in [ID_COLUMN] + list(df.select_dtypes(include="object").columns):
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    df[KEY_COLUMN] = normalize_id(df[ID_COLUMN])
+    return df.set_index(KEY_COLUMN)
+
+
+def _write_cache(df, parquet_path, sqlite_path):
+    if _has_parquet_engine():
+        df.to_parquet(parquet_path)
+        return parquet_path
+    with sqlite3.connect(sqlite_path) as con:
+        df.to_sql("ground_truth", con, if_exists="replace", index=True)
+        con.execute(f"CREATE INDEX IF NOT EXISTS idx_{KEY_COLUMN} ON ground_truth ({KEY_COLUMN})")
+    return sqlite_path
+
+
+def _read_cache(cache_path):
+    if cache_path.endswith(".parquet"):
+        return pd.read_parquet(cache_path)
+    with sqlite3.connect(cache_path) as con:
+        return pd.read_sql("SELECT * FROM ground_truth", con, index_col=KEY_COLUMN)
+
+
+@traced("load_ground_truth")
+def load_ground_truth(xlsx_path, cache_dir=None, log=print):
+    """
+    The ground-truth table of xlsx_path, from the cache when the source did not change.
+    Returns a DataFrame indexed by the normalized fruit id.
+    """
+    parquet_path, sqlite_path, meta_path = _cache_paths(xlsx_path, cache_dir)
+    stat = os.stat(xlsx_path)
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+    cache_ok = meta is not None and os.path.exists(meta["cache"])
+
+    if cache_ok and meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+        return _read_cache(meta["cache"])
+    sha256 = _file_sha256(xlsx_path)
+    if cache_ok and meta["sha256"] == sha256:
+        df = _read_cache(meta["cache"])
+    else:
+        log(f"📥 Importing ground truth from {xlsx_path}")
+        df = import_spreadsheet(xlsx_path)
+        meta = {"cache": _write_cache(df, parquet_path, sqlite_path)}
+    meta.update({"source": os.path.abspath(xlsx_path), "mtime_ns": stat.st_mtime_ns,
+                 "size": stat.st_size, "sha256": sha256})
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return df
+
+
+def read_set_mapping(set_fruits_txt_path):
+    """(cluster_name, fruit_id) pairs of a set_fruits.txt ("cluster : fruit id" lines), in file order."""
+    pairs = []
+    with open(set_fruits_txt_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if ":" in line:
+                parts = line.strip().split(":")
+                pairs.append((parts[0].strip(), parts[1].strip()))
+    return pd.DataFrame(pairs, columns=["cluster_name", "fruit_id"])
+
+
+def resolve_set(ground_truth, mapping):
+    """
+    Ground-truth rows of the fruits of a set, with cluster_name as first column, in one merge
+    (case-insensitive ids, mapping order kept). Returns (table, fruit ids without a ground-truth row).
+    """
+    keys = mapping.assign(**{KEY_COLUMN: normalize_id(mapping["fruit_id"])})
+    table = keys[["cluster_name", KEY_COLUMN]].merge(ground_truth, left_on=KEY_COLUMN, right_index=True,
+                                                     how="inner")
+    missing = keys.loc[~keys[KEY_COLUMN].isin(ground_truth.index), "fruit_id"].tolist()
+    return table.drop(columns=[KEY_COLUMN]).reset_index(drop=True), missing
+
+
+def load_set_table(all_fruits_path, set_fruits_txt_path, cache_dir=None, log=print):
+    """Ground-truth table of a scan (the former set_fruits_table.xlsx content) from the cached store."""
+    table, missing = resolve_set(load_ground_truth(all_fruits_path, cache_dir, log), read_set_mapping(set_fruits_txt_path))
+    if missing:
+        log(f"⚠️ No ground truth for fruit ids {missing}")
+    return table
@@ -0,0 +1,162 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from cluster_store import cluster_reader, list_clusters
+from sphere_fitting import fit_spheres
+from visibility import estimate_visibility
+from instrumentation import span, traced, count
+
+############ Measurement runner
+# Clusters are measured in chunks spread over a process pool. Every worker reads its clusters from the
+# (memory-mapped) cluster store itself, fits the spheres and the visibility of the whole chunk in batched
+# calls, and returns one record per cluster. A failing cluster gives an error row (status, stage, message)
+# instead of stopping or being silently skipped; if a batched call raises, the chunk is redone one cluster
+# at a time so only the culprit fails.
+RESULT_COLUMNS = ["predicted_diam", "error_mm", "visibility", "density", "mm_dist", "status", "error_stage", "error"]
+
+
+@traced("mm_dist")
+def mean_neighbour_distance(points, k=10, workers=-1):
+    """Mean distance of every point to its k nearest neighbours (the point itself excluded), averaged."""
+    if len(points) <= k:
+        raise ValueError(f"{len(points)} points, at least {k + 1} needed for {k} neighbours")
+    distances, _ = cKDTree(points).query(points, k=k + 1, workers=workers)
+    return float(np.mean(distances[:, 1:]))
+
+
+def _error(label, stage, e):
+    return {"cluster_name": label, "status": "error", "error_stage": stage, "error": f"{type(e).__name__}: {e}"}
+
+
+def _fit_batch(clusters, robust, max_radial_error_mm, refit_after_filter, visibility_subdivisions):
+    """Batched fit, filter of the far points, refit and visibility: ((kept, radii, visibilities), None),
+    or (None, (failing stage, exception))."""
+    stage = "fit"
+    try:
+        #4-5-fit, filter the far points, refit
+        centers, radii, _ = fit_spheres(clusters, robust=robust)
+        keep_masks = [np.abs(np.linalg.norm(points - center, axis=1) - radius) <= max_radial_error_mm
+                      for points, center, radius in zip(clusters, centers, radii)]
+        kept = [points[keep] for points, keep in zip(clusters, keep_masks)]
+        if refit_after_filter:
+            centers, radii, _ = fit_spheres(kept, robust=robust)
+
+        #7-visibility of the whole batch
+        stage = "visibility"
+        visibilities = estimate_visibility(centers, radii, kept, subdivisions=visibility_subdivisions)
+    except Exception as e:
+        return None, (stage, e)
+    return (kept, radii, visibilities), None
+
+
+def _no_sphere(points, kept_points):
+    if len(points) < 4:
+        return ValueError(f"{len(points)} points, fewer than the 4 a sphere needs")
+    if len(kept_points) < 4:
+        return ValueError(f"{len(points)} points but {len(kept_points)} within max_radial_error_mm of the "
+                          f"first fit, fewer than the 4 a sphere needs")
+    return ValueError(f"no sphere fitted on {len(points)} points (degenerate, e.g. coplanar)")
+
+
+def _measure_chunk(job):
+    (clusters_folder, labels, scaling_factor, robust, max_radial_error_mm, refit_after_filter,
+     visibility_subdivisions, k_neighbors, kdtree_workers) = job
+    fit_args = (robust, max_radial_error_mm, refit_after_filter, visibility_subdivisions)
+    records, names, clusters = [], [], []
+
+    #2-3-get the cluster points and scale them
+    read = cluster_reader(clusters_folder)
+    for label in labels:
+        try:
+            points, _ = read(label)
+            clusters.append(np.asarray(points, dtype=np.float64) * scaling_factor)
+            names.append(label)
+        except Exception as e:
+            records.append(_error(label, "read", e))
+
+    fitted, failure = _fit_batch(clusters, *fit_args)
+    if failure is None:
+        batches = [(names, clusters, *fitted)]
+    else:
+        # one bad cluster must not fail the whole chunk: fit it again one cluster at a time
+        batches = []
+        for label, points in zip(names, clusters):
+            fitted, failure = _fit_batch([points], *fit_args)
+            if failure is None:
+                batches.append(([label], [points], *fitted))
+            else:
+                records.append(_error(label, *failure))
+
+    for batch in batches:
+        for label, points, kept_points, radius, visibility in zip(*batch):
+            if not np.isfinite(radius):
+                records.append(_error(label, "fit", _no_sphere(points, kept_points)))
+                continue
+            try:
+                #6-mean distance to the k nearest neighbours
+                mm_dist = mean_neighbour_distance(kept_points, k_neighbors, kdtree_workers)
+            except Exception as e:
+                records.append(_error(label, "mm_dist", e))
+                continue
+            records.append({"cluster_name": label, "status": "ok", "error_stage": None, "error": None,
+                            "predicted_diam": 2 * float(radius), "visibility": float(visibility),
+                            "density": len(points), "mm_dist": mm_dist})
+    return records
+
+
+@traced()
+def run_measurements(clusters_folder, scaling_factor, labels=None, num_workers=None, chunk_size=32,
+                     robust=None, max_radial_error_mm=5, refit_after_filter=True, visibility_subdivisions=3,
+                     k_neighbors=10, kdtree_workers=None, log=print):
+    """
+    Measures every cluster (or the given labels) of clusters_folder.
+    Returns a DataFrame with one row per cluster: cluster_name, predicted_diam, visibility, density, mm_dist,
+    status ("ok" / "error"), error_stage and error.
+    kdtree_workers: threads of the mm_dist KD-tree queries (None = all cores without a pool, 1 per pool worker).
+    """
+    labels = list_clusters(clusters_folder) if labels is None else list(labels)
+    if kdtree_workers is None:
+        kdtree_workers = -1 if num_workers == 1 else 1
+    jobs = [(clusters_folder, labels[i:i + chunk_size], scaling_factor, robust, max_radial_error_mm,
+             refit_after_filter, visibility_subdivisions, k_neighbors, kdtree_workers)
+            for i in range(0, len(labels), chunk_size)]
+
+    start = time.perf_counter()
+    records = []
+    with span("measure_chunks", chunks=len(jobs)):
+        if num_workers == 1:
+            for job in jobs:
+                records.extend(_measure_chunk(job))
+                log(f"📏 {len(records)}/{len(labels)} clusters measured")
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as pool:
+                for future in as_completed([pool.submit(_measure_chunk, job) for job in jobs]):
+                    records.extend(future.result())
+                    log(f"📏 {len(records)}/{len(labels)} clusters measured")
+    log(f"⏱️ {len(labels)} clusters in {time.perf_counter() - start:.1f}s")
+
+    results = pd.DataFrame.from_records(records, columns=["cluster_name"] + RESULT_COLUMNS)
+    count("clusters_measured", int((results["status"] == "ok").sum()))
+    count("clusters_failed", int((results["status"] != "ok").sum()))
+    return results.sort_values("cluster_name", ignore_index=True)
+
+
+def merge_results(df, results):
+    """
+    Joins the measurements to the ground-truth table in one merge on cluster_name (ids like "cluster_012" or 12),
+    with the same rounding as the former row-by-row update. Returns (merged table, clusters without a GT row).
+    """
+    df = df.drop(columns=[c for c in RESULT_COLUMNS if c in df.columns])
+    df["cluster_name"] = df["cluster_name"].astype(str).str.extract(r"(\d+)")[0].astype(int)
+    results = results.drop(columns=["error_mm"])
+    merged = df.merge(results, on="cluster_name", how="left")
+    merged["error_mm"] = (merged["GT_diam"] - merged["predicted_diam"]).abs().round(2)
+    merged["predicted_diam"] = merged["predicted_diam"].round(2)
+    merged["visibility"] = merged["visibility"].round(2)
+    merged["mm_dist"] = merged["mm_dist"].round(4)
+    merged = merged[[c for c in df.columns] + RESULT_COLUMNS]
+    unmatched = results.loc[~results["cluster_name"].isin(df["cluster_name"]), "cluster_name"].tolist()
+    return merged, unmatched
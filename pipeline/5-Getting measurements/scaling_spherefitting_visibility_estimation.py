@@ -1,11 +1,16 @@
 import os
-import open3d as o3d
+import sys
 import pandas as pd
 import numpy as np
-import trimesh
-from scipy.optimize import least_squares
-from scipy.spatial import cKDTree
-from sklearn.neighbors import NearestNeighbors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs()
+from cluster_store import read_cluster
+from sphere_fitting import fit_sphere
+from visibility import show_visibility
+from measurement_runner import run_measurements, merge_results
+from ground_truth_store import load_set_table
+import instrumentation
 
 
 
@@ -13,178 +18,96 @@ from sklearn.neighbors import NearestNeighbors
 ###################################################################################
 
 fixed_path="C:/Users/HP/Desktop/colmap_test"
-clusters_folder = f'{fixed_path}/clusters'
+clusters_folder = f'{fixed_path}/clusters'  # cluster store (or per-cluster PLY files) from HDBSCAN_clustering.py
 scaling_cluster_name = "cluster_04"
 real_sphere_diameter_mm = 69
 excel_path = f'{fixed_path}/set_fruits_table.xlsx'
+#  Ground truth: from the cached all_fruits store (see ground_truth_store.py), or from excel_path if all_fruits_path is None
+all_fruits_path = "C:/Users/HP/Desktop/3DReconstruction/Dataset/all_fruits.xlsx"
+set_fruits_txt_path = f'{fixed_path}/set_fruits.txt'
 
+#  Sphere fitting (see sphere_fitting.py)
+sphere_fit_robust = None     # None (least squares), "huber", "tukey" or "ransac" for partial / merged fruits
+max_radial_error_mm = 5      # points farther than this from the fitted sphere are dropped
+refit_after_filter = True    # fit the sphere again on the kept points
 
-#  Sphere fitting 
-def residuals(params, points):
-    x0, y0, z0, r = params
-    x, y, z = points[:, 0], points[:, 1], points[:, 2]
-    return np.sqrt((x - x0)**2 + (y - y0)**2 + (z - z0)**2) - r
+#  Visibility (see visibility.py)
+visibility_subdivisions = 3  # icosphere subdivision level
+show_visibility_scene = False  # open the trimesh viewer for every measured cluster (blocks, needs a display)
 
-def fit_sphere_to_points(points):
-    center_guess = np.mean(points, axis=0)
-    radius_guess = np.mean(np.linalg.norm(points - center_guess, axis=1))
-    params0 = np.append(center_guess, radius_guess)
-    result = least_squares(residuals, params0, args=(points,))
-    x0, y0, z0, r = result.x
-    return np.array([x0, y0, z0]), r
+#  Runner (see measurement_runner.py)
+num_workers = os.cpu_count()  # processes measuring clusters (1 = in this process)
+chunk_size = 32               # clusters per task (fitted together)
+mm_dist_neighbors = 10        # k of the mean neighbour distance
+trace_dir = None              # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
 
 
+###################################################################################
 
-def get_visibility(radius,center,points):
-
-    # Load point cloud to trimesh point cloud object 
-    point_cloud = trimesh.points.PointCloud(vertices=points, colors=(colors * 255).astype(np.uint8))
-
-    # Create icosphere and transfrm it to the optimized center
-    sphere = trimesh.creation.icosphere(subdivisions=3, radius=radius)
-    sphere.apply_translation(center)
-    
-    #this gives a list (N_faces, 3) — one 3D coordinate per triangle
-    #the index of each element in the face_centers matrix will be used as a unique id for that face
-    face_centers = sphere.triangles_center 
-
-    #turn the face centers to a binary tree representation easier to search in
-    tree = cKDTree(face_centers) 
-
-    #for each point from points find k nearest face_centers
-    #_ : The distances to the nearest neighbors(unused)
-    #face_indices : The indices of those nearest neighbors
-    _, face_indices = tree.query(points, k=1) 
-    # Marked faces
-    marked_faces = set(face_indices)
-
-    # getting the vertices of the marked faces
-    # sphere.faces get all faces (face = 3d coords of the 3 vertices making the face), so we flatten
-    marked_vertex_indices = set(sphere.faces[list(marked_faces)].flatten())
+# Guard needed by the process pool (workers re-import this file on Windows)
+if __name__ == "__main__":
+    instrumentation.start("measurements", trace_dir)
 
-    # Initialize vertices colors all to black
-    vertex_colors = np.zeros((len(sphere.vertices), 4), dtype=np.uint8)
-    vertex_colors[:] = [0, 0, 0, 255] 
-    a=0
-    # Then put the marked ones to red
-    for idx in marked_vertex_indices:
-        vertex_colors[idx] = [255, 0, 0, 255] 
-        a=a+1
+    # 0- prepare the excel table ___________________
+    if all_fruits_path is not None:
+        df = load_set_table(all_fruits_path, set_fruits_txt_path)
+    else:
+        df = pd.read_excel(excel_path)
+    df["height"] = df["height"] * 0.01
+    df["width"] = df["width"] * 0.01
+    df = df.rename(columns={"avg": "GT_diam"})
+    df["GT_diam"] = df["GT_diam"] * 10
 
-    # Create a point cloud from the vertices
-    vertex_cloud = trimesh.points.PointCloud(sphere.vertices, colors=vertex_colors)
 
-    # Visibility info
-    total_faces = len(face_centers)
-    marked_count = len(marked_faces)
-    visibility_percent = 100 * marked_count / total_faces
 
-    #____________________optional visualizing
-    #Show all in one scene 
-    scene = trimesh.Scene()
-    scene.add_geometry(point_cloud, node_name='point_cloud')  # original point cloud
-    scene.add_geometry(sphere, node_name='icosphere')         # icosphere
-    scene.add_geometry(vertex_cloud, node_name='vertices')    # visible and invisible vertices
-    scene.show()
-  
+    # 1- fit blue and get SF ____________________________
 
-    return visibility_percent
+    scaling_label = int(scaling_cluster_name.replace("cluster_", ""))
+    with instrumentation.span("scaling_sphere"):
+        scaling_points, _ = read_cluster(clusters_folder, scaling_label)
+        scaling_center, scaling_radius, _ = fit_sphere(scaling_points, robust=sphere_fit_robust)
+    scaling_diameter = 2 * scaling_radius
+    scaling_factor = real_sphere_diameter_mm / scaling_diameter
 
 
-###################################################################################
+    # 2-7- scale, fit, filter, mm_dist and visibility of every cluster, in parallel ____________________________
 
+    results = run_measurements(clusters_folder, scaling_factor, num_workers=num_workers, chunk_size=chunk_size,
+                               robust=sphere_fit_robust, max_radial_error_mm=max_radial_error_mm,
+                               refit_after_filter=refit_after_filter, visibility_subdivisions=visibility_subdivisions,
+                               k_neighbors=mm_dist_neighbors)
 
-# 0- prepare the excel table ___________________
-df = pd.read_excel(excel_path)
-df["height"] = df["height"] * 0.01
-df["width"] = df["width"] * 0.01
-df = df.rename(columns={"avg": "GT_diam"})
-df["GT_diam"] = df["GT_diam"] * 10
-
-
-
-# 1- fit blue and get SF ____________________________
-
-scaling_ply_path = os.path.join(clusters_folder, f"{scaling_cluster_name}.ply")
-scaling_pc = o3d.io.read_point_cloud(scaling_ply_path)
-scaling_points = np.asarray(scaling_pc.points)
-scaling_center, scaling_radius = fit_sphere_to_points(scaling_points)
-scaling_diameter = 2 * scaling_radius
-scaling_factor = real_sphere_diameter_mm / scaling_diameter
-
-
-# Loop over othr clusters ____________________________
-
-for fname in os.listdir(clusters_folder):
-
-    #2-skip non-clusters_________________________
-    if (not fname.endswith(".ply")) or (not fname.startswith("cluster_")):
-        continue
-    cluster_name = int(fname.replace("cluster_", "").replace(".ply", ""))
-
-    #3-get the ply and get numpy points nd scale them________________________
-    cluster_path = os.path.join(clusters_folder, fname)
-    pc = o3d.io.read_point_cloud(cluster_path)
-    points = np.asarray(pc.points)
-    colors = np.asarray(pc.colors)
-    points = points*scaling_factor
-    density= len(points)
-    
-    try:
-        #4-get c and r and diam ___________________________________
-        center, radius = fit_sphere_to_points(points)
-        diameter = 2 * radius
-
-        #5-filter the far points_____________________________________
-        distances = np.linalg.norm(points - center, axis=1)
-        radial_error = np.abs(distances - radius) 
-        keep_mask = radial_error <= 5
-        points = points[keep_mask]
-        colors = colors[keep_mask]
-        
-        #6-Get mean_ditances_mm______________________________________
-        k = 10
-        #Nbrs is a nearestneighbor objct of the "points", we did k+1 cuz the point is its own nghbr
-        nbrs = NearestNeighbors(n_neighbors=k+1).fit(points)
-        #Get distances for each point to its 10 nghbrs, when getting mean ignore first nghbr (point itself) 
-        distances, _ = nbrs.kneighbors(points)
-        mm_dist = np.mean(distances[:, 1:])
-
-        #7-get visibility_score________________________________________
-        visibility = get_visibility(radius, center, points)
-        print('____________about :', cluster_name)
-        print('diameter : ', diameter)
-        print('mm_dist', mm_dist)
-        print("density :", density)
-        print("visibility : ", visibility)
-        
-        #8-Update the cluster row _______________________________________
-        if df["cluster_name"].dtype != int:
-            df["cluster_name"] = df["cluster_name"].astype(str).str.extract(r"(\d+)")[0].astype(int)
-            
-        row_idx = df[df["cluster_name"] == cluster_name].index
-
-        if not row_idx.empty:
-            idx = row_idx[0]
-            df.at[idx, "predicted_diam"] = round(diameter, 2)
-            df.at[idx, "error_mm"] = round(abs(df.at[idx, "GT_diam"] - diameter), 2)
-            df.at[idx, "visibility"] = round(visibility, 2)
-            df.at[idx, "density"] = density
-            df.at[idx, "mm_dist"] = round(mm_dist, 4)
-            print(f"ROW {cluster_name} found")
-            print('____________')
+    for row in results.itertuples():
+        if row.status == "ok":
+            print(f"cluster {row.cluster_name}: diameter {row.predicted_diam:.2f}, mm_dist {row.mm_dist:.4f}, "
+                  f"density {row.density}, visibility {row.visibility:.2f}")
         else:
-            print(f"No row found with cluster_name = {cluster_name}")
-            print('____________')
-
-    except Exception as e:
-        print(f"Error processing {fname}: {e}")
-        continue
-
-
-
-# === Save updated Excel file ===
-df.to_excel(f'{fixed_path}/results.xlsx', index=False)
-print("Excel file updated successfully.")
-
-
+            print(f"Error processing cluster_0{row.cluster_name} ({row.error_stage}): {row.error}")
+
+
+    # 8- join the measurements to the table in one merge _______________________________________
+
+    df, unmatched = merge_results(df, results)
+    if unmatched:
+        print(f"No row found with cluster_name in {unmatched}")
+
+    if show_visibility_scene:
+        for row in results[results["status"] == "ok"].itertuples():
+            points, colors = read_cluster(clusters_folder, row.cluster_name)
+            points = np.asarray(points) * scaling_factor
+            center, radius, _ = fit_sphere(points, robust=sphere_fit_robust)
+            keep = np.abs(np.linalg.norm(points - center, axis=1) - radius) <= max_radial_error_mm
+            points, colors = points[keep], np.asarray(colors)[keep]
+            if refit_after_filter:
+                center, radius, _ = fit_sphere(points, robust=sphere_fit_robust)
+            show_visibility(radius, center, points, colors, subdivisions=visibility_subdivisions)
+
+
+    # === Save updated Excel file ===
+    df.to_excel(f'{fixed_path}/results.xlsx', index=False)
+    errors = results[results["status"] == "error"]
+    if len(errors):
+        errors.to_excel(f'{fixed_path}/results_errors.xlsx', index=False)
+        print(f"⚠️ {len(errors)} clusters failed, see results_errors.xlsx")
+    print("Excel file updated successfully.")
+    instrumentation.finish()
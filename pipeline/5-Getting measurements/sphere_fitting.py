@@ -0,0 +1,251 @@
+import numpy as np
+from instrumentation import traced
+
+############ Sphere fitting
+# Every function works on a batch of clusters at once: the clusters are concatenated into one (N, 3) array
+# (contiguous per cluster, with a segment id per point). Residuals and Jacobians of all clusters are computed
+# in single vectorized passes and each iteration solves all the per-cluster 4x4 systems together, so hundreds
+# of clusters are fitted without one scipy call (and numeric Jacobian) each.
+#   1- algebraic fit: |p|^2 = 2 c.p + (r^2 - |c|^2) is linear in (c, r^2 - |c|^2), solved in closed form
+#   2- refinement of the geometric residuals |p - c| - r by Levenberg-Marquardt with the analytic Jacobian
+#   3- optional robust modes for partially visible / merged fruits:
+#        "huber" / "tukey": M-estimator (iteratively reweighted refinement, scale from the MAD)
+#        "ransac": best 4-point sphere hypothesis, then refinement on its inliers (hypotheses larger than the
+#                  cluster are rejected; without inlier_threshold, the tolerance of the cluster is relative
+#                  to its least-median-of-squares hypothesis)
+HUBER_K = 1.345
+TUKEY_C = 4.685
+MAD_TO_SIGMA = 1.4826
+
+
+# === Batching helpers ===
+def _concat(point_sets):
+    counts = np.array([len(p) for p in point_sets], dtype=np.int64)
+    points = np.concatenate([np.asarray(p, dtype=np.float64).reshape(-1, 3) for p in point_sets]) \
+        if len(point_sets) else np.empty((0, 3))
+    segments = np.repeat(np.arange(len(point_sets)), counts)
+    return points, segments, counts
+
+
+def _segment_sum(values, segments, n):
+    return np.bincount(segments, weights=values, minlength=n)
+
+
+def _segment_median(values, segments, counts):
+    order = np.lexsort((values, segments))
+    ordered = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    safe = np.maximum(counts, 1)
+    lower = ordered[np.minimum(starts + (safe - 1) // 2, len(ordered) - 1)] if len(ordered) else np.zeros(len(counts))
+    upper = ordered[np.minimum(starts + safe // 2, len(ordered) - 1)] if len(ordered) else np.zeros(len(counts))
+    return np.where(counts > 0, 0.5 * (lower + upper), np.nan)
+
+
+def _normal_equations(system, counts, weights=None):
+    """
+    system (N, 5) = [A | b] stacked over contiguous segments.
+    Returns the per-segment A^T W A (n, 4, 4) and A^T W b (n, 4).
+    """
+    weighted = system[:, :4] if weights is None else system[:, :4] * weights[:, None]
+    out = np.zeros((len(counts), 4, 5))
+    stops = np.cumsum(counts)
+    # one small BLAS product per segment is faster than scattering the 14 products with bincount
+    for i in np.flatnonzero(counts):
+        out[i] = weighted[stops[i] - counts[i]:stops[i]].T @ system[stops[i] - counts[i]:stops[i]]
+    return out[:, :, :4], out[:, :, 4]
+
+
+def _solve(A, b):
+    # singular systems (degenerate clusters) give NaN instead of raising for the whole batch
+    out = np.full(b.shape, np.nan)
+    ok = np.abs(np.linalg.det(A)) > 1e-300
+    if ok.any():
+        out[ok] = np.linalg.solve(A[ok], b[ok][..., None])[..., 0]
+    return out
+
+
+# === 1- Algebraic initializer ===
+def _algebraic(points, segments, counts):
+    n = len(counts)
+    # centre every cluster on its mean for conditioning
+    mean = np.column_stack([_segment_sum(points[:, d], segments, n) for d in range(3)]) / np.maximum(counts, 1)[:, None]
+    local = points - np.repeat(mean, counts, axis=0)
+    system = np.empty((len(points), 5))
+    system[:, :3] = 2 * local
+    system[:, 3] = 1.0
+    system[:, 4] = np.einsum("ij,ij->i", local, local)
+    solution = _solve(*_normal_equations(system, counts))
+    center = solution[:, :3]
+    radius = np.sqrt(np.maximum(solution[:, 3] + np.einsum("ij,ij->i", center, center), 0.0))
+    return center + mean, radius
+
+
+def fit_spheres_algebraic(point_sets):
+    """Closed-form (algebraic) spheres of several clusters. Returns (centers (B, 3), radii (B,))."""
+    points, segments, counts = _concat(point_sets)
+    return _algebraic(points, segments, counts)
+
+
+# === 2- Levenberg-Marquardt refinement with analytic Jacobian ===
+def _linearize(points, counts, center, radius):
+    """
+    (N, 5) = [u | 1 | r] with u = (p - c) / |p - c| and r = |p - c| - R.
+    The Jacobian of r is -[u | 1], so [u | 1] gives J^T J and J^T r up to the sign.
+    """
+    system = np.empty((len(points), 5))
+    diff = points - np.repeat(center, counts, axis=0)
+    dist = np.maximum(np.sqrt(np.einsum("ij,ij->i", diff, diff)), 1e-12)
+    np.divide(diff, dist[:, None], out=system[:, :3])
+    system[:, 3] = 1.0
+    system[:, 4] = dist - np.repeat(radius, counts)
+    return system
+
+
+def _residuals(points, counts, center, radius):
+    diff = points - np.repeat(center, counts, axis=0)
+    return np.sqrt(np.einsum("ij,ij->i", diff, diff)) - np.repeat(radius, counts)
+
+
+def _refine(points, segments, counts, center, radius, weights=None, max_iter=50, xtol=1e-8, ftol=1e-8):
+    """
+    Weighted least squares of the geometric residuals r_i = |p_i - c| - R for every segment at once.
+    Jacobian rows: dr/dc = -(p_i - c) / |p_i - c|, dr/dR = -1.
+    Converged segments drop out, so later iterations only touch the points of the slow ones.
+    """
+    n = len(counts)
+    w = np.ones(len(points)) if weights is None else weights
+    center, radius = center.copy(), radius.copy()
+    lam = np.full(n, 1e-3)
+    system = _linearize(points, counts, center, radius)
+    cost = _segment_sum(w * system[:, 4] ** 2, segments, n)
+    active = np.isfinite(cost) & np.isfinite(radius) & (counts >= 4)
+    points, segments, w, system = points[active[segments]], segments[active[segments]], w[active[segments]], \
+        system[active[segments]]
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        cnt = np.where(active, counts, 0)
+        JtJ, Jtr = _normal_equations(system, cnt, None if weights is None else w)
+        step = _solve(JtJ + lam[:, None, None] * (JtJ * np.eye(4)), Jtr)
+        step[~active] = 0.0
+        new_center, new_radius = center + step[:, :3], radius + step[:, 3]
+        new_system = _linearize(points, cnt, new_center, new_radius)
+        new_cost = _segment_sum(w * new_system[:, 4] ** 2, segments, n)
+
+        better = active & np.isfinite(new_cost) & (new_cost <= cost)
+        # same stopping rules as scipy's least_squares: negligible cost decrease (ftol) or step (xtol)
+        flat = better & (cost - new_cost <= ftol * new_cost)
+        center[better], radius[better], cost[better] = new_center[better], new_radius[better], new_cost[better]
+        lam = np.where(better, np.maximum(lam / 10, 1e-12), np.minimum(lam * 10, 1e12))
+        accepted = better[segments]
+        system[accepted] = new_system[accepted]
+
+        scale = np.linalg.norm(np.column_stack((center, radius)), axis=1)
+        tiny = np.linalg.norm(step, axis=1) <= xtol * (xtol + scale)
+        still = active & ~tiny & ~flat & ~np.isnan(step).any(axis=1) & (lam < 1e12)
+        if not np.array_equal(still, active):
+            keep = still[segments]
+            points, segments, w, system = points[keep], segments[keep], w[keep], system[keep]
+        active = still
+    return center, np.abs(radius)
+
+
+# === 3- Robust modes ===
+def _robust_weights(res, segments, counts, robust):
+    sigma = MAD_TO_SIGMA * _segment_median(np.abs(res), segments, counts)
+    scaled = np.abs(res) / np.maximum(sigma[segments], 1e-12)
+    if robust == "huber":
+        return np.minimum(1.0, HUBER_K / np.maximum(scaled, 1e-12))
+    if robust == "tukey":
+        return np.where(scaled < TUKEY_C, (1 - (scaled / TUKEY_C) ** 2) ** 2, 0.0)
+    raise ValueError(f"Unknown M-estimator '{robust}'")
+
+
+def _m_estimator(points, segments, counts, center, radius, robust, iterations=20, tol=1e-6):
+    for _ in range(iterations):
+        res = _residuals(points, counts, center, radius)
+        weights = _robust_weights(res, segments, counts, robust)
+        new_center, new_radius = _refine(points, segments, counts, center, radius, weights=weights, max_iter=10)
+        moved = np.nanmax(np.abs(np.column_stack((new_center - center, new_radius - radius))) /
+                          np.maximum(np.abs(new_radius), 1e-12)[:, None], initial=0.0)
+        center, radius = new_center, new_radius
+        if moved <= tol:
+            break
+    return center, radius
+
+
+def _spheres_through_4_points(quads):
+    # (H, 4, 3) -> algebraic sphere through each quadruple (NaN for coplanar ones)
+    rows = np.concatenate((2 * quads, np.ones(quads.shape[:2] + (1,))), axis=2)
+    solution = _solve(rows, np.einsum("hij,hij->hi", quads, quads))
+    center = solution[:, :3]
+    return center, np.sqrt(np.maximum(solution[:, 3] + np.einsum("ij,ij->i", center, center), 0.0))
+
+
+def _ransac_one(points, threshold, relative_threshold, hypotheses, max_score_points, rng):
+    if len(points) < 4:
+        return np.ones(len(points), dtype=bool)
+    origin = points.mean(axis=0)
+    local = points - origin
+    quads = local[rng.integers(0, len(points), size=(hypotheses, 4))]
+    centers, radii = _spheres_through_4_points(quads)
+    scored = local if len(local) <= max_score_points else local[rng.choice(len(local), max_score_points, False)]
+    # (H, M) distances of the scored points to every hypothesis
+    errors = np.abs(np.linalg.norm(scored[None, :, :] - centers[:, None, :], axis=2) - radii[:, None])
+    # near-coplanar quadruples give huge spheres that pass close to every point of a cap: a fruit is never
+    # larger than the cluster around it
+    plausible = np.isfinite(radii) & (radii <= np.linalg.norm(np.ptp(local, axis=0)))
+    if not plausible.any():
+        return np.ones(len(points), dtype=bool)
+    if threshold is None:
+        # one tolerance for all the hypotheses of the cluster (a per-hypothesis relative_threshold * radius
+        # favours the largest spheres), relative to the least-median-of-squares hypothesis radius
+        median_errors = np.where(plausible, np.median(errors, axis=1), np.inf)
+        threshold = relative_threshold * radii[int(np.argmin(median_errors))]
+    scores = np.where(plausible, (errors <= threshold).sum(1), -1)
+    best = int(np.argmax(scores))
+    inliers = np.abs(np.linalg.norm(local - centers[best], axis=1) - radii[best]) <= threshold
+    return inliers if inliers.sum() >= 4 else np.ones(len(points), dtype=bool)
+
+
+# === Public API ===
+@traced("fit_spheres")
+def fit_spheres(point_sets, robust=None, inlier_threshold=None, relative_threshold=0.05,
+                ransac_hypotheses=256, ransac_score_points=2000, seed=0):
+    """
+    Fits one sphere per cluster in point_sets (list of (Ni, 3) arrays), all clusters in one vectorized call.
+    robust: None (plain least squares), "huber", "tukey" or "ransac".
+    inlier_threshold: absolute distance to the sphere for RANSAC inliers and for the returned inlier masks
+    (None = relative_threshold * radius; for RANSAC, one tolerance per cluster from a robust first radius).
+    Returns (centers (B, 3), radii (B,), inliers list of boolean masks). Clusters with fewer than 4 points
+    (or degenerate ones) get NaN.
+    """
+    points, segments, counts = _concat(point_sets)
+    if robust == "ransac":
+        rng = np.random.default_rng(seed)
+        masks = [_ransac_one(np.asarray(p, dtype=np.float64).reshape(-1, 3), inlier_threshold, relative_threshold,
+                             ransac_hypotheses, ransac_score_points, rng) for p in point_sets]
+        keep = np.concatenate(masks) if masks else np.empty(0, dtype=bool)
+        fit_points, fit_segments = points[keep], segments[keep]
+        fit_counts = np.bincount(fit_segments, minlength=len(counts))
+    else:
+        fit_points, fit_segments, fit_counts = points, segments, counts
+
+    center, radius = _algebraic(fit_points, fit_segments, fit_counts)
+    center, radius = _refine(fit_points, fit_segments, fit_counts, center, radius)
+    if robust in ("huber", "tukey"):
+        center, radius = _m_estimator(points, segments, counts, center, radius, robust)
+    bad = counts < 4
+    center[bad], radius[bad] = np.nan, np.nan
+
+    res = _residuals(points, counts, center, radius)
+    tolerance = inlier_threshold if inlier_threshold is not None else relative_threshold * radius[segments]
+    inside = np.abs(res) <= tolerance
+    inliers = np.split(inside, np.cumsum(counts)[:-1]) if len(counts) else []
+    return center, radius, inliers
+
+
+def fit_sphere(points, robust=None, inlier_threshold=None, **kwargs):
+    """Single-cluster fit_spheres. Returns (center (3,), radius, inlier mask)."""
+    centers, radii, inliers = fit_spheres([points], robust=robust, inlier_threshold=inlier_threshold, **kwargs)
+    return centers[0], float(radii[0]), inliers[0]
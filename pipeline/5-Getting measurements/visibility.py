@@ -0,0 +1,74 @@
+from functools import lru_cache
+import numpy as np
+import trimesh
+from scipy.spatial import cKDTree
+from instrumentation import traced
+
+############ Visibility estimation
+# Visibility of a fruit = % of the faces of an icosphere fitted on it (center, radius) that are the nearest
+# face to at least one of its points.
+# The nearest face center of the sphere (c, r) to p is the nearest face center of the unit icosphere to
+# (p - c) / r, so one unit icosphere and one KD-tree of its face centers serve every cluster.
+
+
+@lru_cache(maxsize=None)
+def unit_icosphere(subdivisions=3):
+    """(unit icosphere mesh, cKDTree of its face centers), built once per subdivision level."""
+    sphere = trimesh.creation.icosphere(subdivisions=subdivisions, radius=1.0)
+    return sphere, cKDTree(sphere.triangles_center)
+
+
+def nearest_faces(center, radius, points, subdivisions=3, workers=1):
+    """Index of the icosphere face nearest to every point."""
+    _, tree = unit_icosphere(subdivisions)
+    _, face_indices = tree.query((np.asarray(points, dtype=np.float64) - center) / radius, k=1, workers=workers)
+    return face_indices
+
+
+@traced("visibility")
+def estimate_visibility(centers, radii, point_sets, subdivisions=3, workers=1):
+    """
+    Visibility percentage of several clusters in one KD-tree query.
+    centers (B, 3), radii (B,), point_sets list of (Ni, 3) arrays. Clusters without a finite fit get NaN.
+    """
+    sphere, tree = unit_icosphere(subdivisions)
+    n_faces = len(sphere.faces)
+    centers, radii = np.asarray(centers, dtype=np.float64).reshape(-1, 3), np.asarray(radii, dtype=np.float64)
+    counts = np.array([len(p) for p in point_sets], dtype=np.int64)
+    valid = np.isfinite(radii) & (radii > 0) & np.all(np.isfinite(centers), axis=1)
+    counts = np.where(valid, counts, 0)
+    if counts.sum() == 0:
+        return np.where(valid, 0.0, np.nan)
+
+    local = np.concatenate([(np.asarray(p, dtype=np.float64) - c) / r
+                            for p, c, r, ok in zip(point_sets, centers, radii, valid) if ok and len(p)])
+    _, face_indices = tree.query(local, k=1, workers=workers)
+    # marked faces of every cluster = distinct (cluster, face) pairs
+    segments = np.repeat(np.arange(len(counts)), counts)
+    marked = np.unique(segments * n_faces + face_indices) // n_faces
+    percent = 100 * np.bincount(marked, minlength=len(counts)) / n_faces
+    return np.where(valid, percent, np.nan)
+
+
+def visibility_percent(radius, center, points, subdivisions=3):
+    """Single-cluster estimate_visibility, same arguments as the former get_visibility."""
+    return float(estimate_visibility([center], [radius], [points], subdivisions)[0])
+
+
+def show_visibility(radius, center, points, colors=None, subdivisions=3):
+    """Interactive scene: the cluster, its icosphere and the vertices of the marked faces in red."""
+    unit, _ = unit_icosphere(subdivisions)
+    sphere = unit.copy()
+    sphere.apply_scale(radius)
+    sphere.apply_translation(center)
+    marked_faces = np.unique(nearest_faces(center, radius, points, subdivisions))
+
+    vertex_colors = np.tile(np.array([0, 0, 0, 255], dtype=np.uint8), (len(sphere.vertices), 1))
+    vertex_colors[np.unique(sphere.faces[marked_faces])] = [255, 0, 0, 255]
+
+    point_colors = None if colors is None else (np.asarray(colors) * 255).astype(np.uint8)
+    scene = trimesh.Scene()
+    scene.add_geometry(trimesh.points.PointCloud(vertices=points, colors=point_colors), node_name='point_cloud')
+    scene.add_geometry(sphere, node_name='icosphere')
+    scene.add_geometry(trimesh.points.PointCloud(sphere.vertices, colors=vertex_colors), node_name='vertices')
+    scene.show()
@@ -0,0 +1,47 @@
+import instrumentation
+from orchestrator import run_scans
+from pipeline_stages import build_stages
+
+
+###################################################################################
+
+# Scans to process: {scan folder: {stage: {param: value}}}. Each folder holds video.mp4 and set_fruits.txt
+# (see pipeline_stages.py for the layout); everything else is produced inside it.
+scans = {
+    "C:/Users/HP/Desktop/scans/set1": {},
+    "C:/Users/HP/Desktop/scans/set2": {"frames": {"extraction_mode": "non_redundant"}},
+}
+reconstruction = "3dgs"  # "mvs", "3dgs" or "sugar"
+# Parameters shared by every scan (per-scan values win)
+overrides = {
+    "measurements": {"all_fruits_path": "C:/Users/HP/Desktop/3DReconstruction/Dataset/all_fruits.xlsx"},
+}
+# External tools (argv prefixes), see DEFAULT_COMMANDS in orchestrator.py
+commands = {
+    "train_3dgs": ["python", "C:/Users/HP/Desktop/gaussian-splatting/train.py"],
+    "gauss_to_pc": ["python", "C:/Users/HP/Desktop/3DGS-to-PC/gauss_to_pc.py"],
+}
+max_workers = 2   # scans processed at the same time
+only = None       # e.g. ["denoise", "clustering", "measurements"] to consider only some stages
+force = []        # stages to rerun even if up to date
+dry_run = False   # only print what would run
+trace_dir = None  # run report + Chrome trace folder (None = off, unless PIPELINE_TRACE_DIR is set)
+
+
+###################################################################################
+
+# Guard needed by the process pools of the stages (workers re-import this file on Windows)
+if __name__ == "__main__":
+    instrumentation.start("pipeline", trace_dir)
+    reports = run_scans(scans, build_stages(reconstruction), overrides, commands, max_workers=max_workers,
+                        only=only, force=force, dry_run=dry_run)
+
+    print("\n=== Summary ===")
+    for scan_dir, report in reports.items():
+        print(scan_dir)
+        for entry in report:
+            line = f"   {entry['stage']:<14} {entry['status']:<10} {entry['seconds']:8.1f}s"
+            if entry["error"]:
+                line += f"  {entry['error']}"
+            print(line)
+    instrumentation.finish()
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs(["benchmarks"])
+from mask_compositing import composite_dir
+from synthetic_data import disk_mask_dataset
+
+# === CONFIG ===
+n_images = 24
+image_size = (1080, 1920)  # (H, W)
+fruits_per_image = 30
+num_workers = os.cpu_count()
+seed = 0
+
+
+# === Reference: the original per-coordinate loop of Getting_png_mask_from_txt.py ===
+def legacy_composite(imgs_dir, masks_txt_dir, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    for mask_filename in os.listdir(masks_txt_dir):
+        img_id = os.path.splitext(mask_filename)[0]
+        image = Image.open(os.path.join(imgs_dir, f"{img_id}.jpg")).convert("RGBA")
+        image_data = np.array(image)
+        height, width = image.size[1], image.size[0]
+        output_data = np.zeros((height, width, 4), dtype=np.uint8)
+        with open(os.path.join(masks_txt_dir, mask_filename), "r") as f:
+            lines = f.readlines()
+        coords_started = False
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            if "Mask" in line:
+                coords_started = True
+                continue
+            if coords_started:
+                for part in line.split():
+                    if "," in part:
+                        x, y = map(int, part.split(","))
+                        if 0 <= x < width and 0 <= y < height:
+                            output_data[y, x] = [image_data[y, x][0], image_data[y, x][1], image_data[y, x][2], 255]
+        Image.fromarray(output_data, "RGBA").save(os.path.join(output_dir, f"{img_id}.png"))
+
+
+def same_pngs(dir_a, dir_b):
+    for name in os.listdir(dir_a):
+        if not np.array_equal(np.array(Image.open(os.path.join(dir_a, name))),
+                              np.array(Image.open(os.path.join(dir_b, name)))):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    root = tempfile.mkdtemp(prefix="bench_masks_")
+    try:
+        imgs_dir, txt_dir, msk_dir, _ = disk_mask_dataset(root, np.random.default_rng(seed), n_images, image_size,
+                                                         fruits_per_image)
+        print(f"{n_images} images {image_size[1]}x{image_size[0]}, {fruits_per_image} masks each")
+
+        start = time.perf_counter()
+        legacy_composite(imgs_dir, txt_dir, os.path.join(root, "legacy"))
+        legacy_s = time.perf_counter() - start
+        print(f"legacy loop          : {n_images / legacy_s:8.2f} images/s")
+
+        for masks_dir, fmt in ((txt_dir, "txt"), (msk_dir, "msk")):
+            for workers in (1, num_workers):
+                out = os.path.join(root, f"{fmt}_{workers}")
+                summary = composite_dir(imgs_dir, masks_dir, out, num_workers=workers)
+                identical = same_pngs(os.path.join(root, "legacy"), out)
+                print(f"{fmt} x {workers:2d} workers    : {summary['images_per_s']:8.2f} images/s"
+                      f"  pixel-identical: {identical}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
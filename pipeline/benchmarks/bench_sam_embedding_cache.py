@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+from segment_anything import sam_model_registry, SamPredictor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs(["benchmarks"])
+from sam_embedding_cache import EmbeddingCache
+
+# === CONFIG ===
+checkpoint_path = "/teamspace/studios/this_studio/segment-anything/weights/sam_vit_b_01ec64.pth"
+model_type = "vit_b"
+n_images = 5
+image_size = (1080, 1920)  # (H, W)
+boxes_per_image = 20
+seed = 0
+
+
+# Segments every image once: set_image (through the cache) + one predict() per box
+def segment_all(predictor, cache, images, boxes):
+    start = time.perf_counter()
+    masks = []
+    for image, image_boxes in zip(images, boxes):
+        cache.set_image(predictor, image)
+        for box in image_boxes:
+            m, _, _ = predictor.predict(box=box[None, :], multimask_output=False)
+            masks.append(m[0])
+    return time.perf_counter() - start, masks
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(seed)
+    H, W = image_size
+    images = [rng.integers(0, 256, size=(H, W, 3), dtype=np.uint8) for _ in range(n_images)]
+    boxes = []
+    for _ in range(n_images):
+        x0, y0 = rng.integers(0, W - 200, boxes_per_image), rng.integers(0, H - 200, boxes_per_image)
+        size = rng.integers(40, 200, boxes_per_image)
+        boxes.append(np.column_stack((x0, y0, x0 + size, y0 + size)))
+
+    sam = sam_model_registry[model_type](checkpoint=checkpoint_path)
+    sam.to("cpu")
+    predictor = SamPredictor(sam)
+
+    cache_dir = tempfile.mkdtemp(prefix="bench_sam_cache_")
+    try:
+        cache = EmbeddingCache(cache_dir, model_type)
+        cold_s, cold_masks = segment_all(predictor, cache, images, boxes)
+        warm_s, warm_masks = segment_all(predictor, cache, images, boxes)
+        identical = all(np.array_equal(a, b) for a, b in zip(cold_masks, warm_masks))
+        print(f"{n_images} images {W}x{H}, {boxes_per_image} boxes each")
+        print(f"cold run : {cold_s:8.2f}s ({cold_s / n_images:.2f}s/image)")
+        print(f"warm run : {warm_s:8.2f}s ({warm_s / n_images:.2f}s/image)  speed-up x{cold_s / warm_s:.1f}")
+        print(f"cache    : {cache.stats()}  masks identical: {identical}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
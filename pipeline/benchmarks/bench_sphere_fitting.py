@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import numpy as np
+from scipy.optimize import least_squares
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs(["benchmarks"])
+from sphere_fitting import fit_spheres
+from synthetic_data import partial_sphere
+
+# === CONFIG ===
+n_clusters = 300
+points_per_cluster = (500, 5000)
+radius_mm = (30, 45)
+visible_fraction = (0.15, 0.6)   # fraction of the sphere surface seen by the cameras
+noise_mm = 0.5
+outlier_fraction = 0.1           # leaves / neighbour fruit points glued to the cluster
+seed = 0
+
+
+# === Current fitter (scaling_spherefitting_visibility_estimation.py) ===
+def residuals(params, points):
+    x0, y0, z0, r = params
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+    return np.sqrt((x - x0)**2 + (y - y0)**2 + (z - z0)**2) - r
+
+
+def fit_sphere_to_points(points):
+    center_guess = np.mean(points, axis=0)
+    radius_guess = np.mean(np.linalg.norm(points - center_guess, axis=1))
+    params0 = np.append(center_guess, radius_guess)
+    result = least_squares(residuals, params0, args=(points,))
+    x0, y0, z0, r = result.x
+    return np.array([x0, y0, z0]), r
+
+
+def errors(centers, radii, true_centers, true_radii):
+    diam = np.abs(2 * radii - 2 * true_radii)
+    cen = np.linalg.norm(centers - true_centers, axis=1)
+    return np.nanmedian(diam), np.nanpercentile(diam, 90), np.nanmedian(cen)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(seed)
+    true_centers = rng.uniform(-500, 500, size=(n_clusters, 3))
+    true_radii = rng.uniform(*radius_mm, size=n_clusters)
+    clusters = [partial_sphere(rng, c, r, int(rng.integers(*points_per_cluster)), rng.uniform(*visible_fraction),
+                               noise_mm, outlier_fraction) for c, r in zip(true_centers, true_radii)]
+    print(f"{n_clusters} partial spheres, {sum(len(c) for c in clusters):,} points, "
+          f"{100 * outlier_fraction:.0f}% outliers, noise {noise_mm} mm")
+    print(f"{'fitter':<24}{'ms/cluster':>12}{'diam err median':>18}{'diam err p90':>15}{'center err':>13}")
+
+    start = time.perf_counter()
+    legacy = [fit_sphere_to_points(c) for c in clusters]
+    elapsed = time.perf_counter() - start
+    med, p90, cen = errors(np.array([c for c, _ in legacy]), np.array([r for _, r in legacy]),
+                           true_centers, true_radii)
+    print(f"{'current (least_squares)':<24}{1000 * elapsed / n_clusters:>12.2f}{med:>18.2f}{p90:>15.2f}{cen:>13.2f}")
+
+    for robust in (None, "huber", "tukey", "ransac"):
+        start = time.perf_counter()
+        centers, radii, _ = fit_spheres(clusters, robust=robust)
+        elapsed = time.perf_counter() - start
+        med, p90, cen = errors(centers, radii, true_centers, true_radii)
+        name = f"batched {robust or 'lsq'}"
+        print(f"{name:<24}{1000 * elapsed / n_clusters:>12.2f}{med:>18.2f}{p90:>15.2f}{cen:>13.2f}")
+
+    # the plain batched fit must land on the same minimum as the current fitter on clean clusters
+    clean = [partial_sphere(rng, c, r, 2000, 0.4, noise_mm, 0.0) for c, r in zip(true_centers[:50], true_radii[:50])]
+    centers, radii, _ = fit_spheres(clean)
+    legacy_radii = np.array([fit_sphere_to_points(c)[1] for c in clean])
+    print(f"clean clusters, max |radius batched - current|: {np.max(np.abs(radii - legacy_radii)):.2e} mm")
@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs(["benchmarks"])
+from synthetic_data import render_video, disk_mask_dataset, disks_union, fruit_cloud, write_cloud_ply
+from cloud_clustering import peak_rss_mb
+
+############ Benchmark suite of the Python stages on deterministic synthetic data
+# Every (stage, scale) case runs in its own process on data generated beforehand, so its peak memory is its own.
+# For each case: wall time of the stage call, throughput, peak RSS of the process, growth of the peak during the
+# call, and accuracy against the known ground truth. Results go to output_path; with baseline_path set to an
+# earlier results file, slower / heavier / less accurate cases are flagged.
+
+# === CONFIG ===
+stages = ["frames", "masks", "denoise", "clustering", "spheres", "visibility", "measurements"]
+frame_scales = [10, 100, 1000]                              # frames per video
+image_scales = [10, 100, 1000]                              # images per mask folder
+point_scales = [10_000, 100_000, 1_000_000, 10_000_000]     # points per cloud
+video_size = (360, 640)       # (H, W)
+image_size = (360, 640)       # (H, W)
+fruits_per_image = 20
+points_per_fruit = 2000
+num_workers = os.cpu_count()
+data_dir = None               # keep generated datasets here between runs (None = temporary folder)
+output_path = os.path.join(HERE, "bench_results.json")
+baseline_path = None          # earlier bench_results.json to compare against
+regression_tolerance = 0.10   # relative change flagged as a regression (throughput, memory)
+# accuracy metrics: (better direction, change ignored in the worse direction, in the metric's units);
+# metrics not listed here (counts kept for information) are never flagged
+ACCURACY_METRICS = {
+    "sharpest_picked": ("higher", 0.01),
+    "mask_iou": ("higher", 0.005),
+    "outliers_removed": ("higher", 0.01),
+    "fruit_points_kept": ("higher", 0.01),
+    "adjusted_rand_index": ("higher", 0.01),
+    "cluster_count_err": ("lower", 0),
+    "diam_err_median_mm": ("lower", 0.1),
+    "diam_err_p90_mm": ("lower", 0.2),
+    "visibility_err_pp": ("lower", 0.5),
+    "failed": ("lower", 0),
+}
+seed = 0
+
+SCALES = {"frames": frame_scales, "masks": image_scales}
+
+
+# === Datasets (generated once per scale, reused by every stage that needs them) ===
+def video_data(root, n_frames):
+    path = os.path.join(root, f"video_{n_frames}.mp4")
+    if not os.path.exists(path):
+        sigmas = render_video(path, n_frames, video_size, seed=seed)
+        np.save(os.path.join(root, f"video_{n_frames}_sigmas.npy"), sigmas)
+    return path
+
+
+def mask_data(root, n_images):
+    folder = os.path.join(root, f"masks_{n_images}")
+    if not os.path.exists(os.path.join(folder, "disks.npy")):
+        _, _, _, disks = disk_mask_dataset(folder, np.random.default_rng(seed), n_images, image_size,
+                                           fruits_per_image, radius_px=(8, 30), write_msk=False)
+        np.save(os.path.join(folder, "disks.npy"), disks)
+    return folder
+
+
+def cloud_data(root, n_points):
+    path = os.path.join(root, f"cloud_{n_points}.ply")
+    if not os.path.exists(path):
+        points, colors, labels, centers, radii, fractions = fruit_cloud(n_points, points_per_fruit, seed=seed)
+        write_cloud_ply(path, points, colors)
+        np.savez(os.path.join(root, f"cloud_{n_points}_truth.npz"), labels=labels, centers=centers, radii=radii,
+                 fractions=fractions)
+    return path
+
+
+def dataset(root, stage, scale):
+    if stage == "frames":
+        return video_data(root, scale)
+    if stage == "masks":
+        return mask_data(root, scale)
+    return cloud_data(root, scale)
+
+
+# === Cases: each loads its data, then returns (call, unit); call() runs the stage and returns (items, accuracy) ===
+def _load_cloud(path):
+    from ply_io import read_vertices, xyz
+    vertices = read_vertices(path)
+    truth = np.load(path.replace(".ply", "_truth.npz"))
+    colors = np.column_stack([vertices[c] for c in ("red", "green", "blue")]) / 255.0
+    return xyz(vertices).astype(np.float64), colors, truth
+
+
+def _fruit_sets(points, labels):
+    order = np.argsort(labels, kind="stable")
+    bounds = np.searchsorted(labels[order], np.arange(labels.max() + 2))
+    return [points[order[s:e]] for s, e in zip(bounds[:-1], bounds[1:])]
+
+
+def case_frames(path, work_dir):
+    from frame_selection import group_size, adaptive_blur_threshold, extract_sharp_frames_streaming
+    sigmas = np.load(path.replace(".mp4", "_sigmas.npy"))
+
+    def call():
+        cap = cv2.VideoCapture(path)
+        N = group_size(cap.get(cv2.CAP_PROP_FPS))
+        threshold = adaptive_blur_threshold(video_size[1], video_size[0])
+        summary = extract_sharp_frames_streaming(cap, work_dir, N, threshold, num_workers=num_workers)
+        cap.release()
+        # a pick is right when no frame of its group is less blurred
+        right = [sigmas[idx] == sigmas[idx - idx % N:idx - idx % N + N].min() for _, idx, _ in summary["saved"]]
+        return summary["frames_read"], {"sharpest_picked": float(np.mean(right)) if right else 0.0,
+                                        "groups_kept": len(right) / max(1, len(sigmas) // N)}
+    return call, "frames/s"
+
+
+def case_masks(folder, work_dir):
+    from mask_codec import convert_txt_dir, read_masks, union_mask
+    from mask_compositing import composite_dir
+    disks = np.load(os.path.join(folder, "disks.npy"))
+    msk_dir = os.path.join(work_dir, "masks_msk")
+
+    def call():
+        convert_txt_dir(os.path.join(folder, "masks_txt"), os.path.join(folder, "imgs"), msk_dir)
+        composite_dir(os.path.join(folder, "imgs"), msk_dir, os.path.join(work_dir, "png"), num_workers=num_workers)
+        return len(disks), {}
+
+    def accuracy():
+        ious = []
+        for i in range(min(len(disks), 20)):
+            shape, instances = read_masks(os.path.join(msk_dir, f"{i}.msk"), cropped=True)
+            truth, found = disks_union(disks[i], shape), union_mask(instances, shape)
+            ious.append(np.count_nonzero(truth & found) / max(1, np.count_nonzero(truth | found)))
+        return {"mask_iou": float(np.mean(ious))}
+    return call, "images/s", accuracy
+
+
+def case_denoise(path, work_dir):
+    from outlier_removal import remove_statistical_outlier_tiled
+    truth = np.load(path.replace(".ply", "_truth.npz"))
+    outlier = truth["labels"] < 0
+
+    def call():
+        report, keep = remove_statistical_outlier_tiled(path, os.path.join(work_dir, "cleaned.ply"),
+                                                        num_workers=num_workers, tmp_dir=work_dir)
+        return report["points"], {"outliers_removed": float(np.mean(~keep[outlier])) if outlier.any() else 1.0,
+                                  "fruit_points_kept": float(np.mean(keep[~outlier]))}
+    return call, "points/s"
+
+
+def case_clustering(path, work_dir):
+    from cloud_clustering import cluster_multiresolution, label_agreement
+    points, _, truth = _load_cloud(path)
+
+    def call():
+        labels, info = cluster_multiresolution(points, min_cluster_size=points_per_fruit // 4, num_workers=num_workers)
+        agreement = label_agreement(labels, truth["labels"])
+        return len(points), {"adjusted_rand_index": agreement["adjusted_rand_index"], "clusters": info["clusters"],
+                             "true_clusters": len(truth["radii"]),
+                             "cluster_count_err": abs(info["clusters"] - len(truth["radii"]))}
+    return call, "points/s"
+
+
+def case_spheres(path, work_dir):
+    from sphere_fitting import fit_spheres
+    points, _, truth = _load_cloud(path)
+    sets = _fruit_sets(points, truth["labels"])
+
+    def call():
+        _, radii, _ = fit_spheres(sets)
+        error = np.abs(2 * radii - 2 * truth["radii"])
+        return len(sets), {"diam_err_median_mm": float(np.nanmedian(error)),
+                           "diam_err_p90_mm": float(np.nanpercentile(error, 90))}
+    return call, "clusters/s"
+
+
+def case_visibility(path, work_dir):
+    from visibility import estimate_visibility
+    points, _, truth = _load_cloud(path)
+    sets = _fruit_sets(points, truth["labels"])
+
+    def call():
+        visibility = estimate_visibility(truth["centers"], truth["radii"], sets)
+        return len(sets), {"visibility_err_pp": float(np.mean(np.abs(visibility - 100 * truth["fractions"])))}
+    return call, "clusters/s"
+
+
+def case_measurements(path, work_dir):
+    from cluster_store import write_cluster_store
+    from measurement_runner import run_measurements
+    points, colors, truth = _load_cloud(path)
+    store = os.path.join(work_dir, "clusters")
+    write_cluster_store(store, points, colors, truth["labels"])
+
+    def call():
+        results = run_measurements(store, 1.0, num_workers=num_workers, log=lambda message: None)
+        ok = results[results["status"] == "ok"]
+        error = np.abs(ok["predicted_diam"].to_numpy() - 2 * truth["radii"][ok["cluster_name"].to_numpy()])
+        return len(results), {"diam_err_median_mm": float(np.median(error)) if len(error) else float("nan"),
+                              "failed": int((results["status"] != "ok").sum())}
+    return call, "clusters/s"
+
+
+CASES = {"frames": case_frames, "masks": case_masks, "denoise": case_denoise, "clustering": case_clustering,
+         "spheres": case_spheres, "visibility": case_visibility, "measurements": case_measurements}
+
+
+def run_case(stage, data_path):
+    """Runs one case in this process and returns its measurements."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench_{stage}_")
+    try:
+        call, unit, *extra = CASES[stage](data_path, work_dir)
+        peak_before = peak_rss_mb()
+        start = time.perf_counter()
+        items, accuracy = call()
+        seconds = time.perf_counter() - start
+        peak = peak_rss_mb()
+        if extra:
+            accuracy.update(extra[0]())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"seconds": seconds, "items": items, "throughput": items / max(seconds, 1e-9), "unit": unit,
+            "peak_rss_mb": peak, "stage_peak_mb": max(0.0, peak - peak_before), "accuracy": accuracy}
+
+
+# === Report ===
+def compare(results, baseline):
+    """Lines for the cases that got slower, heavier or less accurate than in baseline."""
+    previous = {(r["stage"], r["scale"]): r for r in baseline}
+    flags = []
+    for r in results:
+        old = previous.get((r["stage"], r["scale"]))
+        if old is None or "error" in r or "error" in old:
+            continue
+        case = f"{r['stage']} @ {r['scale']:,}"
+        if r["throughput"] < old["throughput"] * (1 - regression_tolerance):
+            flags.append(f"{case}: throughput {old['throughput']:,.1f} -> {r['throughput']:,.1f} {r['unit']}")
+        if r["peak_rss_mb"] > old["peak_rss_mb"] * (1 + regression_tolerance):
+            flags.append(f"{case}: peak memory {old['peak_rss_mb']:,.0f} -> {r['peak_rss_mb']:,.0f} MB")
+        for name, value in r["accuracy"].items():
+            before = old["accuracy"].get(name)
+            if before is None or name not in ACCURACY_METRICS:
+                continue
+            direction, tolerance = ACCURACY_METRICS[name]
+            worse_by = before - value if direction == "higher" else value - before
+            # a NaN (no result) after a number is a regression too
+            if worse_by > tolerance or (np.isnan(value) and not np.isnan(before)):
+                flags.append(f"{case}: {name} {before:.4g} -> {value:.4g}")
+    return flags
+
+
+def _accuracy_text(accuracy):
+    return "  ".join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}" for k, v in accuracy.items())
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--case":
+        # child process: one case, result as JSON on the last line
+        print(json.dumps(run_case(sys.argv[2], sys.argv[3])))
+        sys.exit(0)
+
+    root = data_dir or tempfile.mkdtemp(prefix="bench_data_")
+    os.makedirs(root, exist_ok=True)
+    results = []
+    print(f"{'stage':<14}{'scale':>12}{'seconds':>10}{'throughput':>22}{'peak MB':>10}{'stage MB':>10}  accuracy")
+    try:
+        for stage in stages:
+            for scale in SCALES.get(stage, point_scales):
+                data_path = dataset(root, stage, scale)
+                child = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", stage, data_path],
+                                       capture_output=True, text=True)
+                result = {"stage": stage, "scale": scale}
+                if child.returncode != 0:
+                    result["error"] = child.stderr.strip().splitlines()[-1] if child.stderr.strip() else "failed"
+                    print(f"{stage:<14}{scale:>12,}  ❌ {result['error']}")
+                else:
+                    result.update(json.loads(child.stdout.strip().splitlines()[-1]))
+                    print(f"{stage:<14}{scale:>12,}{result['seconds']:>10.2f}"
+                          f"{result['throughput']:>13,.1f} {result['unit']:<8}{result['peak_rss_mb']:>10.0f}"
+                          f"{result['stage_peak_mb']:>10.0f}  {_accuracy_text(result['accuracy'])}")
+                results.append(result)
+    finally:
+        if data_dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    with open(output_path, "w") as f:
+        json.dump({"python": sys.version.split()[0], "num_workers": num_workers, "results": results}, f, indent=2)
+    print(f"✅ Results saved to {output_path}")
+
+    if baseline_path is not None:
+        with open(baseline_path, "r") as f:
+            flags = compare(results, json.load(f)["results"])
+        print("⚠️ Changes against the baseline:" if flags else "✅ No regression against the baseline")
+        for line in flags:
+            print(f"   {line}")
@@ -0,0 +1,143 @@
+import os
+import numpy as np
+import cv2
+
+from mask_codec import encode_mask, write_masks_txt, write_encoded_masks
+from ply_io import write_ply
+
+############ Deterministic synthetic data for the benchmarks
+# Same seed -> same files, so timings and accuracies of two runs (or two commits) are comparable.
+#   render_video      a camera panning over a textured scene with oranges, every frame blurred by a known sigma
+#   disk_mask_dataset images with disk masks in the legacy .txt format written by SAM.py (and .msk)
+#   fruit_cloud       noisy partial spheres of known centers / diameters plus scattered outliers
+PLY_DTYPE = np.dtype([("x", "<f4"), ("y", "<f4"), ("z", "<f4"), ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+
+
+# === Video ===
+def render_video(path, n_frames, frame_size=(360, 640), fps=30, blur_sigmas=(0, 1.5, 3, 5), pan_px=4,
+                 n_fruits=40, seed=0):
+    """
+    Writes an .mp4 of n_frames (H, W) frames cropped from a wide scene that pans by pan_px per frame.
+    Each frame gets a Gaussian blur drawn from blur_sigmas (0 = sharp). Returns the per-frame sigmas.
+    """
+    rng = np.random.default_rng(seed)
+    H, W = frame_size
+    pano_w = W + pan_px * n_frames
+    coarse = rng.integers(40, 200, size=(max(2, H // 16), max(2, pano_w // 16), 3), dtype=np.uint8)
+    scene = cv2.resize(coarse, (pano_w, H), interpolation=cv2.INTER_CUBIC).astype(np.int16)
+    scene += rng.integers(-25, 26, size=scene.shape, dtype=np.int16)  # leaf texture the Laplacian responds to
+    scene = np.clip(scene, 0, 255).astype(np.uint8)
+    for _ in range(n_fruits * pano_w // W):
+        center = (int(rng.integers(0, pano_w)), int(rng.integers(0, H)))
+        cv2.circle(scene, center, int(rng.integers(H // 30, H // 10)), (0, 140, 255), -1, cv2.LINE_AA)
+
+    sigmas = rng.choice(np.asarray(blur_sigmas, dtype=np.float64), size=n_frames)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (W, H))
+    try:
+        for i, sigma in enumerate(sigmas):
+            frame = np.ascontiguousarray(scene[:, i * pan_px:i * pan_px + W])
+            if sigma > 0:
+                frame = cv2.GaussianBlur(frame, (0, 0), sigma)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return sigmas
+
+
+# === 2D masks ===
+def disk_mask_dataset(root, rng, n_images, image_size, fruits_per_image, radius_px=(10, 60), write_msk=True):
+    """
+    Noise images (imgs/<i>.jpg) with random disk masks in masks_txt/<i>.txt (and masks_msk/<i>.msk).
+    Returns (imgs_dir, txt_dir, msk_dir, disks) with disks (n_images, fruits_per_image, 3) = cx, cy, r.
+    """
+    imgs_dir, txt_dir, msk_dir = (os.path.join(root, d) for d in ("imgs", "masks_txt", "masks_msk"))
+    for d in (imgs_dir, txt_dir) + ((msk_dir,) if write_msk else ()):
+        os.makedirs(d, exist_ok=True)
+    H, W = image_size
+    yy, xx = np.mgrid[:H, :W]
+    disks = np.zeros((n_images, fruits_per_image, 3), dtype=np.int64)
+    for i in range(n_images):
+        image = rng.integers(0, 256, size=(H, W, 3), dtype=np.uint8)
+        cv2.imwrite(os.path.join(imgs_dir, f"{i}.jpg"), image)
+        encoded, labels = [], []
+        for j in range(fruits_per_image):
+            cx, cy, r = rng.integers(0, W), rng.integers(0, H), rng.integers(*radius_px)
+            disks[i, j] = cx, cy, r
+            encoded.append(encode_mask((xx - cx) ** 2 + (yy - cy) ** 2 <= r * r))
+            labels.append(f"{j + 1}. orange,")
+        write_masks_txt(os.path.join(txt_dir, f"{i}.txt"), encoded, labels)
+        if write_msk:
+            write_encoded_masks(os.path.join(msk_dir, f"{i}.msk"), (H, W), encoded, labels)
+    return imgs_dir, txt_dir, msk_dir, disks
+
+
+def disks_union(disks, image_size):
+    """Ground-truth union mask of one image's disks."""
+    H, W = image_size
+    yy, xx = np.mgrid[:H, :W]
+    union = np.zeros((H, W), dtype=bool)
+    for cx, cy, r in disks:
+        union |= (xx - cx) ** 2 + (yy - cy) ** 2 <= r * r
+    return union
+
+
+# === Point clouds ===
+def partial_sphere(rng, center, radius, n, fraction, noise, outliers):
+    """Noisy points of the spherical cap facing a random direction, plus a fraction of outliers."""
+    view = rng.normal(size=3)
+    view /= np.linalg.norm(view)
+    n_out = int(round(outliers * n))
+    dirs = rng.normal(size=(4 * n, 3))
+    dirs /= np.linalg.norm(dirs, axis=1, keepdims=True)
+    # a cap covering `fraction` of the sphere: dot(dir, view) >= 1 - 2 * fraction
+    dirs = dirs[dirs @ view >= 1 - 2 * fraction][:n - n_out]
+    points = center + dirs * (radius + rng.normal(scale=noise, size=(len(dirs), 1)))
+    # outliers: a blob next to the cap (a leaf or a second fruit)
+    blob = center + view * radius * 1.3 + rng.normal(scale=0.3 * radius, size=(n_out, 3))
+    return np.vstack((points, blob))
+
+
+def fruit_cloud(n_points, points_per_fruit=2000, radius_mm=(30, 45), visible_fraction=(0.3, 0.6), noise_mm=0.5,
+                outlier_fraction=0.01, seed=0):
+    """
+    About n_points points (mm): partial spheres on a jittered grid (no two fruits touch) plus uniform outliers.
+    Returns (points (N, 3), colors (N, 3) in [0, 1], labels (N,) with -1 for outliers,
+    centers (F, 3), radii (F,), visible fractions (F,)).
+    """
+    rng = np.random.default_rng(seed)
+    n_outliers = int(round(outlier_fraction * n_points))
+    n_fruits = max(1, (n_points - n_outliers) // points_per_fruit)
+    side = int(np.ceil(np.sqrt(n_fruits)))
+    spacing = 3 * radius_mm[1]
+    grid = np.stack(np.unravel_index(np.arange(n_fruits), (side, side)), axis=1) * spacing
+    centers = np.column_stack((grid + rng.uniform(-0.2, 0.2, (n_fruits, 2)) * spacing,
+                               rng.uniform(-radius_mm[1], radius_mm[1], n_fruits)))
+    radii = rng.uniform(*radius_mm, size=n_fruits)
+    fractions = rng.uniform(*visible_fraction, size=n_fruits)
+
+    points, labels = [], []
+    for label, (center, radius, fraction) in enumerate(zip(centers, radii, fractions)):
+        fruit = partial_sphere(rng, center, radius, points_per_fruit, fraction, noise_mm, 0.0)
+        points.append(fruit)
+        labels.append(np.full(len(fruit), label, dtype=np.int64))
+    low, high = centers.min(axis=0) - spacing, centers.max(axis=0) + spacing
+    points.append(rng.uniform(low, high, size=(n_outliers, 3)))
+    labels.append(np.full(n_outliers, -1, dtype=np.int64))
+
+    points, labels = np.vstack(points), np.concatenate(labels)
+    colors = np.where(labels[:, None] >= 0, [1.0, 0.55, 0.0], [0.1, 0.5, 0.1])
+    colors = np.clip(colors + rng.normal(scale=0.05, size=colors.shape), 0, 1)
+    return points, colors, labels, centers, radii, fractions
+
+
+def write_cloud_ply(path, points, colors, chunk_size=1_000_000):
+    """Binary little-endian PLY with float xyz and uchar colors, like the reconstruction outputs."""
+    def chunks():
+        for s in range(0, len(points), chunk_size):
+            e = min(s + chunk_size, len(points))
+            vertices = np.zeros(e - s, dtype=PLY_DTYPE)
+            vertices["x"], vertices["y"], vertices["z"] = points[s:e].T
+            rgb = np.round(colors[s:e] * 255).astype(np.uint8)
+            vertices["red"], vertices["green"], vertices["blue"] = rgb.T
+            yield vertices
+    write_ply(path, PLY_DTYPE, chunks(), len(points))
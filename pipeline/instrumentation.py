@@ -0,0 +1,219 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+
+############ Instrumentation: nested timing spans, counters and memory sampling
+# Off by default: span() then returns one shared no-op context manager and count() returns at once,
+# so instrumented code pays a function call per span. start() turns it on for the current process:
+#   with span("knn", tile=3): ...     timed, nested per thread; keyword arguments end up in the trace
+#   count("frames_kept", n)           named counters
+# and a background thread samples the resident memory every memory_interval seconds.
+# finish() (also called at exit) writes into trace_dir:
+#   <run>.report.json   per span path: calls, total / mean / max seconds; counters; peak and sampled RSS
+#   <run>.trace.json    Chrome trace (chrome://tracing or ui.perfetto.dev): spans per thread, counters, RSS
+# Only the process that called start() records: work sent to process-pool workers is covered by the span
+# around the pool call. Setting PIPELINE_TRACE_DIR enables it for every script without editing them.
+TRACE_DIR_ENV = "PIPELINE_TRACE_DIR"
+
+_recorder = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB."""
+    if sys.platform == "win32":
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024**2
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def rss_mb():
+    """Current resident memory of this process, in MB (the peak so far if it cannot be read)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024**2
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+class _Span:
+    __slots__ = ("recorder", "name", "args", "start")
+
+    def __init__(self, recorder, name, args):
+        self.recorder = recorder
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.recorder._stack().append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        stack = self.recorder._stack()
+        path = "/".join(stack)
+        stack.pop()
+        self.recorder._add_span(path, self.name, self.start, end, self.args)
+        return False
+
+
+class _Recorder:
+    def __init__(self, run_name, trace_dir, memory_interval):
+        self.run_name = run_name
+        self.trace_dir = trace_dir
+        self.origin = time.perf_counter()
+        self.started = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = []
+        self.totals = {}
+        self.counters = {}
+        self.memory = []
+        self.stop_event = threading.Event()
+        self.sampler = None
+        if memory_interval:
+            self.sampler = threading.Thread(target=self._sample_memory, args=(memory_interval,), daemon=True)
+            self.sampler.start()
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _add_span(self, path, name, start, end, args):
+        seconds = end - start
+        event = {"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": seconds * 1e6,
+                 "pid": os.getpid(), "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+            total = self.totals.get(path)
+            if total is None:
+                self.totals[path] = [1, seconds, seconds]
+            else:
+                total[0] += 1
+                total[1] += seconds
+                total[2] = max(total[2], seconds)
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.events.append({"name": name, "ph": "C", "ts": (time.perf_counter() - self.origin) * 1e6,
+                                "pid": os.getpid(), "args": {name: self.counters[name]}})
+
+    def _sample_memory(self, interval):
+        while not self.stop_event.wait(interval):
+            sample = ((time.perf_counter() - self.origin), rss_mb())
+            with self.lock:
+                self.memory.append(sample)
+
+    def write(self):
+        self.stop_event.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        elapsed = time.perf_counter() - self.origin
+        rss = [mb for _, mb in self.memory]
+        report = {
+            "run": self.run_name,
+            "started": self.started,
+            "elapsed_s": elapsed,
+            "spans": {path: {"calls": calls, "total_s": total, "mean_s": total / calls, "max_s": longest}
+                      for path, (calls, total, longest) in sorted(self.totals.items())},
+            "counters": self.counters,
+            "memory": {"peak_rss_mb": peak_rss_mb(), "samples": len(rss),
+                       "max_sampled_rss_mb": max(rss) if rss else None,
+                       "mean_sampled_rss_mb": sum(rss) / len(rss) if rss else None},
+        }
+        memory_events = [{"name": "rss_mb", "ph": "C", "ts": t * 1e6, "pid": os.getpid(), "args": {"rss_mb": mb}}
+                         for t, mb in self.memory]
+        os.makedirs(self.trace_dir, exist_ok=True)
+        report_path = os.path.join(self.trace_dir, f"{self.run_name}.report.json")
+        trace_path = os.path.join(self.trace_dir, f"{self.run_name}.trace.json")
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": self.events + memory_events, "displayTimeUnit": "ms"}, f)
+        return report_path, trace_path
+
+
+# === Public surface ===
+def start(run_name, trace_dir=None, memory_interval=0.5):
+    """
+    Turns recording on for this process if trace_dir (or the PIPELINE_TRACE_DIR variable) is set.
+    Returns True when recording. memory_interval=None disables the RSS sampling thread.
+    """
+    global _recorder
+    trace_dir = trace_dir or os.environ.get(TRACE_DIR_ENV)
+    if not trace_dir or _recorder is not None:
+        return _recorder is not None
+    _recorder = _Recorder(f"{run_name}_{time.strftime('%Y%m%d_%H%M%S')}", trace_dir, memory_interval)
+    atexit.register(finish)
+    return True
+
+
+def enabled():
+    return _recorder is not None
+
+
+def span(name, **args):
+    """Context manager timing a block (no-op while disabled)."""
+    if _recorder is None:
+        return _NULL_SPAN
+    return _Span(_recorder, name, args)
+
+
+def traced(name=None):
+    """Decorator form of span(), named after the function by default."""
+    def decorate(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return function(*args, **kwargs)
+            with _Span(_recorder, label, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    """Adds value to a named counter (no-op while disabled)."""
+    if _recorder is None:
+        return
+    _recorder.count(name, value)
+
+
+def finish(log=print):
+    """Writes the report and the trace and turns recording off. Returns their paths (None if disabled)."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is None:
+        return None
+    paths = recorder.write()
+    log(f"📊 Run report: {paths[0]}  trace: {paths[1]}")
+    return paths
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import span, count
+
+############ Pipeline orchestrator
+# Every scan is a folder; a stage reads declared inputs and writes declared outputs inside it (or absolute paths).
+# Before running a stage its key is computed:
+#   sha256(stage name, version, parameters, commands used, content hash of every input)
+# and compared with the stamp written by its last successful run (<scan>/.pipeline/<stage>.json).
+# Same key and outputs present -> the stage is skipped. Because inputs are hashed by content, a stage reruns
+# exactly when its own parameters changed or one of its upstream stages produced different files.
+# File digests are memoized per scan on (size, mtime) so unchanged multi-GB inputs are not re-read every run.
+STATE_DIR = ".pipeline"
+HASH_MEMO = "file_hashes.json"
+
+# External tools, as argv prefixes. Replace an entry (e.g. with [sys.executable, "stub.py"]) to run without them.
+DEFAULT_COMMANDS = {
+    "colmap": ["colmap"],
+    "train_3dgs": [sys.executable, "gaussian-splatting/train.py"],
+    "train_sugar": [sys.executable, "SuGaR/train_full_pipeline.py"],
+    "gauss_to_pc": [sys.executable, "3DGS-to-PC/gauss_to_pc.py"],
+}
+
+
+class StageError(RuntimeError):
+    pass
+
+
+class Stage:
+    """
+    One step of the DAG.
+    run(scan_dir, params, ctx) does the work; inputs / outputs are paths relative to the scan (or absolute),
+    possibly "{param}" templates; deps are the names of the stages that must run first;
+    commands are the external tools the stage calls (part of its key).
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), deps=(), params=None, commands=(), version=1):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = list(deps)
+        self.params = dict(params or {})
+        self.commands = list(commands)
+        self.version = version
+
+    def paths(self, templates, scan_dir, params):
+        return [os.path.join(scan_dir, t.format(**params)) for t in templates]
+
+
+class RunContext:
+    """What a stage run gets besides its parameters: the command table and a logger."""
+
+    def __init__(self, scan_dir, commands, log):
+        self.scan_dir = scan_dir
+        self.commands = commands
+        self.log = log
+
+    def path(self, *parts):
+        return os.path.join(self.scan_dir, *parts)
+
+    def command(self, name, *args, cwd=None):
+        """Runs an external tool from the command table; raises StageError on a non-zero exit."""
+        argv = list(self.commands[name]) + [str(a) for a in args]
+        self.log(f"$ {' '.join(argv)}")
+        completed = subprocess.run(argv, cwd=cwd or self.scan_dir)
+        if completed.returncode != 0:
+            raise StageError(f"{name} exited with code {completed.returncode}")
+
+
+# === Content hashing ===
+def _file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashMemo:
+    """sha256 of files, memoized on (size, mtime_ns) in <scan>/.pipeline/file_hashes.json."""
+
+    def __init__(self, scan_dir):
+        self.path = os.path.join(scan_dir, STATE_DIR, HASH_MEMO)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = _file_digest(path)
+        with self.lock:
+            self.entries[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        return digest
+
+    def tree(self, path):
+        """Digest of a file, or of a folder (relative names + file digests, sorted); None if missing."""
+        if os.path.isfile(path):
+            return self.file(path)
+        if not os.path.isdir(path):
+            return None
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != STATE_DIR)
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(os.path.relpath(full, path).replace(os.sep, "/").encode())
+                digest.update(self.file(full).encode())
+        return digest.hexdigest()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+
+
+def stage_key(stage, params, commands, input_digests):
+    payload = {
+        "stage": stage.name,
+        "version": stage.version,
+        "params": params,
+        "commands": {name: commands[name] for name in stage.commands},
+        "inputs": input_digests,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _stamp_path(scan_dir, stage):
+    return os.path.join(scan_dir, STATE_DIR, f"{stage.name}.json")
+
+
+def _read_stamp(scan_dir, stage):
+    path = _stamp_path(scan_dir, stage)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_stamp(scan_dir, stage, key, seconds):
+    path = _stamp_path(scan_dir, stage)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"key": key, "seconds": seconds, "finished": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=2)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def topological_order(stages):
+    by_name = {s.name: s for s in stages}
+    order, state = [], {}
+
+    def visit(name):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise StageError(f"Cycle in the pipeline at stage '{name}'")
+        if name not in by_name:
+            raise StageError(f"Unknown stage '{name}'")
+        state[name] = "visiting"
+        for dep in by_name[name].deps:
+            visit(dep)
+        state[name] = "done"
+        order.append(by_name[name])
+
+    for s in stages:
+        visit(s.name)
+    return order
+
+
+# === Running ===
+def run_scan(scan_dir, stages, overrides=None, commands=None, only=None, force=(), dry_run=False, clean=True,
+             log=print):
+    """
+    Runs the stale stages of one scan in dependency order.
+    overrides: {stage name: {param: value}} on top of the stage defaults.
+    only: names of the stages to consider (the others are neither checked nor run);
+    force: stage names to rerun even if current. dry_run: only report what would run.
+    Returns [{stage, status ("skipped" / "ran" / "would run" / "failed" / "blocked"), seconds, key, error}].
+    """
+    commands = {**DEFAULT_COMMANDS, **(commands or {})}
+    overrides = overrides or {}
+    scan_name = os.path.basename(os.path.normpath(scan_dir))
+    memo = HashMemo(scan_dir)
+    report, rerun, failed = [], set(), set()
+
+    def scan_log(message):
+        log(f"[{scan_name}] {message}")
+
+    for stage in topological_order(stages):
+        if only is not None and stage.name not in only:
+            continue
+        params = {**stage.params, **overrides.get(stage.name, {})}
+        entry = {"stage": stage.name, "status": None, "seconds": 0.0, "key": None, "error": None}
+        report.append(entry)
+        if any(dep in failed for dep in stage.deps):
+            entry["status"] = "blocked"
+            failed.add(stage.name)
+            continue
+        if dry_run and any(dep in rerun for dep in stage.deps):
+            # upstream outputs will change: no point hashing the current ones
+            entry["status"] = "would run"
+            rerun.add(stage.name)
+            continue
+
+        inputs = stage.paths(stage.inputs, scan_dir, params)
+        outputs = stage.paths(stage.outputs, scan_dir, params)
+        digests = {os.path.relpath(p, scan_dir).replace(os.sep, "/"): memo.tree(p) for p in inputs}
+        missing = [p for p, d in digests.items() if d is None]
+        key = stage_key(stage, params, commands, digests)
+        entry["key"] = key
+        stamp = _read_stamp(scan_dir, stage)
+        current = (stamp is not None and stamp["key"] == key and all(os.path.exists(p) for p in outputs)
+                   and stage.name not in force)
+        if current:
+            entry["status"] = "skipped"
+            count("stages_skipped")
+            scan_log(f"⏩ {stage.name} is up to date")
+            continue
+        if dry_run:
+            entry["status"] = "would run"
+            rerun.add(stage.name)
+            continue
+        if missing:
+            entry.update(status="failed", error=f"missing inputs: {missing}")
+            failed.add(stage.name)
+            scan_log(f"❌ {stage.name}: missing inputs {missing}")
+            continue
+
+        scan_log(f"▶️ {stage.name}")
+        start = time.perf_counter()
+        try:
+            if clean:
+                for p in outputs:
+                    _remove(p)
+            with span(stage.name, scan=scan_name):
+                stage.run(scan_dir, params, RunContext(scan_dir, commands, scan_log))
+            absent = [p for p in outputs if not os.path.exists(p)]
+            if absent:
+                raise StageError(f"outputs not produced: {absent}")
+        except Exception as e:
+            entry.update(status="failed", seconds=time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+            failed.add(stage.name)
+            scan_log(f"❌ {stage.name} failed: {entry['error']}")
+            continue
+        entry.update(status="ran", seconds=time.perf_counter() - start)
+        count("stages_ran")
+        _write_stamp(scan_dir, stage, key, entry["seconds"])
+        rerun.add(stage.name)
+        scan_log(f"✅ {stage.name} done in {entry['seconds']:.1f}s")
+
+    memo.save()
+    return report
+
+
+def run_scans(scans, stages, overrides=None, commands=None, max_workers=2, only=None, force=(), dry_run=False,
+              clean=True, log=print):
+    """
+    Runs several independent scans concurrently, at most max_workers at a time.
+    scans: {scan_dir: {stage name: {param: value}}} (per-scan overrides) or a list of scan dirs;
+    overrides: {stage name: {param: value}} shared by every scan (per-scan values win).
+    Returns {scan_dir: report of run_scan}.
+    """
+    if not isinstance(scans, dict):
+        scans = {scan_dir: {} for scan_dir in scans}
+    shared = overrides or {}
+
+    def one(item):
+        scan_dir, own = item
+        merged = {name: {**shared.get(name, {}), **(own or {}).get(name, {})} for name in set(shared) | set(own or {})}
+        return scan_dir, run_scan(scan_dir, stages, merged, commands, only, force, dry_run, clean, log)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(pool.map(one, scans.items()))
@@ -0,0 +1,19 @@
+import os
+import sys
+
+############ Import paths of the pipeline
+# The stage folders have spaces in their names, so they are not packages. Entry points (the stage scripts,
+# the orchestrator stages, the benchmarks, the tests) call add_stage_dirs() once; the stage modules then import
+# instrumentation and each other by plain module name, without touching sys.path themselves.
+# Process-pool workers started with "spawn" (Windows) inherit the parent's sys.path.
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGE_DIRS = ["1-Handling the video", "2-2D segmentation", "3-3D reconstruction", "4-Handling the cloud",
+              "5-Getting measurements"]
+
+
+def add_stage_dirs(extra=()):
+    """Puts the pipeline folder, every stage folder (and the extra folders, relative to the pipeline) on sys.path."""
+    for folder in [""] + STAGE_DIRS + list(extra):
+        path = os.path.normpath(os.path.join(PIPELINE_DIR, folder))
+        if path not in sys.path:
+            sys.path.insert(0, path)
@@ -0,0 +1,279 @@
+import os
+import threading
+from orchestrator import Stage, StageError
+from pipeline_paths import add_stage_dirs
+
+############ Stages 1-5 as a DAG for orchestrator.py
+# Layout of a scan folder (all paths relative to it):
+#   video.mp4                -> images/                   1- sharp frames
+#   images/                  -> masks/                    2- GroundingDINO + SAM
+#   images/                  -> database.db, sparse/      3- COLMAP structure-from-motion
+#   images/, sparse/         -> cloud/point_cloud.ply     3- PatchMatch-MVS, 3DGS or SuGaR (+ 3DGS-to-PC)
+#                                                         (MVS: depth maps pruned with masks/ before fusion)
+#   cloud/point_cloud.ply    -> cloud/point_cloud_cleaned.ply    4- tiled outlier removal
+#   cloud/..._cleaned.ply    -> clusters/                 4- HDBSCAN
+#   clusters/, sparse/, masks/ -> clusters_dedup/         4- duplicate fruits dropped
+#   clusters_dedup/, set_fruits.txt, all_fruits.xlsx -> results.xlsx   5- measurements
+# The stage code is imported lazily from the stage folders, so e.g. checking a scan does not load torch.
+
+# SAM's predictor keeps the current image embedding: concurrent scans take turns on the loaded models
+_MODELS_LOCK = threading.Lock()
+_MODELS = {}
+
+
+def _use_stage_modules():
+    add_stage_dirs()
+
+
+# === 1- Sharp frames ===
+def run_frames(scan_dir, p, ctx):
+    _use_stage_modules()
+    import cv2
+    from frame_selection import (group_size, adaptive_blur_threshold, extract_sharp_frames_streaming,
+                                 extract_non_redundant_frames)
+
+    cap = cv2.VideoCapture(ctx.path(p["video"]))
+    if not cap.isOpened():
+        raise StageError(f"Cannot open {p['video']}")
+    output_dir = ctx.path("images")
+    os.makedirs(output_dir, exist_ok=True)
+    N = group_size(cap.get(cv2.CAP_PROP_FPS))
+    threshold = adaptive_blur_threshold(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                        p["base_threshold"])
+    try:
+        if p["extraction_mode"] == "non_redundant":
+            summary = extract_non_redundant_frames(cap, output_dir, N, threshold, min_motion=p["min_motion"],
+                                                   target_frames=p["target_frames"], motion_metric=p["motion_metric"],
+                                                   proxy_scale=p["proxy_scale"])
+        else:
+            summary = extract_sharp_frames_streaming(cap, output_dir, N, threshold, proxy_scale=p["proxy_scale"])
+    finally:
+        cap.release()
+    ctx.log(f"{len(summary['saved'])} frames kept out of {summary['frames_read']}")
+
+
+# === 2- Detection + segmentation ===
+def _segmentation_models(p):
+    key = (p["dino_config"], p["dino_weights"], p["sam_checkpoint"], p["sam_model_type"])
+    if key not in _MODELS:
+        from segment_anything import sam_model_registry, SamPredictor
+        from GroundingDINO.groundingdino.util.inference import load_model
+
+        sam = sam_model_registry[p["sam_model_type"]](checkpoint=p["sam_checkpoint"])
+        sam.to("cpu")
+        _MODELS[key] = (load_model(p["dino_config"], p["dino_weights"]).cpu(), SamPredictor(sam))
+    return _MODELS[key]
+
+
+def run_segmentation(scan_dir, p, ctx):
+    _use_stage_modules()
+    from segmentation_pipeline import run_streaming_pipeline
+
+    images_dir = ctx.path("images")
+    image_files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith((".jpg", ".png", ".jpeg")))
+    with _MODELS_LOCK:
+        dino_model, predictor = _segmentation_models(p)
+        report = run_streaming_pipeline(dino_model, predictor, images_dir, ctx.path("masks"), image_files,
+                                        p["prompt"], p["box_threshold"], p["text_threshold"],
+                                        box_chunk_size=p["box_chunk_size"], mask_format=p["mask_format"],
+                                        resume=False, roi_mode=p["roi_mode"], log=ctx.log)
+    ctx.log(f"{report['masks']} masks on {report['images']} images")
+
+
+# === 3- COLMAP / 3DGS / SuGaR ===
+def run_sfm(scan_dir, p, ctx):
+    os.makedirs(ctx.path("sparse"), exist_ok=True)
+    ctx.command("colmap", "database_creator", "--database_path", "database.db")
+    ctx.command("colmap", "feature_extractor", "--database_path", "database.db", "--image_path", "images",
+                "--ImageReader.single_camera", p["single_camera"], "--SiftExtraction.use_gpu", p["use_gpu"])
+    if p["matcher"] == "pairs":
+        _use_stage_modules()
+        from pair_generation import generate_pairs
+
+        generate_pairs(ctx.path("images"), ctx.path("pairs.txt"), window=p["pair_window"],
+                       cross_per_image=p["pair_cross_per_image"], min_similarity=p["pair_min_similarity"],
+                       log=ctx.log)
+        ctx.command("colmap", "matches_importer", "--database_path", "database.db", "--match_list_path", "pairs.txt",
+                    "--match_type", "pairs", "--SiftMatching.use_gpu", p["use_gpu"])
+    else:
+        ctx.command("colmap", p["matcher"], "--database_path", "database.db", "--SiftMatching.use_gpu", p["use_gpu"])
+    ctx.command("colmap", "mapper", "--database_path", "database.db", "--image_path", "images",
+                "--output_path", "sparse")
+
+
+def run_mvs(scan_dir, p, ctx):
+    os.makedirs(ctx.path("cloud"), exist_ok=True)
+    ctx.command("colmap", "image_undistorter", "--image_path", "images", "--input_path", "sparse/0",
+                "--output_path", "dense", "--output_type", "COLMAP", "--max_image_size", p["max_image_size"])
+    ctx.command("colmap", "patch_match_stereo", "--workspace_path", "dense", "--workspace_format", "COLMAP",
+                "--PatchMatchStereo.geom_consistency", "true")
+    if p["mask_pruning"]:
+        _use_stage_modules()
+        from depth_pruning import prune_workspace
+
+        prune_workspace(ctx.path("dense"), ctx.path("masks"), sparse_dir=ctx.path("sparse/0"),
+                        dilation_px=p["mask_dilation_px"], log=ctx.log)
+    ctx.command("colmap", "stereo_fusion", "--workspace_path", "dense", "--workspace_format", "COLMAP",
+                "--input_type", "geometric", "--output_path", "cloud/point_cloud.ply")
+
+
+def _gaussians_to_cloud(ctx, p, gaussians_ply):
+    os.makedirs(ctx.path("cloud"), exist_ok=True)
+    if p["sampler"] == "native":
+        _use_stage_modules()
+        from gaussian_sampler import gaussians_to_cloud
+
+        report = gaussians_to_cloud(ctx.path(gaussians_ply), ctx.path("cloud/point_cloud.ply"),
+                                    num_points=p["num_points"], min_opacity=p["min_opacity"],
+                                    max_scale=p["max_scale"], roi=p["roi"], log=ctx.log)
+        ctx.log(f"{report['points']:,} points from {report['gaussians_kept']:,} Gaussians")
+        return
+    ctx.command("gauss_to_pc", "--input_path", ctx.path(gaussians_ply), "--output_path", ctx.path("cloud/point_cloud.ply"),
+                "--transform_path", ctx.scan_dir, "--num_points", p["num_points"], "--colour_quality", "high",
+                "--visibility_threshold", p["visibility_threshold"], "--min_opacity", p["min_opacity"],
+                "--clean_pointcloud", "True")
+
+
+def run_3dgs(scan_dir, p, ctx):
+    ctx.command("train_3dgs", "-s", ctx.scan_dir, "-m", ctx.path("gaussians"), "--resolution", 1,
+                "--iterations", p["iterations"], "--opacity_lr", p["opacity_lr"],
+                "--densify_from_iter", p["densify_from_iter"], "--densify_until_iter", p["densify_until_iter"],
+                "--percent_dense", p["percent_dense"])
+    _gaussians_to_cloud(ctx, p, f"gaussians/point_cloud/iteration_{p['iterations']}/point_cloud.ply")
+
+
+def run_sugar(scan_dir, p, ctx):
+    ctx.command("train_sugar", "-s", ctx.scan_dir, "--refinement_time", p["refinement_time"],
+                "--export_ply", "True", "--export_obj", "False")
+    _gaussians_to_cloud(ctx, p, p["gaussians_ply"])
+
+
+# === 4- Cloud ===
+def run_denoise(scan_dir, p, ctx):
+    _use_stage_modules()
+    from outlier_removal import remove_statistical_outlier_tiled
+
+    report, _ = remove_statistical_outlier_tiled(ctx.path("cloud/point_cloud.ply"), ctx.path("cloud/point_cloud_cleaned.ply"),
+                                                 nb_neighbors=p["nb_neighbors"], std_ratio=p["std_ratio"],
+                                                 tile_points=p["tile_points"], num_workers=p["num_workers"])
+    ctx.log(f"{report['kept']} points kept, {report['removed']} removed ({report['points_per_s']:,.0f} points/s)")
+
+
+def run_clustering(scan_dir, p, ctx):
+    _use_stage_modules()
+    import numpy as np
+    from ply_io import read_vertices, xyz
+    from cloud_clustering import cluster_multiresolution, _hdbscan_labels
+    from cluster_store import write_cluster_store
+
+    vertices = read_vertices(ctx.path("cloud/point_cloud_cleaned.ply"))
+    points = xyz(vertices)
+    names = vertices.dtype.names
+    colors = (np.column_stack([vertices[c] for c in ("red", "green", "blue")]) / 255.0
+              if all(c in names for c in ("red", "green", "blue")) else np.zeros_like(points))
+    if p["clustering_mode"] == "full":
+        labels = _hdbscan_labels(points, p["min_cluster_size"])
+    else:
+        tile_size = p["tile_size"]
+        if p["clustering_mode"] == "tiled" and tile_size is None:
+            tile_size = float(np.ptp(points[:, :2], axis=0).max()) / 4
+        labels, _ = cluster_multiresolution(points, p["min_cluster_size"], voxel_size=p["voxel_size"],
+                                            target_points=p["target_points"],
+                                            tile_size=tile_size if p["clustering_mode"] == "tiled" else None,
+                                            num_workers=p["num_workers"])
+    index = write_cluster_store(ctx.path("clusters"), points, colors, labels)
+    ctx.log(f"{len(index['clusters'])} clusters")
+
+
+def run_duplicates(scan_dir, p, ctx):
+    _use_stage_modules()
+    from duplicate_fruits import find_duplicates
+
+    report = find_duplicates(ctx.path("clusters"), ctx.path("sparse/0"), ctx.path("masks"), ctx.path("clusters_dedup"),
+                             distance_factor=p["distance_factor"], max_radius_ratio=p["max_radius_ratio"],
+                             min_views=p["min_views"], confirm_ratio=p["confirm_ratio"], log=ctx.log)
+    ctx.log(f"{report['clusters'] - sum(len(g['dropped']) for g in report['groups'])} clusters without duplicates")
+
+
+# === 5- Measurements ===
+def run_measurements(scan_dir, p, ctx):
+    _use_stage_modules()
+    from cluster_store import read_cluster
+    from sphere_fitting import fit_sphere
+    from measurement_runner import run_measurements as measure, merge_results
+    from ground_truth_store import load_set_table
+
+    # same file as the hashed input "{all_fruits_path}" (relative to the scan, absolute paths kept)
+    df = load_set_table(ctx.path(p["all_fruits_path"]), ctx.path("set_fruits.txt"), log=ctx.log)
+    df["height"] = df["height"] * 0.01
+    df["width"] = df["width"] * 0.01
+    df = df.rename(columns={"avg": "GT_diam"})
+    df["GT_diam"] = df["GT_diam"] * 10
+
+    scaling_label = int(p["scaling_cluster_name"].replace("cluster_", ""))
+    scaling_points, _ = read_cluster(ctx.path(p["clusters"]), scaling_label)
+    _, scaling_radius, _ = fit_sphere(scaling_points, robust=p["sphere_fit_robust"])
+    scaling_factor = p["real_sphere_diameter_mm"] / (2 * scaling_radius)
+
+    results = measure(ctx.path(p["clusters"]), scaling_factor, num_workers=p["num_workers"], robust=p["sphere_fit_robust"],
+                      max_radial_error_mm=p["max_radial_error_mm"], refit_after_filter=p["refit_after_filter"],
+                      log=ctx.log)
+    df, _ = merge_results(df, results)
+    df.to_excel(ctx.path("results.xlsx"), index=False)
+
+
+# === DAG ===
+# Gaussians -> cloud: "native" (gaussian_sampler.py, in this process) or "gauss_to_pc" (external 3DGS-to-PC,
+# which also applies visibility_threshold)
+SAMPLER_PARAMS = {"sampler": "native", "max_scale": None, "roi": None}
+
+
+def build_stages(reconstruction="3dgs"):
+    """Stages 1-5 with their default parameters; reconstruction is "mvs", "3dgs" or "sugar"."""
+    dense_stages = {
+        "mvs": dict(run=run_mvs, commands=["colmap"], outputs=["cloud/point_cloud.ply", "dense"],
+                    inputs=["images", "sparse", "masks"], deps=["sfm", "segmentation"],
+                    params={"max_image_size": 600, "mask_pruning": True, "mask_dilation_px": 5}),
+        "3dgs": dict(run=run_3dgs, commands=["train_3dgs", "gauss_to_pc"], outputs=["cloud/point_cloud.ply", "gaussians"],
+                     params={"iterations": 30000, "opacity_lr": 0.07, "densify_from_iter": 500,
+                             "densify_until_iter": 15000, "percent_dense": 0.02, "num_points": 10_000_000,
+                             "visibility_threshold": 0.08, "min_opacity": 0.05, **SAMPLER_PARAMS}),
+        "sugar": dict(run=run_sugar, commands=["train_sugar", "gauss_to_pc"], outputs=["cloud/point_cloud.ply"],
+                      params={"refinement_time": "long", "gaussians_ply": "output/refined_ply/point_cloud.ply",
+                              "num_points": 10_000_000, "visibility_threshold": 0.08, "min_opacity": 0.05,
+                              **SAMPLER_PARAMS}),
+    }[reconstruction]
+    return [
+        Stage("frames", run_frames, inputs=["{video}"], outputs=["images"],
+              params={"video": "video.mp4", "extraction_mode": "streaming", "base_threshold": 100.0,
+                      "proxy_scale": 1.0, "min_motion": 0.02, "target_frames": None, "motion_metric": "flow"}),
+        Stage("segmentation", run_segmentation, inputs=["images"], outputs=["masks"], deps=["frames"],
+              params={"prompt": "orange . yellow ball .blue colored ball . purple colored ball .",
+                      "box_threshold": 0.25, "text_threshold": 0.25, "box_chunk_size": 4, "mask_format": "msk",
+                      "roi_mode": False,
+                      "dino_config": "GroundingDINO/groundingdino/config/GroundingDINO_SwinT_OGC.py",
+                      "dino_weights": "GroundingDINO/weights/groundingdino_swint_ogc.pth",
+                      "sam_checkpoint": "segment-anything/weights/sam_vit_b_01ec64.pth", "sam_model_type": "vit_b"}),
+        Stage("sfm", run_sfm, inputs=["images"], outputs=["database.db", "sparse"], deps=["frames"],
+              commands=["colmap"],
+              # matcher: a COLMAP matcher ("sequential_matcher", "exhaustive_matcher") or "pairs" (pair_generation.py)
+              params={"single_camera": 1, "use_gpu": 1, "matcher": "sequential_matcher", "pair_window": 10,
+                      "pair_cross_per_image": 3, "pair_min_similarity": 0.5}),
+        Stage(f"dense_{reconstruction}", **{"inputs": ["images", "sparse"], "deps": ["sfm"], **dense_stages}),
+        Stage("denoise", run_denoise, inputs=["cloud/point_cloud.ply"], outputs=["cloud/point_cloud_cleaned.ply"],
+              deps=[f"dense_{reconstruction}"],
+              params={"nb_neighbors": 20, "std_ratio": 0.5, "tile_points": 1_000_000, "num_workers": None}),
+        Stage("clustering", run_clustering, inputs=["cloud/point_cloud_cleaned.ply"], outputs=["clusters"],
+              deps=["denoise"],
+              params={"clustering_mode": "full", "min_cluster_size": 100, "voxel_size": None,
+                      "target_points": 500_000, "tile_size": None, "num_workers": None}),
+        Stage("duplicates", run_duplicates, inputs=["clusters", "sparse", "masks"], outputs=["clusters_dedup"],
+              deps=["clustering", "sfm", "segmentation"],
+              params={"distance_factor": 1.5, "max_radius_ratio": 1.5, "min_views": 3, "confirm_ratio": 0.7}),
+        # clusters: "clusters_dedup" (duplicate fruits dropped) or "clusters" (raw HDBSCAN output)
+        Stage("measurements", run_measurements, inputs=["{clusters}", "set_fruits.txt", "{all_fruits_path}"],
+              outputs=["results.xlsx"], deps=["duplicates"],
+              params={"clusters": "clusters_dedup", "all_fruits_path": "all_fruits.xlsx", "scaling_cluster_name": "cluster_04",
+                      "real_sphere_diameter_mm": 69, "sphere_fit_robust": None, "max_radial_error_mm": 5,
+                      "refit_after_filter": True, "num_workers": None}),
+    ]
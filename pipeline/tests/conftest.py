@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The stage folders are not packages: put them on sys.path once for every test (see pipeline_paths.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_paths import add_stage_dirs
+add_stage_dirs(["benchmarks"])
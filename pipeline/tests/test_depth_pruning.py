@@ -0,0 +1,97 @@
+import os
+import numpy as np
+import pytest
+from colmap_io import read_array, read_array_shape, write_array
+from depth_pruning import DEPTH_DIR, prune_workspace
+from mask_codec import write_masks
+
+W, H = 40, 30
+BOX = (10, 6, 20, 14)  # fruit mask (x0, y0, x1, y1), x1 / y1 exclusive, even so it survives a 2x downscale
+NAMES = ["frame_0000_idx0_score90.jpg", "frame_0001_idx6_score80.jpg", "frame_0002_idx12_score70.jpg"]
+
+
+def write_text_model(model_dir, width, height):
+    # identical pinhole cameras in sparse/0 and dense/sparse: depth pixel (x, y) <-> image pixel (x, y)
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, "cameras.txt"), "w") as f:
+        f.write("# CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n")
+        f.write(f"1 PINHOLE {width} {height} 30 30 {width / 2} {height / 2}\n")
+    with open(os.path.join(model_dir, "images.txt"), "w") as f:
+        f.write("# IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n# POINTS2D[] as (X, Y, POINT3D_ID)\n")
+        for image_id, name in enumerate(NAMES, start=1):
+            f.write(f"{image_id} 1 0 0 0 0 0 0 1 {name}\n\n")
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    dense_dir, masks_dir, sparse_dir = tmp_path / "dense", tmp_path / "masks", tmp_path / "sparse" / "0"
+    os.makedirs(dense_dir / DEPTH_DIR)
+    os.makedirs(masks_dir)
+    write_text_model(sparse_dir, W, H)
+    write_text_model(dense_dir / "sparse", W, H)
+    fruit = np.zeros((H, W), dtype=bool)
+    x0, y0, x1, y1 = BOX
+    fruit[y0:y1, x0:x1] = True
+    # the last image has no mask file
+    for name in NAMES[:2]:
+        write_masks(str(masks_dir / (os.path.splitext(name)[0] + ".msk")), (H, W), [fruit], ["orange"])
+    return dense_dir, masks_dir, sparse_dir
+
+
+def write_depth_maps(dense_dir, shape):
+    depth = np.full(shape, 2.0, dtype=np.float32)
+    depth[0, :5] = 0  # pixels without depth (outside the fruit) are not counted as removed
+    for name in NAMES:
+        for input_type in ("geometric", "photometric"):
+            write_array(str(dense_dir / DEPTH_DIR / f"{name}.{input_type}.bin"), depth)
+    return int(np.count_nonzero(depth))
+
+
+def kept_box(path):
+    ys, xs = np.nonzero(read_array(str(path)) > 0)
+    return int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1, len(xs)
+
+
+def test_prune_with_sparse_models(workspace):
+    dense_dir, masks_dir, sparse_dir = workspace
+    valid = write_depth_maps(dense_dir, (H, W))
+    report = prune_workspace(str(dense_dir), str(masks_dir), sparse_dir=str(sparse_dir), dilation_px=0,
+                             num_workers=2, log=lambda *_: None)
+
+    x0, y0, x1, y1 = BOX
+    fruit_pixels = (x1 - x0) * (y1 - y0)
+    for name in NAMES[:2]:
+        for input_type in ("geometric", "photometric"):
+            assert kept_box(dense_dir / DEPTH_DIR / f"{name}.{input_type}.bin") == (*BOX, fruit_pixels)
+    # no mask: the depth map is left as is
+    assert kept_box(dense_dir / DEPTH_DIR / f"{NAMES[2]}.geometric.bin")[-1] == valid
+
+    assert report["images"] == 3 and report["depth_maps"] == 4
+    assert report["images_without_masks"] == [NAMES[2]]
+    for input_type in ("geometric", "photometric"):
+        assert report[f"{input_type}_valid"] == 2 * valid
+        assert report[f"{input_type}_removed"] == 2 * (valid - fruit_pixels)
+
+    # pruned maps are pruned already
+    again = prune_workspace(str(dense_dir), str(masks_dir), sparse_dir=str(sparse_dir), dilation_px=0,
+                            log=lambda *_: None)
+    assert again["geometric_removed"] == again["photometric_removed"] == 0
+
+
+def test_prune_resized_masks_and_dry_run(workspace):
+    dense_dir, masks_dir, _ = workspace
+    # depth maps at half the image size (--max_image_size), masks resized without the models
+    valid = write_depth_maps(dense_dir, (H // 2, W // 2))
+    path = dense_dir / DEPTH_DIR / f"{NAMES[0]}.geometric.bin"
+    before = path.read_bytes()
+    report = prune_workspace(str(dense_dir), str(masks_dir), dilation_px=0, dry_run=True, log=lambda *_: None)
+    assert path.read_bytes() == before
+
+    x0, y0, x1, y1 = (v // 2 for v in BOX)
+    fruit_pixels = (x1 - x0) * (y1 - y0)
+    assert report["geometric_removed"] == 2 * (valid - fruit_pixels)
+
+    prune_workspace(str(dense_dir), str(masks_dir), dilation_px=1, log=lambda *_: None)
+    assert read_array_shape(str(path)) == (H // 2, W // 2)
+    # a 1 px dilation grows the kept box by one pixel on every side
+    assert kept_box(path)[:4] == (x0 - 1, y0 - 1, x1 + 1, y1 + 1)
@@ -0,0 +1,130 @@
+import os
+import json
+import cv2
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from cluster_store import ClusterStore, write_cluster_store, list_clusters, cluster_name
+from colmap_io import read_model, project_points
+from mask_codec import write_encoded_masks, encode_mask_crop
+from duplicate_fruits import find_duplicates, DUPLICATES_FILE
+from sphere_fitting import fit_sphere
+
+W, H, F = 320, 240, 400
+RADIUS = 0.1
+GHOST = 20          # label of the ghost of fruit 3
+TOUCHING = (0, 12)  # two real fruits side by side
+
+
+def fruit_centers():
+    # 12 fruits around a "tree" (cylinder of radius 2), plus fruit 12 touching fruit 0
+    angles = np.arange(12) * np.pi / 6
+    centers = np.column_stack((2 * np.cos(angles), 2 * np.sin(angles), 1 + 0.5 * (np.arange(12) % 2)))
+    side = np.cross(centers[0] / np.linalg.norm(centers[0]), [0, 0, 1.0])
+    return np.vstack((centers, centers[0] + 2.05 * RADIUS * side))
+
+
+def cap(rng, center, n_points, radius=RADIUS):
+    # the outward-facing part of a fruit, as MVS sees it
+    v = rng.normal(size=(3 * n_points, 3))
+    v /= np.linalg.norm(v, axis=1)[:, None]
+    outward = np.array([center[0], center[1], 0.0]) / np.linalg.norm(center[:2])
+    v = v[v @ outward > -0.2][:n_points]
+    return center + radius * v + rng.normal(0, 0.01 * radius, v.shape)
+
+
+def write_scene(root, centers):
+    sparse_dir, masks_dir = root / "sparse" / "0", root / "masks"
+    os.makedirs(sparse_dir)
+    os.makedirs(masks_dir)
+    lines = []
+    for k in range(16):
+        a = 2 * np.pi * k / 16
+        position = np.array([5 * np.cos(a), 5 * np.sin(a), 1.25])
+        forward = -np.array([np.cos(a), np.sin(a), 0.0])
+        right = np.cross(forward, [0, 0, 1.0])
+        rotation = np.vstack((right, np.cross(forward, right), forward))  # world -> camera
+        qx, qy, qz, qw = Rotation.from_matrix(rotation).as_quat()
+        t = -rotation @ position
+        lines.append(f"{k + 1} {qw} {qx} {qy} {qz} {t[0]} {t[1]} {t[2]} 1 frame_{k:04d}.jpg\n\n")
+    (sparse_dir / "cameras.txt").write_text(f"1 PINHOLE {W} {H} {F} {F} {W / 2} {H / 2}\n")
+    (sparse_dir / "images.txt").write_text("".join(lines))
+
+    # one SAM instance per visible fruit, nearer fruits drawn over farther ones
+    cameras, images = read_model(str(sparse_dir))
+    for image in images.values():
+        x, y, depth = project_points(centers, image, cameras[1])
+        ids = np.full((H, W), -1, dtype=np.int32)
+        for i in np.argsort(-depth):
+            cv2.circle(ids, (int(x[i]), int(y[i])), max(1, int(F * RADIUS / depth[i])), int(i), -1)
+        encoded = []
+        for i in np.unique(ids[ids >= 0]):
+            ys, xs = np.nonzero(ids == i)
+            bbox = (xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+            encoded.append(encode_mask_crop(ids[bbox[1]:bbox[3], bbox[0]:bbox[2]] == i, bbox))
+        name = os.path.splitext(image["name"])[0]
+        write_encoded_masks(str(masks_dir / f"{name}.msk"), (H, W), encoded, ["orange"] * len(encoded))
+    return str(sparse_dir), str(masks_dir)
+
+
+@pytest.fixture(scope="module")
+def scene(tmp_path_factory):
+    root = tmp_path_factory.mktemp("duplicates")
+    rng = np.random.default_rng(0)
+    centers = fruit_centers()
+    sparse_dir, masks_dir = write_scene(root, centers)
+    points, labels = [], []
+    for i, center in enumerate(centers):
+        p = cap(rng, center, 300)
+        points.append(p)
+        labels.append(np.full(len(p), i))
+    # fruit 3 reconstructed a second time, fewer points, one radius away
+    offset = rng.normal(size=3)
+    ghost = cap(rng, centers[3] + RADIUS * offset / np.linalg.norm(offset), 150)
+    points.append(ghost)
+    labels.append(np.full(len(ghost), GHOST))
+    points = np.vstack(points)
+    clusters_dir = str(root / "clusters")
+    write_cluster_store(clusters_dir, points, np.zeros_like(points), np.concatenate(labels))
+    return root, clusters_dir, sparse_dir, masks_dir
+
+
+def folder_bytes(folder):
+    return {name: open(os.path.join(folder, name), "rb").read() for name in sorted(os.listdir(folder))}
+
+
+def test_ghost_dropped_best_cluster_kept(scene):
+    root, clusters_dir, sparse_dir, masks_dir = scene
+    before = folder_bytes(clusters_dir)
+    output_dir = str(root / "clusters_dedup")
+    report = find_duplicates(clusters_dir, sparse_dir, masks_dir, output_dir, num_workers=2, log=lambda *_: None)
+
+    assert report["clusters"] == 14 and report["views"] == 16
+    # the touching pair is a candidate but the masks keep the two fruits apart
+    assert report["candidates"] >= 2
+    assert [(g["kept"], g["dropped"]) for g in report["groups"]] == [(cluster_name(3), [cluster_name(GHOST)])]
+
+    # the input clusters are an upstream output: untouched, the report goes to the output folder
+    assert folder_bytes(clusters_dir) == before
+    with open(os.path.join(output_dir, DUPLICATES_FILE)) as f:
+        duplicates = json.load(f)
+    assert duplicates["groups"] == report["groups"]
+    assert any(set(p["clusters"]) == {cluster_name(i) for i in TOUCHING} and not p["duplicate"]
+               for p in duplicates["pairs"])
+
+    # the kept fruit keeps exactly its own points (no pooling with the ghost, no diameter bias)
+    assert GHOST not in list_clusters(output_dir)
+    assert list_clusters(output_dir) == list(range(13))
+    kept = ClusterStore(output_dir).points(3)
+    assert np.array_equal(kept, ClusterStore(clusters_dir).points(3))
+    _, radius, _ = fit_sphere(np.asarray(kept, dtype=np.float64))
+    assert abs(radius - RADIUS) < 0.01 * RADIUS
+
+
+def test_flag_only(scene):
+    root, clusters_dir, sparse_dir, masks_dir = scene
+    output_dir = str(root / "flagged")
+    report = find_duplicates(clusters_dir, sparse_dir, masks_dir, output_dir, drop_duplicates=False,
+                             log=lambda *_: None)
+    assert [g["dropped"] for g in report["groups"]] == [[cluster_name(GHOST)]]
+    assert os.listdir(output_dir) == [DUPLICATES_FILE]
@@ -0,0 +1,46 @@
+import threading
+import numpy as np
+from frame_selection import iter_group_winners
+
+
+class FakeCapture:
+    # cap.read() stand-in: num_frames frames of growing sharpness, then raises if fail_at is set
+    def __init__(self, num_frames, fail_at=None):
+        self.num_frames, self.fail_at, self.index = num_frames, fail_at, 0
+        self.rng = np.random.default_rng(0)
+
+    def read(self):
+        if self.index == self.fail_at:
+            raise OSError("corrupt packet")
+        if self.index == self.num_frames:
+            return False, None
+        noise = self.rng.integers(0, 1 + 10 * self.index, size=(24, 32, 3))
+        self.index += 1
+        return True, noise.astype(np.uint8)
+
+
+def winners(cap, **kwargs):
+    return [(i, round(score, 6)) for i, _, score in iter_group_winners(cap, 3, num_workers=2, **kwargs)]
+
+
+def test_group_winners():
+    # frames get sharper: the last frame of every complete group wins, the trailing partial group is dropped
+    stats = {}
+    assert [i for i, _ in winners(FakeCapture(8), stats=stats)] == [2, 5]
+    assert stats["frames_read"] == 8
+
+
+def test_decode_error_reaches_the_caller():
+    result = {}
+
+    def consume():
+        try:
+            winners(FakeCapture(20, fail_at=7), queue_size=1)
+        except OSError as e:
+            result["error"] = e
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    consumer.join(timeout=10)
+    assert not consumer.is_alive(), "the consumer waits forever on the frame queue"
+    assert str(result["error"]) == "corrupt packet"
@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+import pytest
+from ground_truth_store import load_ground_truth, load_set_table
+
+
+@pytest.fixture
+def mixed_id_sheet(tmp_path):
+    # ids typed as numbers in some rows and as text in others, decimal commas, a mixed free-text column
+    path = tmp_path / "all_fruits.xlsx"
+    pd.DataFrame({
+        "id": [12, "A7", 3, "b2"],
+        "height": ["5,5", 6, "7,25", 8],
+        "width": [1, 2, 3, 4],
+        "avg": ["1,5", 2, 3, 4],
+        "note": ["x", 1, None, "y"],
+    }).to_excel(path, index=False)
+    return path
+
+
+def test_mixed_type_ids_are_cached(mixed_id_sheet):
+    logs = []
+    first = load_ground_truth(mixed_id_sheet, log=logs.append)
+    cache_files = sorted(os.listdir(mixed_id_sheet.parent))
+    assert any(name.startswith("all_fruits.gt.") and name != "all_fruits.gt.json" for name in cache_files)
+    assert len(logs) == 1
+
+    second = load_ground_truth(mixed_id_sheet, log=logs.append)
+    assert len(logs) == 1  # served from the cache
+    assert second.index.tolist() == ["12", "a7", "3", "b2"]
+    assert second["id"].tolist() == ["12", "A7", "3", "b2"]
+    assert second["height"].tolist() == [5.5, 6.0, 7.25, 8.0]
+    pd.testing.assert_frame_equal(first, second, check_dtype=False)
+
+
+def test_set_table_resolves_mixed_ids(mixed_id_sheet, tmp_path):
+    set_path = tmp_path / "set_fruits.txt"
+    set_path.write_text("c1 : 12\nc2 : a7\nc3 : 99\n", encoding="utf-8")
+    logs = []
+    table = load_set_table(mixed_id_sheet, set_path, log=logs.append)
+    assert table["cluster_name"].tolist() == ["c1", "c2"]
+    assert table["avg"].tolist() == [1.5, 2.0]
+    assert any("99" in line for line in logs)
@@ -0,0 +1,40 @@
+import numpy as np
+import measurement_runner
+from cluster_store import write_cluster_store
+from measurement_runner import run_measurements
+
+RADIUS = 30.0   # mm
+POISON = 77     # points of the cluster whose visibility raises
+
+
+def sphere(rng, n_points, center):
+    v = rng.normal(size=(n_points, 3))
+    return center + RADIUS * v / np.linalg.norm(v, axis=1)[:, None]
+
+
+def test_failing_cluster_does_not_fail_its_chunk(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    clusters = [sphere(rng, 200, [0, 0, 0]), sphere(rng, POISON, [100, 0, 0]), sphere(rng, 3, [200, 0, 0]),
+                sphere(rng, 200, [300, 0, 0])]
+    points = np.vstack(clusters)
+    labels = np.repeat(np.arange(len(clusters)), [len(c) for c in clusters])
+    write_cluster_store(str(tmp_path), points, np.zeros_like(points), labels)
+
+    estimate_visibility = measurement_runner.estimate_visibility
+
+    def flaky_visibility(centers, radii, point_sets, **kwargs):
+        if any(len(p) == POISON for p in point_sets):
+            raise FloatingPointError("bad cluster")
+        return estimate_visibility(centers, radii, point_sets, **kwargs)
+
+    monkeypatch.setattr(measurement_runner, "estimate_visibility", flaky_visibility)
+    results = run_measurements(str(tmp_path), 1.0, num_workers=1, log=lambda *_: None).set_index("cluster_name")
+
+    # the other clusters of the chunk are still measured
+    assert results["status"].tolist() == ["ok", "error", "error", "ok"]
+    assert np.allclose(results.loc[[0, 3], "predicted_diam"], 2 * RADIUS)
+    assert results.loc[1, "error_stage"] == "visibility"
+    assert results.loc[1, "error"] == "FloatingPointError: bad cluster"
+    # a too small cluster says why, with its own point count
+    assert results.loc[2, "error_stage"] == "fit"
+    assert results.loc[2, "error"] == "ValueError: 3 points, fewer than the 4 a sphere needs"
@@ -0,0 +1,161 @@
+import os
+import sys
+import pytest
+import orchestrator
+from orchestrator import Stage, run_scan
+
+# Stand-in for an external tool: upper-cases a text file, exits with 3 on "fail"
+STUB = """
+import sys
+text = open(sys.argv[1]).read().strip()
+if text == "fail":
+    sys.exit(3)
+open(sys.argv[2], "w").write(text.upper())
+"""
+
+
+@pytest.fixture
+def stub_tool(tmp_path, monkeypatch):
+    stub_path = tmp_path / "stub_tool.py"
+    stub_path.write_text(STUB)
+    monkeypatch.setitem(orchestrator.DEFAULT_COMMANDS, "tool", [sys.executable, str(stub_path)])
+    return stub_path
+
+
+@pytest.fixture
+def scan(tmp_path):
+    scan_dir = tmp_path / "scan"
+    scan_dir.mkdir()
+    (scan_dir / "raw.txt").write_text("hello")
+    return scan_dir
+
+
+def make_stages(calls):
+    # raw.txt -(tool)-> a.txt -> b.txt -> c.txt
+    def run_a(scan_dir, p, ctx):
+        calls.append("a")
+        ctx.command("tool", "raw.txt", "a.txt")
+
+    def run_b(scan_dir, p, ctx):
+        calls.append("b")
+        with open(ctx.path("a.txt")) as f, open(ctx.path("b.txt"), "w") as out:
+            out.write(f.read() + p["suffix"])
+
+    def run_c(scan_dir, p, ctx):
+        calls.append("c")
+        with open(ctx.path("b.txt")) as f, open(ctx.path("c.txt"), "w") as out:
+            out.write(f"{len(f.read())}")
+
+    return [
+        Stage("c", run_c, inputs=["b.txt"], outputs=["c.txt"], deps=["b"]),
+        Stage("a", run_a, inputs=["raw.txt"], outputs=["a.txt"], commands=["tool"]),
+        Stage("b", run_b, inputs=["a.txt"], outputs=["b.txt"], deps=["a"], params={"suffix": "!"}),
+    ]
+
+
+def statuses(report):
+    return {entry["stage"]: entry["status"] for entry in report}
+
+
+def run(scan_dir, stages, **kwargs):
+    return statuses(run_scan(str(scan_dir), stages, log=lambda *_: None, **kwargs))
+
+
+def test_up_to_date_stages_are_skipped(stub_tool, scan):
+    calls = []
+    stages = make_stages(calls)
+    assert run(scan, stages) == {"a": "ran", "b": "ran", "c": "ran"}
+    assert calls == ["a", "b", "c"]  # dependency order, whatever the list order
+    assert (scan / "b.txt").read_text() == "HELLO!"
+    assert all((scan / orchestrator.STATE_DIR / f"{name}.json").exists() for name in "abc")
+
+    assert run(scan, stages) == {"a": "skipped", "b": "skipped", "c": "skipped"}
+    assert calls == ["a", "b", "c"]
+    assert run(scan, stages, dry_run=True) == {"a": "skipped", "b": "skipped", "c": "skipped"}
+
+    # a missing output makes its stage stale even with the same key
+    os.remove(scan / "c.txt")
+    assert run(scan, stages) == {"a": "skipped", "b": "skipped", "c": "ran"}
+
+
+def test_changed_input_reruns_downstream(stub_tool, scan):
+    calls = []
+    stages = make_stages(calls)
+    run(scan, stages)
+
+    (scan / "raw.txt").write_text("world")
+    assert run(scan, stages, dry_run=True) == {"a": "would run", "b": "would run", "c": "would run"}
+    assert run(scan, stages) == {"a": "ran", "b": "ran", "c": "ran"}
+    assert (scan / "b.txt").read_text() == "WORLD!"
+
+    # inputs are hashed by content: a new raw.txt giving the same a.txt stops the rerun at a
+    (scan / "raw.txt").write_text("world\n")
+    assert run(scan, stages) == {"a": "ran", "b": "skipped", "c": "skipped"}
+
+
+def test_changed_param_or_command_reruns(stub_tool, scan):
+    calls = []
+    stages = make_stages(calls)
+    run(scan, stages)
+
+    assert run(scan, stages, overrides={"b": {"suffix": "?!"}}) == {"a": "skipped", "b": "ran", "c": "ran"}
+    assert (scan / "c.txt").read_text() == "7"
+    # back to the default: b's key differs from its last stamp again
+    assert run(scan, stages) == {"a": "skipped", "b": "ran", "c": "ran"}
+
+    # a different tool (command table) is part of the key of the stages using it
+    commands = {"tool": [sys.executable, "-X", "utf8", str(stub_tool)]}
+    assert run(scan, stages, commands=commands) == {"a": "ran", "b": "skipped", "c": "skipped"}
+    # back to the default tool (a reruns); force reruns c although b.txt did not change
+    assert run(scan, stages, force=("c",)) == {"a": "ran", "b": "skipped", "c": "ran"}
+
+
+def test_failure_blocks_dependents(stub_tool, scan):
+    calls = []
+    stages = make_stages(calls)
+    (scan / "raw.txt").write_text("fail")
+    report = run_scan(str(scan), stages, log=lambda *_: None)
+    assert statuses(report) == {"a": "failed", "b": "blocked", "c": "blocked"}
+    assert "exited with code 3" in report[0]["error"]
+    assert calls == ["a"]
+    assert not (scan / orchestrator.STATE_DIR / "a.json").exists()
+
+    # a failed stage is retried on the next run
+    (scan / "raw.txt").write_text("fixed")
+    assert run(scan, stages) == {"a": "ran", "b": "ran", "c": "ran"}
+
+
+def test_missing_input_fails_without_running(stub_tool, scan):
+    calls = []
+    os.remove(scan / "raw.txt")
+    assert run(scan, make_stages(calls)) == {"a": "failed", "b": "blocked", "c": "blocked"}
+    assert calls == []
+
+
+@pytest.mark.parametrize("reconstruction", ["mvs", "3dgs", "sugar"])
+def test_pipeline_dag_dry_run(tmp_path, reconstruction):
+    from pipeline_stages import build_stages
+    stages = build_stages(reconstruction)
+    order = [stage.name for stage in orchestrator.topological_order(stages)]
+    assert order[0] == "frames" and order[-1] == "measurements"
+    # a dry run on an empty scan plans every stage without running (or importing) any stage code
+    assert set(run(tmp_path, stages, dry_run=True).values()) == {"would run"}
+
+
+def test_measurements_read_the_hashed_ground_truth(tmp_path, monkeypatch):
+    import ground_truth_store
+    from pipeline_stages import build_stages
+    read = []
+
+    def load_set_table(all_fruits_path, set_fruits_txt_path, cache_dir=None, log=print):
+        read.append(all_fruits_path)
+        raise RuntimeError("stop after the ground truth")
+
+    monkeypatch.setattr(ground_truth_store, "load_set_table", load_set_table)
+    monkeypatch.chdir(tmp_path)
+    stage = {s.name: s for s in build_stages("mvs")}["measurements"]
+    scan_dir = str(tmp_path / "scan")
+    [hashed] = [p for p in stage.paths(stage.inputs, scan_dir, stage.params) if p.endswith(".xlsx")]
+    with pytest.raises(RuntimeError, match="stop after"):
+        stage.run(scan_dir, stage.params, orchestrator.RunContext(scan_dir, {}, lambda *_: None))
+    assert read == [hashed]
@@ -0,0 +1,48 @@
+import numpy as np
+import torch
+from mask_codec import encoded_iou
+from sam_inference import segment_boxes
+
+H, W = 96, 128
+BOXES = np.array([[10, 10, 40, 30], [50, 20, 90, 70], [0, 60, 30, 96], [70, 0, 128, 18], [30, 40, 60, 80],
+                  [95, 50, 125, 90], [12, 34, 44, 58]])
+
+
+class IdentityTransform:
+    def apply_boxes(self, boxes, original_size):
+        return np.asarray(boxes, dtype=np.float64)
+
+
+class FakePredictor:
+    # SamPredictor stand-in: an ellipse inscribed in every box. Like SAM's batched kernels, a batch of more
+    # than one box rounds differently (+1e-7), which flips the edge pixels whose logit rounds to about 0.
+    original_size = (H, W)
+    device = "cpu"
+    transform = IdentityTransform()
+
+    def predict_torch(self, point_coords, point_labels, boxes, multimask_output):
+        y, x = torch.meshgrid(torch.arange(H, dtype=torch.float32), torch.arange(W, dtype=torch.float32),
+                              indexing="ij")
+        x0, y0, x1, y1 = (boxes[:, i, None, None] for i in range(4))
+        logits = 1 - ((2 * x - x0 - x1) / (x1 - x0)) ** 2 - ((2 * y - y0 - y1) / (y1 - y0)) ** 2
+        if len(boxes) > 1:
+            logits = logits + 1e-7
+        masks = logits > 0
+        scores = logits.amax(dim=(1, 2))
+        return masks[:, None], scores[:, None], logits[:, None]
+
+
+def test_chunked_masks_match_per_box_up_to_rounding():
+    predictor = FakePredictor()
+    per_box, per_box_scores = segment_boxes(predictor, BOXES, chunk_size=1)
+    chunked, chunked_scores = segment_boxes(predictor, BOXES, chunk_size=3)
+
+    assert len(chunked) == len(per_box) == len(BOXES)
+    assert np.allclose(chunked_scores, per_box_scores, rtol=0, atol=1e-5)
+    flipped = 0
+    for a, b in zip(chunked, per_box):
+        # same box order, and only edge pixels differ
+        assert max(abs(u - v) for u, v in zip(a[0], b[0])) <= 1
+        assert encoded_iou(a, b) >= 0.95
+        flipped += int(a[1][:, 1].sum()) - int(b[1][:, 1].sum())
+    assert flipped > 0
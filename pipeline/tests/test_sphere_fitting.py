@@ -0,0 +1,19 @@
+import numpy as np
+from sphere_fitting import fit_spheres
+from synthetic_data import partial_sphere
+
+
+def test_ransac_default_threshold_rejects_outliers():
+    # caps of 30-45 mm fruits with 30% of leaf / neighbour points, fitted with the callers' defaults
+    rng = np.random.default_rng(0)
+    true_radii = rng.uniform(30, 45, size=40)
+    clusters = [partial_sphere(rng, rng.uniform(-500, 500, size=3), r, 1500, rng.uniform(0.15, 0.6), 0.5, 0.3)
+                for r in true_radii]
+    _, lsq, _ = fit_spheres(clusters)
+    _, ransac, inliers = fit_spheres(clusters, robust="ransac")
+
+    lsq_error, ransac_error = np.abs(lsq - true_radii), np.abs(ransac - true_radii)
+    assert np.median(lsq_error) > 2.0
+    assert np.median(ransac_error) < 0.1 and ransac_error.max() < 1.0
+    # the blob points (the last 30% of every cluster) are outliers, but for the few lying on the sphere
+    assert all(mask[-450:].mean() < 0.15 and mask[:-450].mean() > 0.9 for mask in inliers)